@@ -1,6 +1,10 @@
 from bottle import request
 
+from . import responses
+
 _endpoints = {}
+# endpoints with responses that only change when the page version changes
+_versioned = set()
 
 
 def _route(method, path):
@@ -16,19 +20,37 @@ put = (lambda path: _route('PUT', path))
 delete = (lambda path: _route('DELETE', path))
 
 
+def versioned(fn):
+    _versioned.add(fn.__name__)
+    return fn
+
+
 class API(object):
 
-    def __init__(self, registry, encoder, message_handler):
+    def __init__(self, registry, encoder, message_handler, ws_server, get_version, etag_token):
         self._prefix = '/api'
         self._registry = registry
         self._encoder = encoder
         self._message_handler = message_handler
+        self._ws_server = ws_server
+        self._get_version = get_version
+        self._etag_token = etag_token
 
     def _callback_wrapper(self, callback):
+        is_versioned = callback.__name__ in _versioned
+
         def wrapper(*args, **kwargs):
             request.content_type = 'application/json'
+            encoding = responses.content_encoding()
+            etag = None
+            if is_versioned:
+                etag = responses.make_etag(self._etag_token, self._get_version(), encoding)
+                if responses.etag_matches(etag):
+                    return responses.not_modified(etag)
             result = callback(*args, **kwargs)
-            return self._encoder.to_json(result)
+            body, encoding = responses.compress(self._encoder.to_json_bytes(result), encoding)
+            responses.set_headers(etag, encoding)
+            return body
         return wrapper
 
     def register(self, app):
@@ -41,7 +63,12 @@ class API(object):
     def _status(self):
         return {'status': 'alive'}
 
+    @get('/connections')
+    def _get_connections(self):
+        return {'connections': self._ws_server.get_stats()}
+
     @get('/elements')
+    @versioned
     def _get_elements(self):
         query = request.query
         include_data = query.get('include_data', '').lower() == 'true'
@@ -54,6 +81,7 @@ class API(object):
         }
 
     @get('/elements/<element_id>')
+    @versioned
     def _get_element(self, element_id, include_data=True, include_props=True):
         e = self._registry.elements[element_id]
         result = {
@@ -63,7 +91,7 @@ class API(object):
             'parent_id': e.parent.id if e.parent else None,
             'index': e.index,
             'children_ids': [c.id for c in e.children],
-            'prop_children': e._prop_children
+            'prop_children': e.prop_children
         }
         if include_data:
             result['data'] = e.data
@@ -144,10 +172,12 @@ class API(object):
         return {'id': element_id, 'status': 'success'}
 
     @get('/variables')
+    @versioned
     def _get_variables(self):
         return {'variables': self._registry.get_variables()}
 
     @get('/variables/<variable_id>')
+    @versioned
     def _get_variable(self, variable_id):
         return self._registry.variables[variable_id].get_variable()
 
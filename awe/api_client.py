@@ -27,6 +27,12 @@ class APIClient(object):
         """
         return self._request('GET', '/status')
 
+    def get_connections(self):
+        """
+        Get stats of all open websocket connections, keyed by client id.
+        """
+        return self._request('GET', '/connections')['connections']
+
     def get_elements(self, include_data=False, include_props=False):
         """
         Get all elements currently registered.
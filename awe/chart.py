@@ -222,8 +222,9 @@ transformer_classes = {t.key: t for t in [
 @builtin
 class Chart(Element):
 
+    __slots__ = ('_transformer',)
+
     allow_children = False
-    _transformer = None
 
     def _init(self, data=None, options=None, transform=None, moving_window=None):
         self.transformer = transform
@@ -1,4 +1,7 @@
-from six import StringIO, string_types
+import hashlib
+import threading
+
+from six import StringIO, string_types, text_type
 
 
 class CustomComponentHandler(object):
@@ -6,15 +9,42 @@ class CustomComponentHandler(object):
     def __init__(self, registry, encoder):
         self.registry = registry
         self.encoder = encoder
+        self._lock = threading.Lock()
+        self._cache_key = None
+        self._cached = None
 
     def combined_script_with_script_tag(self):
         result = StringIO()
-        result.write('<script type="text/babel">\n')
+        result.write('<script>\n')
         result.write(self.combined_script())
         result.write('</script>\n')
         return result.getvalue()
 
     def combined_script(self):
+        return self.combined_script_with_hash()[0]
+
+    def combined_script_hash(self):
+        return self.combined_script_with_hash()[1]
+
+    def combined_script_with_hash(self):
+        """
+        The combined script is only rebuilt when the registered element types change.
+
+        :return: A ``(script, script_hash)`` tuple.
+        """
+        element_types = self.registry.element_types
+        key = tuple(sorted((name, id(element_type)) for name, element_type in list(element_types.items())))
+        with self._lock:
+            if key != self._cache_key:
+                script = self._build_combined_script()
+                self._cached = (script, content_hash(script))
+                self._cache_key = key
+            return self._cached
+
+    def _build_combined_script(self):
+        # The script is plain javascript, that may run before the client is loaded, so it queues a setup function
+        # that is called by the client once it is. Component sources are transpiled by the client, and the result
+        # is cached by the client using the source hash.
         result = StringIO()
         scripts = {}
         styles = {}
@@ -26,17 +56,25 @@ class CustomComponentHandler(object):
             for script in element_type._scripts:
                 script = self._get_script_def(script)
                 scripts[script['src']] = script
+        if not element_types:
+            return ''
+        result.write('(window.aweComponentQueue = window.aweComponentQueue || []).push(function (Awe) {\n')
         for style in styles.values():
-            result.write('Awe.addStyle({});\n'.format(self.encoder.to_json(style)))
+            result.write('Awe.addStyle({});\n'.format(self._to_script_json(style)))
         for script in scripts.values():
-            result.write('Awe.addScript({});\n'.format(self.encoder.to_json(script)))
+            result.write('Awe.addScript({});\n'.format(self._to_script_json(script)))
         for name, element_type in element_types.items():
-            result.write('Awe.onScriptsLoaded(() => ((register) => {{{}}})((fn) => Awe.register("{}", fn)));\n'
-                         .format(element_type._js(), name))
-        if element_types:
-            result.write('Awe.scriptSetupDone();\n')
+            component = component_definition(name, element_type)
+            result.write('Awe.onScriptsLoaded(function () {{ Awe.registerComponent({}); }});\n'
+                         .format(self._to_script_json(component)))
+        result.write('Awe.scriptSetupDone();\n')
+        result.write('});\n')
         return result.getvalue()
 
+    def _to_script_json(self, obj):
+        # the script may be inlined in a script tag
+        return self.encoder.to_json(obj).replace('<', '\\u003c')
+
     @staticmethod
     def _get_style_def(style):
         if isinstance(style, string_types):
@@ -50,3 +88,25 @@ class CustomComponentHandler(object):
             script = {'src': script}
         script.setdefault('type', 'text/javascript')
         return script
+
+
+def component_definition(name, element_type):
+    source = element_type._js() or ''
+    return {'name': name, 'hash': content_hash(source), 'source': source}
+
+
+def register_component_action(name, element_type):
+    """
+    :return: An action that registers a custom element type on clients that are already loaded.
+    """
+    return {
+        'type': 'registerComponent',
+        'component': component_definition(name, element_type),
+        'scripts': [CustomComponentHandler._get_script_def(script) for script in element_type._scripts],
+        'styles': [CustomComponentHandler._get_style_def(style) for style in element_type._styles]
+    }
+
+
+def content_hash(content):
+    content = content.encode('utf-8') if isinstance(content, text_type) else content
+    return hashlib.sha1(content).hexdigest()[:16]
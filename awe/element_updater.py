@@ -10,6 +10,8 @@ else:
 
 class Updater(object):
 
+    __slots__ = ('element', 'updater')
+
     def __init__(self, element, updater):
         self.element = element
         self.updater = updater
@@ -1,35 +1,243 @@
 import collections
+import itertools
 import json
 
+import six
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import enum
+    import uuid
+
+    import orjson
+    # orjson serializes these types itself even with the passthrough options, without calling custom serializers
+    ORJSON_NATIVE_TYPES = (enum.Enum, uuid.UUID)
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+    # older ujson versions don't support custom serializers
+    ujson.dumps(None, default=None)
+except (ImportError, TypeError):
+    ujson = None
+
+JSON = 'json'
+MSGPACK = 'msgpack'
+
+# the approximate size of chunks of JSON encoded in chunks (see ``Encoder.iter_json``)
+JSON_CHUNK_SIZE = 64 * 1024
+# the number of items of containers of scalars encoded at once, while encoding JSON in chunks
+JSON_SLICE_SIZE = 1000
+
+# datetimes and dataclasses are passed to custom serializers, like in other backends. subclasses of builtin types
+# aren't, since the other backends encode them as their base type too
+ORJSON_OPTIONS = orjson and (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME |
+                             orjson.OPT_PASSTHROUGH_DATACLASS)
+
+AUTO = 'auto'
+STDLIB = 'json'
+ORJSON = 'orjson'
+UJSON = 'ujson'
+
 
 class JSONEncoder(json.JSONEncoder):
 
     def __init__(self, serializers):
         super(JSONEncoder, self).__init__(separators=(',', ':'))
         self.serializers = serializers
+        self.serializers_cache = {}
 
     def default(self, o):
-        for cls, serializer in self.serializers.items():
-            if isinstance(o, cls):
-                return serializer(o)
+        serializer = self.get_serializer(type(o))
+        if serializer:
+            return serializer(o)
         return super(JSONEncoder, self).default(o)
 
+    def get_serializer(self, cls):
+        try:
+            return self.serializers_cache[cls]
+        except KeyError:
+            pass
+        result = None
+        for serializer_cls, serializer in self.serializers.items():
+            if issubclass(cls, serializer_cls):
+                result = serializer
+                break
+        self.serializers_cache[cls] = result
+        return result
+
 
 def element_serializer(element):
     return {'_awe_root_': element.root_id}
 
 
+def get_json_backend(json_backend, serializers=None):
+    """
+    :param serializers: Custom serializers, orjson isn't used when it would ignore any of them.
+    """
+    serialized_by_orjson = orjson and any(issubclass(cls, ORJSON_NATIVE_TYPES) for cls in serializers or {})
+    if json_backend == ORJSON and serialized_by_orjson:
+        return STDLIB
+    if json_backend in [None, AUTO]:
+        if orjson and not serialized_by_orjson:
+            return ORJSON
+        if ujson:
+            return UJSON
+        return STDLIB
+    if json_backend == ORJSON and not orjson:
+        raise ImportError('orjson is not installed')
+    if json_backend == UJSON and not ujson:
+        raise ImportError('ujson (>=2.0) is not installed')
+    assert json_backend in [STDLIB, ORJSON, UJSON]
+    return json_backend
+
+
+def is_flat(values):
+    """
+    :return: Whether none of ``values`` is a container, or a callable that builds one lazily.
+    """
+    return not any(isinstance(v, (dict, list, tuple, collections.deque)) or callable(v) for v in values)
+
+
 class Encoder(object):
 
-    def __init__(self, element_cls, serializers):
+    def __init__(self, element_cls, serializers, json_backend=None):
         serializers = serializers or {}
         serializers.setdefault(collections.deque, list)
         serializers.setdefault(element_cls, element_serializer)
         self._json_encoder = JSONEncoder(serializers)
+        self.json_backend = get_json_backend(json_backend, serializers)
+        self.formats = [MSGPACK, JSON] if msgpack else [JSON]
 
     def to_json(self, obj):
-        return self._json_encoder.encode(obj)
+        result = self._fast_to_json(obj)
+        if result is None:
+            return self._json_encoder.encode(obj)
+        return result.decode('utf-8')
+
+    def to_json_bytes(self, obj):
+        result = self._fast_to_json(obj)
+        if result is None:
+            return self._json_encoder.encode(obj).encode('utf-8')
+        return result
+
+    def iter_json(self, obj, chunk_size=JSON_CHUNK_SIZE):
+        """
+        Encode ``obj`` to JSON in chunks, so large objects can be streamed without holding their full encoding
+        in memory.
+
+        :param obj: The object to encode. Callables are called to get the value to encode, so values can be
+                    built lazily and released once encoded.
+        :param chunk_size: Small values are encoded together, into chunks of about this number of characters.
+        """
+        pending = []
+        pending_size = 0
+        for chunk in self._iter_json(obj):
+            pending.append(chunk)
+            pending_size += len(chunk)
+            if pending_size >= chunk_size:
+                yield ''.join(pending)
+                pending = []
+                pending_size = 0
+        if pending:
+            yield ''.join(pending)
+
+    def _iter_json(self, obj):
+        # containers are streamed item by item, down to containers of scalars (e.g. table rows or chart series),
+        # which are encoded JSON_SLICE_SIZE items at a time
+        if callable(obj):
+            obj = obj()
+        if isinstance(obj, dict):
+            if len(obj) <= JSON_SLICE_SIZE and is_flat(obj.values()):
+                yield self.to_json(obj)
+                return
+            yield '{'
+            for i, (key, value) in enumerate(obj.items()):
+                if not isinstance(key, six.string_types):
+                    key = self.to_json(key)
+                yield '{}{}:'.format(',' if i else '', self.to_json(key))
+                for chunk in self._iter_json(value):
+                    yield chunk
+            yield '}'
+        elif isinstance(obj, (list, tuple, collections.deque)):
+            yield '['
+            if is_flat(obj):
+                items = iter(obj)
+                for i, values in enumerate(iter(lambda: list(itertools.islice(items, JSON_SLICE_SIZE)), [])):
+                    if i:
+                        yield ','
+                    yield self.to_json(values)[1:-1]
+            else:
+                for i, value in enumerate(obj):
+                    if i:
+                        yield ','
+                    for chunk in self._iter_json(value):
+                        yield chunk
+            yield ']'
+        else:
+            yield self.to_json(obj)
+
+    def _fast_to_json(self, obj):
+        # a None result means the standard library encoder should be used
+        try:
+            if self.json_backend == ORJSON:
+                return orjson.dumps(obj, default=self._json_encoder.default, option=ORJSON_OPTIONS)
+            if self.json_backend == UJSON:
+                return ujson.dumps(
+                    obj,
+                    default=self._json_encoder.default,
+                    ensure_ascii=False,
+                    escape_forward_slashes=False
+                ).encode('utf-8')
+        except (TypeError, OverflowError):
+            # e.g. integers larger than 64 bit, let the standard library handle (or fail on) these
+            pass
+        return None
 
     @staticmethod
     def from_json(obj):
         return json.loads(obj)
+
+    def to_msgpack(self, obj):
+        return msgpack.packb(obj, default=self._json_encoder.default, use_bin_type=True)
+
+    @staticmethod
+    def from_msgpack(obj):
+        return msgpack.unpackb(obj, raw=False)
+
+    def encode(self, obj, message_format):
+        """
+        Encode ``obj`` to bytes in the supplied wire format.
+        """
+        if message_format == MSGPACK:
+            return self.to_msgpack(obj)
+        return self.to_json_bytes(obj)
+
+    def decode(self, payload, message_format):
+        if message_format == MSGPACK:
+            return self.from_msgpack(payload)
+        return self.from_json(payload)
+
+    @staticmethod
+    def encode_batch(payloads, message_format):
+        """
+        Combine already encoded actions into a single encoded ``batch`` action without decoding them.
+        """
+        if len(payloads) == 1:
+            return payloads[0]
+        if message_format == MSGPACK:
+            packer = msgpack.Packer(use_bin_type=True)
+            header = [
+                packer.pack_map_header(2),
+                packer.pack('type'),
+                packer.pack('batch'),
+                packer.pack('actions'),
+                packer.pack_array_header(len(payloads))
+            ]
+            return b''.join(header + payloads)
+        return b''.join([b'{"type":"batch","actions":[', b','.join(payloads), b']}'])
@@ -1,7 +1,15 @@
+import base64
+import hashlib
+import io
 import os
 import re
+import shutil
+import threading
+
+import six
 
 from . import resources
+from .static import HASHED_PATH
 
 BASE_STATIC_URL = 'https://s3.amazonaws.com/awe-static-files/dist'
 BASE_URL = os.environ.get('AWE_EXPORT_BASE_URL')
@@ -15,7 +23,37 @@ def resource_regex_pattern(prefix, extension):
     return re.compile(regex)
 
 
+custom_components_src = 'src="/custom-components"'
+custom_components_hash_src_format = 'src="/custom-components/{}"'.format
+custom_components_script = '<script src="/custom-components"></script>'
 frozen_state_format = 'window.frozenState={}'.format
+frozen_state_script = '<script>{}</script>'.format(frozen_state_format('null'))
+frozen_state_from_element_script = (
+    '<script>window.frozenState=JSON.parse(document.getElementById("{}").textContent)</script>'.format)
+frozen_state_element_id = 'awe-frozen-state'
+
+# frozen state formats
+OBJECT = 'object'
+JSON_PARSE = 'json_parse'
+JSON_SCRIPT = 'json_script'
+STATE_FORMATS = [OBJECT, JSON_PARSE, JSON_SCRIPT]
+
+# asset modes
+REMOTE = 'remote'
+INLINE = 'inline'
+ASSET_MODES = [REMOTE, INLINE]
+stylesheet_pattern = re.compile(r'<link href="/static/(static/css/[^"]+\.css)" rel="stylesheet">')
+script_pattern = re.compile(r'<script src="/static/(static/js/[^"]+\.js)"></script>')
+source_map_pattern = re.compile(r'^\s*/[/*]# sourceMappingURL=.*$', re.MULTILINE)
+css_comment_pattern = re.compile(r'/\*.*?\*/', re.DOTALL)
+css_space_pattern = re.compile(r'\s*([{};,>])\s*')
+
+# directory exports
+static_url_pattern = re.compile(r'"/static/([^"]+)"')
+shards_dir = 'state'
+shard_format = '(window.aweShards=window.aweShards||{{}})["{}"]={};'.format
+shard_script_format = '<script src="{}/{{}}.js"></script>'.format(shards_dir).format
+custom_components_file_format = 'custom-components.{}.js'.format
 awe_websocket_port_format = 'window.aweWebsocketPort={}'.format
 favicon = '/static/favicon.ico'
 index_resources = [
@@ -29,8 +67,16 @@ resource_patterns = [resource_regex_pattern(*args) for args in index_resources]
 
 class Exporter(object):
 
-    def __init__(self, export_fn, get_initial_state, custom_component, encoder):
+    def __init__(self, export_fn, get_initial_state, custom_component, encoder, state_format=OBJECT, assets=REMOTE,
+                 minify=False):
         from . import __version__
+        if state_format not in STATE_FORMATS:
+            raise ValueError('Invalid state format: {}'.format(state_format))
+        if assets not in ASSET_MODES:
+            raise ValueError('Invalid assets mode: {}'.format(assets))
+        self.state_format = state_format
+        self.assets = assets
+        self.minify = minify
         self.client_root = 'client/awe/build'
         self.export_fn = export_fn or self.default_export_fn
         self.get_initial_state = get_initial_state
@@ -38,26 +84,313 @@ class Exporter(object):
         self.encoder = encoder
         self.index = resources.get(os.path.join(self.client_root, 'index.html'))
         self.base_url = BASE_URL or '{}/{}'.format(BASE_STATIC_URL, __version__)
+        self.template = self._compile_template()
+        self._directory_template = None
 
-    def export(self, export_fn=None):
-        export_fn = export_fn or self.export_fn
+    def _compile_template(self):
+        index = self._inline_assets() if self.assets == INLINE else self._remote_assets()
+        return Template(index, {
+            frozen_state_script: self._iter_frozen_state,
+            custom_components_script: self._iter_custom_components
+        })
+
+    def _remote_assets(self):
         index = self.index.replace(favicon, '{}/{}'.format(self.base_url, 'favicon.ico'), 1)
         for pattern in resource_patterns:
             index = pattern.sub('{}/{}'.format(self.base_url, r'\1'), index, 1)
+        return index
+
+    def _inline_assets(self):
+        # exports that embed the client assets load without network access
+        def build_path(path):
+            return os.path.join(self.client_root, path)
+
+        def inline_stylesheet(match):
+            return '<style>{}</style>'.format(get_inline_asset(build_path(match.group(1)), self.minify))
+
+        def inline_script(match):
+            return '<script>{}</script>'.format(get_inline_asset(build_path(match.group(1)), self.minify))
+        index = self.index.replace(favicon, get_inline_asset(build_path('favicon.ico'), self.minify), 1)
+        index = stylesheet_pattern.sub(inline_stylesheet, index)
+        return script_pattern.sub(inline_script, index)
+
+    def _compile_directory_template(self):
+        if self.assets == INLINE:
+            # assets are shared by all exports to the same directory, rather than inlined in each of them
+            index = static_url_pattern.sub(r'"static/\1"', self.index)
+        else:
+            index = self._remote_assets()
+        # slots are supplied to each render
+        return Template(index, {frozen_state_script: None, custom_components_script: None})
+
+    def export(self, export_fn=None):
+        export_fn = export_fn or self.export_fn
+        return export_fn(''.join(self.iter_export()))
+
+    def export_dir(self, directory, export_fn=None):
+        """
+        Export into a directory that holds an ``index.html``, the page state split into content hashed shards, and
+        (when assets are inlined in exports) the client assets.
+
+        Each root is stored in its own shard, so unchanged roots keep their shard file between exports to the same
+        directory. The children of collapsed panels and inactive tabs are stored in separate shards, that are only
+        loaded when they are first shown.
+
+        :param directory: The export directory, created if it doesn't exist.
+        :param export_fn: Override the export function, which is applied to the ``index.html`` content.
+        :return: The path of the exported ``index.html``.
+        """
+        export_fn = export_fn or self.export_fn
         state = self.get_initial_state()
-        json_state = self.encoder.to_json(state)
-        index = index.replace(frozen_state_format('null'), frozen_state_format(json_state), 1)
-        index = index.replace(
-            '<script type="text/babel" src="/custom-components"></script>',
-            self.custom_component.combined_script_with_script_tag(), 1)
-        return export_fn(index)
+        roots, lazy_shards = split_lazy_views(state.pop('roots'))
+        state_dir = os.path.join(directory, shards_dir)
+        if not os.path.isdir(state_dir):
+            os.makedirs(state_dir)
+        state['roots'] = {}
+        state['shards'] = [self._write_shard(state_dir, {root_id: views}) for root_id, views in roots.items()]
+        state['lazyShards'] = {element_id: self._write_shard(state_dir, shard)
+                               for element_id, shard in lazy_shards.items()}
+        script, script_hash = self.custom_component.combined_script_with_hash()
+        custom_components_file = custom_components_file_format(script_hash)
+        write_once(os.path.join(directory, custom_components_file), script)
+        if self.assets == INLINE:
+            self._copy_assets(directory)
+
+        def iter_frozen_state():
+            yield '<script>{}</script>'.format(frozen_state_format(escape_json(self.encoder.to_json(state))))
+            for shard_hash in state['shards']:
+                yield shard_script_format(shard_hash)
+
+        def iter_custom_components():
+            yield '<script src="{}"></script>'.format(custom_components_file)
+        if self._directory_template is None:
+            self._directory_template = self._compile_directory_template()
+        index = export_fn(''.join(self._directory_template.render({
+            frozen_state_script: iter_frozen_state,
+            custom_components_script: iter_custom_components
+        })))
+        index_path = os.path.join(directory, 'index.html')
+        with io.open(index_path, 'w', encoding='utf-8') as f:
+            f.write(six.text_type(index))
+        return index_path
+
+    def _write_shard(self, state_dir, shard):
+        data = escape_json(self.encoder.to_json(shard)).encode('utf-8')
+        shard_hash = hashlib.sha1(data).hexdigest()[:16]
+        write_once(os.path.join(state_dir, '{}.js'.format(shard_hash)),
+                   shard_format(shard_hash, data.decode('utf-8')))
+        return shard_hash
+
+    def _copy_assets(self, directory):
+        for path in static_url_pattern.findall(self.index):
+            target = os.path.join(directory, 'static', path)
+            if HASHED_PATH.search(path) and os.path.isfile(target):
+                continue
+            target_dir = os.path.dirname(target)
+            if not os.path.isdir(target_dir):
+                os.makedirs(target_dir)
+            shutil.copyfile(os.path.join(resources.DIR, self.client_root, path), target)
+
+    def export_to(self, fileobj):
+        """
+        :param fileobj: A file-like object opened in binary mode, the export is written to.
+        """
+        for chunk in self.iter_export():
+            fileobj.write(chunk.encode('utf-8') if isinstance(chunk, six.text_type) else chunk)
+
+    def iter_export(self):
+        """
+        :return: Iterator over the exported html in chunks, that are built while iterating.
+        """
+        return self.template.render()
+
+    def _iter_frozen_state(self):
+        chunks = self.encoder.iter_json(self.get_initial_state(lazy=True))
+        if self.state_format == JSON_PARSE:
+            # browsers parse JSON in a string literal faster than the same data as a javascript object literal
+            yield '<script>{}'.format(frozen_state_format("JSON.parse('"))
+            for chunk in chunks:
+                yield escape_js_string(chunk)
+            yield "')</script>"
+        elif self.state_format == JSON_SCRIPT:
+            # avoids the string literal copy of the state, for very large states
+            yield '<script type="application/json" id="{}">'.format(frozen_state_element_id)
+            for chunk in chunks:
+                yield escape_json(chunk)
+            yield '</script>'
+            yield frozen_state_from_element_script(frozen_state_element_id)
+        else:
+            yield '<script>{}'.format(frozen_state_format(''))
+            for chunk in chunks:
+                yield escape_json(chunk)
+            yield '</script>'
+
+    def _iter_custom_components(self):
+        yield self.custom_component.combined_script_with_script_tag()
 
     def get_index_html(self, websocket_port):
-        return self.index.replace(
+        index = self.index.replace(
             awe_websocket_port_format('null'),
             awe_websocket_port_format(websocket_port)
         )
+        # the content hash url can be cached by browsers across reloads
+        return index.replace(
+            custom_components_src,
+            custom_components_hash_src_format(self.custom_component.combined_script_hash()),
+            1
+        )
 
     @staticmethod
     def default_export_fn(index_html):
         return index_html
+
+
+def escape_json(chunk):
+    """
+    Escape JSON (in chunks) so it can be embedded in a script tag.
+
+    The escaped characters can only appear in JSON strings, where they can be replaced with unicode escapes.
+    """
+    return chunk.replace(u'<', u'\\u003c').replace(u'\u2028', u'\\u2028').replace(u'\u2029', u'\\u2029')
+
+
+def escape_js_string(chunk):
+    """
+    Escape text (in chunks) so it can be embedded as a single quoted javascript string in a script tag.
+    """
+    return (chunk
+            .replace(u'\\', u'\\\\')
+            .replace(u"'", u"\\'")
+            .replace(u'<', u'\\x3c')
+            .replace(u'\n', u'\\n')
+            .replace(u'\r', u'\\r')
+            .replace(u'\u2028', u'\\u2028')
+            .replace(u'\u2029', u'\\u2029'))
+
+
+def split_lazy_views(roots):
+    """
+    Split the children of collapsed panels and inactive tabs out of root views.
+
+    :param roots: Dict from root id to root view. (see ``Registry.get_roots``)
+    :return: A ``(roots, lazy_shards)`` tuple, where ``lazy_shards`` is a dict from panel and tab ids to
+             ``{root_id: children}`` dicts, holding the children that were removed from their views.
+    """
+    lazy_shards = {}
+
+    def visit(views, root_id):
+        for view in views:
+            inactive_ids = _inactive_child_ids(view)
+            for child in view['children']:
+                if child['id'] in inactive_ids and child['children']:
+                    lazy_shards[child['id']] = {root_id: child['children']}
+                    # views are built for each export, so their children can be replaced
+                    children = child['children']
+                    child['children'] = []
+                    visit(children, root_id)
+                else:
+                    visit([child], root_id)
+    for root_id, root_views in roots.items():
+        visit(root_views, root_id)
+    return roots, lazy_shards
+
+
+def _inactive_child_ids(view):
+    children = view['children']
+    props = view['props'] or {}
+    active = props.get('activeKey', props.get('defaultActiveKey'))
+    if view['elementType'] == 'Collapse':
+        active = active if isinstance(active, list) else [active]
+        return set(child['id'] for child in children if child['props'].get('key') not in active)
+    if view['elementType'] == 'Tabs':
+        if active is None and children:
+            # the first tab is active by default
+            active = children[0]['props'].get('key')
+        return set(child['id'] for child in children if child['props'].get('key') != active)
+    return set()
+
+
+def write_once(path, content):
+    """
+    Write a file whose name is derived from its content, unless it already exists.
+    """
+    if os.path.isfile(path):
+        return
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write(six.text_type(content))
+
+
+_inline_assets = {}
+_inline_assets_lock = threading.Lock()
+
+
+def get_inline_asset(resource, minify=False):
+    """
+    Read a packaged client asset, prepared for inlining in an exported html.
+
+    Assets are read once per process, so that many exports don't read the same files again.
+
+    :param resource: The asset path, relative to the resources directory.
+    :param minify: Remove comments, source map references and (in stylesheets) whitespace.
+    :return: The asset content, escaped for embedding in a ``style`` or ``script`` tag, or a data url for other assets.
+    """
+    key = (resource, minify)
+    with _inline_assets_lock:
+        if key not in _inline_assets:
+            _inline_assets[key] = _read_inline_asset(resource, minify)
+        return _inline_assets[key]
+
+
+def _read_inline_asset(resource, minify):
+    extension = os.path.splitext(resource)[1]
+    if extension not in ('.css', '.js'):
+        with open(os.path.join(resources.DIR, resource), 'rb') as f:
+            data = base64.b64encode(f.read()).decode('ascii')
+        mimetype = 'image/x-icon' if extension == '.ico' else 'application/octet-stream'
+        return 'data:{};base64,{}'.format(mimetype, data)
+    with io.open(os.path.join(resources.DIR, resource), encoding='utf-8') as f:
+        content = f.read()
+    if minify:
+        content = source_map_pattern.sub('', content)
+        if extension == '.css':
+            content = css_comment_pattern.sub('', content)
+            content = css_space_pattern.sub(r'\1', content).strip()
+    # only the end tag can end the style or script element, and "<\/" has the same meaning as "</" wherever
+    # it is valid in javascript or css
+    tag = 'style' if extension == '.css' else 'script'
+    return re.sub(r'</({})'.format(tag), r'<\\/\1', content, flags=re.IGNORECASE)
+
+
+class Template(object):
+    """
+    A template that is split once into static segments and slots, so rendering it doesn't scan or copy it.
+    """
+
+    def __init__(self, template, slots):
+        """
+        :param template: The template text.
+        :param slots: Dict from slot markers in the template (the first occurrence of each marker is replaced) to
+                      functions that return an iterator over the slot content chunks.
+        """
+        positions = sorted((template.index(marker), marker) for marker in slots if marker in template)
+        self.segments = []
+        self.markers = []
+        self.slots = slots
+        start = 0
+        for position, marker in positions:
+            self.segments.append(template[start:position])
+            self.markers.append(marker)
+            start = position + len(marker)
+        self.segments.append(template[start:])
+
+    def render(self, slots=None):
+        """
+        :param slots: Optional dict from slot markers to functions, that override the template slot functions.
+        """
+        functions = dict(self.slots)
+        functions.update(slots or {})
+        for segment, marker in zip(self.segments, self.markers):
+            yield segment
+            for chunk in functions[marker]():
+                yield chunk
+        yield self.segments[-1]
@@ -0,0 +1,349 @@
+"""
+Asyncio HTTP/1.1 server that serves a WSGI application and websocket connections from a single port.
+
+WSGI requests are handled concurrently in a thread pool, so the event loop (and websocket connections) is never
+blocked by slow requests. Response bodies that are generated while iterating are streamed with the chunked transfer
+encoding. Websocket upgrade requests are handed over to the websocket server protocol.
+
+Python 3 only.
+"""
+import asyncio
+import io
+import itertools
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote_to_bytes
+
+MAX_HEADERS_SIZE = 64 * 1024
+# streamed response bodies are read from the WSGI application and written in chunks of at least this size
+STREAM_CHUNK_SIZE = 64 * 1024
+
+STATUS_LINES = {
+    400: b'400 Bad Request',
+    431: b'431 Request Header Fields Too Large',
+    500: b'500 Internal Server Error',
+    501: b'501 Not Implemented'
+}
+
+
+class HttpProtocol(asyncio.Protocol):
+
+    def __init__(self, app, websocket_factory, executor, loop):
+        """
+        :param app: The WSGI application.
+        :param websocket_factory: Protocol factory for websocket upgrade requests.
+        :param executor: The executor WSGI requests are handled in.
+        :param loop: The event loop of the server.
+        """
+        self.app = app
+        self.websocket_factory = websocket_factory
+        self.executor = executor
+        self.loop = loop
+        self.transport = None
+        self.buffer = b''
+        self.busy = False
+        self.closed = False
+        self.paused = False
+        # called once the transport write buffer is drained, while streaming a response
+        self.on_resume = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self.closed = True
+
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+        on_resume, self.on_resume = self.on_resume, None
+        if on_resume:
+            on_resume()
+
+    def data_received(self, data):
+        self.buffer += data
+        self.process()
+
+    def process(self):
+        # requests on a connection are handled one at a time, pipelined requests wait in the buffer
+        if self.busy or self.closed:
+            return
+        headers_end = self.buffer.find(b'\r\n\r\n')
+        if headers_end == -1:
+            if len(self.buffer) > MAX_HEADERS_SIZE:
+                self.send_error(431)
+            return
+        try:
+            request = parse_request(self.buffer[:headers_end].decode('latin-1'))
+        except ValueError:
+            self.send_error(400)
+            return
+        method, target, version, headers = request
+        if headers.get('upgrade', '').lower() == 'websocket':
+            self.upgrade()
+            return
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            self.send_error(501)
+            return
+        try:
+            content_length = int(headers.get('content-length') or 0)
+        except ValueError:
+            self.send_error(400)
+            return
+        request_end = headers_end + 4 + content_length
+        if len(self.buffer) < request_end:
+            return
+        body = self.buffer[headers_end + 4:request_end]
+        self.buffer = self.buffer[request_end:]
+        connection = headers.get('connection', '').lower()
+        keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+        environ = self.environ(method, target, version, headers, body)
+        self.busy = True
+        future = self.loop.run_in_executor(self.executor, call_app, self.app, environ)
+        chunked = version != 'HTTP/1.0'
+        future.add_done_callback(lambda f: self.send_response(f.result(), method == 'HEAD', keep_alive, chunked))
+
+    def upgrade(self):
+        protocol = self.websocket_factory()
+        self.transport.set_protocol(protocol)
+        protocol.connection_made(self.transport)
+        protocol.data_received(self.buffer)
+        self.buffer = b''
+
+    def environ(self, method, target, version, headers, body):
+        path, _, query = target.partition('?')
+        server_name, server_port = self.transport.get_extra_info('sockname')[:2]
+        peer = self.transport.get_extra_info('peername') or ('', 0)
+        result = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            # WSGI strings are bytes decoded as latin-1
+            'PATH_INFO': unquote_to_bytes(path).decode('latin-1'),
+            'QUERY_STRING': query,
+            'SERVER_NAME': server_name,
+            'SERVER_PORT': str(server_port),
+            'SERVER_PROTOCOL': version,
+            'REMOTE_ADDR': peer[0],
+            'CONTENT_TYPE': headers.pop('content-type', ''),
+            'CONTENT_LENGTH': headers.pop('content-length', ''),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            'wsgi.file_wrapper': FileWrapper
+        }
+        for name, value in headers.items():
+            result['HTTP_{}'.format(name.upper().replace('-', '_'))] = value
+        return result
+
+    def send_response(self, response, head, keep_alive, chunked=True):
+        """
+        :param chunked: Whether streamed bodies can be sent with the chunked transfer encoding. Otherwise, they are
+                        delimited by closing the connection.
+        """
+        status, headers, body = response
+        if self.closed:
+            self.finish_response(body, keep_alive)
+            return
+        streamed = isinstance(body, StreamedBody)
+        lines = [b'HTTP/1.1 ' + status.encode('latin-1')]
+        for name, value in headers:
+            if name.lower() in ('content-length', 'connection', 'transfer-encoding'):
+                continue
+            lines.append('{}: {}'.format(name, value).encode('latin-1'))
+        if streamed:
+            content_length = None
+            keep_alive = keep_alive and chunked
+            if chunked:
+                lines.append(b'Transfer-Encoding: chunked')
+        else:
+            if isinstance(body, FileWrapper):
+                content_length = os.fstat(body.file.fileno()).st_size - body.file.tell()
+            else:
+                content_length = len(body)
+            lines.append('Content-Length: {}'.format(content_length).encode('latin-1'))
+        lines.append(b'Connection: keep-alive' if keep_alive else b'Connection: close')
+        self.transport.write(b'\r\n'.join(lines) + b'\r\n\r\n')
+        if head or content_length == 0:
+            self.finish_response(body, keep_alive)
+        elif streamed:
+            self.stream(body, body.first, chunked, keep_alive)
+        elif isinstance(body, FileWrapper):
+            # files are sent with os.sendfile, when supported by the transport
+            task = self.loop.create_task(self.loop.sendfile(self.transport, body.file))
+            task.add_done_callback(
+                lambda t: self.finish_response(body, keep_alive and not t.cancelled() and not t.exception()))
+        else:
+            self.transport.write(body)
+            self.finish_response(body, keep_alive)
+
+    def stream(self, body, chunk, chunked, keep_alive):
+        """
+        Write a streamed body chunk, and read the next one once the transport can take more data, so large bodies
+        are never held in memory.
+        """
+        if self.closed:
+            self.finish_response(body, False)
+            return
+        if not chunk:
+            if chunked:
+                self.transport.write(b'0\r\n\r\n')
+            self.finish_response(body, keep_alive)
+            return
+        self.transport.write(b'%x\r\n%s\r\n' % (len(chunk), chunk) if chunked else chunk)
+
+        def read_next():
+            future = self.loop.run_in_executor(self.executor, body.read, STREAM_CHUNK_SIZE)
+            future.add_done_callback(lambda f: self.stream_next(body, f, chunked, keep_alive))
+        if self.paused:
+            self.on_resume = read_next
+        else:
+            read_next()
+
+    def stream_next(self, body, future, chunked, keep_alive):
+        if future.exception():
+            # the status line was already sent, the response can only be cut short
+            self.close()
+            self.finish_response(body, False)
+            return
+        self.stream(body, future.result(), chunked, keep_alive)
+
+    def finish_response(self, body, keep_alive):
+        if isinstance(body, (FileWrapper, StreamedBody)):
+            body.close()
+        self.busy = False
+        if self.closed:
+            return
+        if keep_alive:
+            self.process()
+        else:
+            self.close()
+
+    def send_error(self, status):
+        self.transport.write(
+            b'HTTP/1.1 ' + STATUS_LINES[status] + b'\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+        self.close()
+
+    def close(self):
+        self.closed = True
+        self.buffer = b''
+        self.transport.close()
+
+
+def parse_request(head):
+    """
+    :param head: The request line and header lines.
+    :return: A ``(method, target, version, headers)`` tuple, where ``headers`` keys are lower case.
+    """
+    lines = head.split('\r\n')
+    method, target, version = lines[0].split(' ')
+    if not version.startswith('HTTP/1.'):
+        raise ValueError(version)
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(':')
+        if not sep:
+            raise ValueError(line)
+        name = name.strip().lower()
+        value = value.strip()
+        headers[name] = '{}, {}'.format(headers[name], value) if name in headers else value
+    return method, target, version, headers
+
+
+def call_app(app, environ):
+    """
+    :return: A ``(status, headers, body)`` tuple.
+    """
+    response = []
+
+    def start_response(status, headers, exc_info=None):
+        if exc_info and response:
+            raise exc_info[1].with_traceback(exc_info[2])
+        response[:] = [status, headers]
+        return written.append
+    written = []
+    try:
+        result = app(environ, start_response)
+        if isinstance(result, FileWrapper) and not written:
+            return response[0], response[1], result
+        if not isinstance(result, (list, tuple)):
+            # other iterables (e.g. generators) are streamed as they are produced, unless they are small
+            body = StreamedBody(written, result)
+            if not body.done:
+                return response[0], response[1], body
+            body.close()
+            return response[0], response[1], body.first
+        try:
+            body = b''.join(written + list(result))
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response[0], response[1], body
+    except Exception:
+        return '500 Internal Server Error', [('Content-Type', 'text/plain')], b'Internal Server Error'
+
+
+class FileWrapper(object):
+    """
+    Files returned by the WSGI application are sent from the event loop, rather than read in the thread pool.
+    """
+
+    def __init__(self, file, block_size=8192):
+        self.file = file
+        self.block_size = block_size
+
+    def __iter__(self):
+        return iter(lambda: self.file.read(self.block_size), b'')
+
+    def close(self):
+        self.file.close()
+
+
+class StreamedBody(object):
+    """
+    Response body that is read from the WSGI application, in the thread pool, as it is sent.
+    """
+
+    def __init__(self, written, result):
+        """
+        :param written: Chunks written with the ``start_response`` write callable.
+        :param result: The iterable returned by the WSGI application.
+        """
+        self.result = result
+        self.chunks = itertools.chain(written, result)
+        self.done = False
+        # read immediately, as applications may call start_response when iteration starts
+        self.first = self.read(STREAM_CHUNK_SIZE)
+
+    def read(self, size):
+        """
+        :return: The next chunks, joined until they are at least ``size`` bytes long, or ``b''`` after the last chunk.
+        """
+        chunks = []
+        total = 0
+        while total < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.done = True
+                break
+            chunks.append(chunk)
+            total += len(chunk)
+        return b''.join(chunks)
+
+    def close(self):
+        if hasattr(self.result, 'close'):
+            self.result.close()
+
+
+def create_server(app, websocket_factory, host, port, loop, max_workers=None):
+    """
+    :return: Coroutine that creates the server. (see ``loop.create_server``)
+    """
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    return loop.create_server(lambda: HttpProtocol(app, websocket_factory, executor, loop), host, port)
@@ -9,9 +9,12 @@ class MessageHandler(object):
         self.registry = registry
         self.dispatch = dispatch
         self.pool = None
+        # client id -> ids of the virtual tables the client fetched rows of
+        self.client_tables = {}
         self.handlers = {
             'call': self.handle_call,
-            'updateVariable': self.handle_update_variable
+            'updateVariable': self.handle_update_variable,
+            'fetchRows': self.handle_fetch_rows
         }
 
     def start(self):
@@ -57,3 +60,24 @@ class MessageHandler(object):
             'value': value,
             'version': variable.version
         })
+
+    def handle_fetch_rows(self, message):
+        table = self.registry.elements.get(message['id'])
+        if table is None:
+            # removed while the client displayed it
+            return
+        client_id = message['clientId']
+        table.fetch_rows(client_id, message['offset'], message['limit'], message.get('query'))
+        self.client_tables.setdefault(client_id, set()).add(table.id)
+
+    def client_closed(self, client_id):
+        """
+        Called from the websocket server when a client disconnects.
+        """
+        self.pool.apply_async(self.handle_client_closed, args=(client_id,))
+
+    def handle_client_closed(self, client_id):
+        for table_id in self.client_tables.pop(client_id, ()):
+            table = self.registry.elements.get(table_id)
+            if table is not None:
+                table.release_rows(client_id)
@@ -1,7 +1,12 @@
+import contextlib
 import os
+import threading
 import time
+import uuid
 import webbrowser
 
+import six
+
 from . import messages
 from . import registry
 from . import view
@@ -36,7 +41,17 @@ class Page(view.Root):
             style=None,
             export_fn=None,
             offline=False,
-            serializers=None):
+            serializers=None,
+            flush_interval=None,
+            websocket_compression=None,
+            send_queue_size=None,
+            slow_consumer_policy='resync',
+            json_backend='auto',
+            action_log_size=1000,
+            single_port=False,
+            export_state_format='object',
+            export_assets='remote',
+            export_minify=False):
         """
         :param title: Page title.
         :param host: Webserver/Websocket host.
@@ -47,7 +62,48 @@ class Page(view.Root):
         :param export_fn: Override default export function.
         :param offline: Offline mode means start/block don't do anything. Useful when exporting directly from python.
         :param serializers: Custom serializers for custom element implementations.
+        :param flush_interval: Optional interval (in seconds, e.g. ``0.05``) during which dispatched actions are
+                               collected and sent to clients as a single batch. By default, actions are sent as
+                               soon as the websocket server thread is free to send them.
+        :param websocket_compression: Pass ``True`` to enable websocket permessage-deflate compression for clients that
+                                      support it, or a dict to override any of the ``window_bits`` (``9`` to ``15``,
+                                      default: ``15``), ``mem_level`` (default: ``8``) and ``threshold`` (default:
+                                      ``1024``, messages smaller than this number of bytes are not compressed)
+                                      settings.
+        :param send_queue_size: Optional maximum number of messages queued for a client that doesn't keep up with the
+                                rate of page updates. By default, the queue is not bounded.
+        :param slow_consumer_policy: What to do when a client queue is full. One of ``resync`` (the default, drop the
+                                     queued messages and make the client fetch the full page state again),
+                                     ``drop`` (drop queued updates that were superseded by newer updates, and resync
+                                     if there are none) or ``block`` (block dispatching threads until the client
+                                     catches up).
+        :param json_backend: The library used to encode JSON. One of ``orjson``, ``ujson``, ``json`` (the standard
+                             library) or ``auto`` (the default, use the fastest one installed). orjson isn't
+                             used when custom serializers are registered for types it always encodes itself (enums
+                             and UUIDs). Unlike the other backends, orjson encodes NaN and infinite floats as
+                             ``null``.
+        :param action_log_size: Number of recent actions kept in memory, so that reconnecting clients are only sent the
+                                actions they missed, instead of fetching the full page state again. (default: 1000)
+        :param single_port: Serve the webserver and the websocket from ``port`` with a single asyncio server, that
+                            handles webserver requests concurrently. (python 3 only, default: ``False``)
+        :param export_state_format: How the page state is embedded in exports. One of ``object`` (the default, a
+                                    javascript object literal), ``json_parse`` (a ``JSON.parse`` call on a string
+                                    literal, which browsers parse faster for large states) or ``json_script`` (a
+                                    ``<script type="application/json">`` block, for very large states).
+        :param export_assets: Where exports load the client assets from. One of ``remote`` (the default, from
+                              ``AWE_EXPORT_BASE_URL`` or the awe static files CDN) or ``inline`` (embedded in the
+                              exported html, so exports load without network access).
+        :param export_minify: Minify assets inlined in exports. (default: ``False``)
         """
+        if single_port:
+            if six.PY2:
+                raise ValueError('single_port requires python 3')
+            websocket_port = port
+        if isinstance(websocket_compression, dict):
+            window_bits = websocket_compression.get('window_bits', websocket.MIN_WINDOW_BITS)
+            if not websocket.MIN_WINDOW_BITS <= window_bits <= websocket.MAX_WINDOW_BITS:
+                raise ValueError('websocket_compression window_bits must be between {} and {}'.format(
+                    websocket.MIN_WINDOW_BITS, websocket.MAX_WINDOW_BITS))
         super(Page, self).__init__(owner=self, element_id='root')
         self._registry = registry.Registry()
         self._register(self)
@@ -61,7 +117,8 @@ class Page(view.Root):
         )
         self._encoder = encoding.Encoder(
             element_cls=view.Element,
-            serializers=serializers
+            serializers=serializers,
+            json_backend=json_backend
         )
         self._message_handler = messages.MessageHandler(
             registry=self._registry,
@@ -75,12 +132,32 @@ class Page(view.Root):
             export_fn=export_fn,
             get_initial_state=self._get_initial_state,
             custom_component=self._custom_component,
-            encoder=self._encoder
+            encoder=self._encoder,
+            state_format=export_state_format,
+            assets=export_assets,
+            minify=export_minify
+        )
+        # distinguishes different page instances in etags and reconnecting clients
+        self._instance_token = uuid.uuid4().hex[:8]
+        self._ws_server = websocket.WebSocketServer(
+            host=host,
+            port=websocket_port,
+            message_handler=self._message_handler,
+            encoder=self._encoder,
+            flush_interval=flush_interval,
+            compression=websocket_compression,
+            send_queue_size=send_queue_size,
+            slow_consumer_policy=slow_consumer_policy,
+            action_log_size=action_log_size,
+            instance_token=self._instance_token
         )
         self._api = api.API(
             registry=self._registry,
             encoder=self._encoder,
-            message_handler=self._message_handler
+            message_handler=self._message_handler,
+            ws_server=self._ws_server,
+            get_version=lambda: self._version,
+            etag_token=self._instance_token
         )
         self._server = webserver.WebServer(
             exporter=self._exporter,
@@ -89,15 +166,17 @@ class Page(view.Root):
             websocket_port=websocket_port,
             custom_component=self._custom_component,
             encoder=self._encoder,
-            api=self._api)
-        self._ws_server = websocket.WebSocketServer(
-            host=host,
-            port=websocket_port,
-            message_handler=self._message_handler,
-            encoder=self._encoder
-        )
+            api=self._api,
+            get_version=lambda: self._version,
+            etag_token=self._instance_token)
+        if single_port:
+            self._ws_server.serve_http(self._server.app)
+        self._single_port = single_port
         self._started = False
         self._version = 0
+        self._version_lock = threading.Lock()
+        # the batch of each thread, if any (see ``batch``)
+        self._batches = threading.local()
         self._closed = False
         if os.environ.get('AWE_SET_GLOBAL'):
             global global_page
@@ -118,7 +197,9 @@ class Page(view.Root):
             self._element_updater.start()
             return
         self._message_handler.start()
-        self._server.start()
+        self._ws_server.action_log.start(self._version)
+        if not self._single_port:
+            self._server.start()
         self._ws_server.start()
         self._element_updater.start()
         self._started = True
@@ -128,15 +209,55 @@ class Page(view.Root):
         if block:
             self.block()
 
-    def export(self, export_fn=None):
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Context manager that collects the changes made while it is active and sends them to clients as a single
+        action. (see ``Element.batch``)
+
+        Batch scopes can be nested, changes are sent when the outermost scope exits. Only changes made by the thread
+        that entered the scope are collected.
+        """
+        batch = self._get_batch()
+        if batch is None:
+            batch = self._batches.batch = view.Batch()
+        batch.depth += 1
+        try:
+            yield
+        finally:
+            batch.depth -= 1
+            if not batch.depth:
+                self._batches.batch = None
+                action = batch.get_action()
+                if action:
+                    self._dispatch(action)
+
+    def export(self, export_fn=None, directory=None):
         """
         Export current page state into a static html.
 
         :param export_fn: Override the export_fn supplied during page creation. (if any)
-        :return: The exporter result.
+        :param directory: Export into a directory instead, with the page state split into shards that are loaded by
+                          the exported ``index.html``. Unchanged parts of the page keep their shard files across
+                          exports to the same directory, and the content of collapsed panels and inactive tabs is
+                          only loaded when first shown. Suitable for very large pages.
+        :return: The exporter result, or the path of the exported ``index.html`` when exporting into a directory.
         """
+        if directory:
+            return self._exporter.export_dir(directory, export_fn)
         return self._exporter.export(export_fn)
 
+    def export_to(self, fileobj):
+        """
+        Export current page state into a static html, written in chunks to a file-like object.
+
+        Unlike ``export``, the html is never fully held in memory, which makes this method more suitable for
+        exporting large pages.
+
+        :param fileobj: A file-like object opened in binary mode.
+        """
+        self._exporter.export_to(fileobj)
+
     def block(self):
         """
         Utility method to block after page has been started.
@@ -153,17 +274,20 @@ class Page(view.Root):
         # TODO actually close things
         self._closed = True
 
-    def _get_initial_state(self):
+    def _get_initial_state(self, lazy=False):
         return {
-            'roots': self._registry.get_roots(),
+            'roots': self._registry.get_roots(lazy=lazy),
             'variables': self._registry.get_variables(),
             'version': self._version,
+            'token': self._instance_token,
             'style': self._style,
             'title': self._title,
         }
 
     def _increase_version(self):
-        self._version += 1
+        with self._version_lock:
+            self._version += 1
+            return self._version
 
     def _register(self, obj, obj_id=None):
         if isinstance(obj, element_updater.Updater):
@@ -174,14 +298,19 @@ class Page(view.Root):
     def _unregister(self, obj, obj_id=None):
         self._registry.unregister(obj, obj_id)
 
+    def _get_batch(self):
+        return getattr(self._batches, 'batch', None)
+
     def _dispatch(self, action, client_id=None):
         if self._closed:
             raise RuntimeError('page is closed')
-        self._increase_version()
+        # actions sent to a single client (e.g. errors and replies) don't change the page state
         if not self._started:
+            if not client_id:
+                self._increase_version()
             return
-        action['version'] = self._version
-        self._ws_server.dispatch_from_thread(action, client_id)
+        next_version = None if client_id else self._increase_version
+        self._ws_server.dispatch_from_thread(action, client_id, next_version=next_version)
 
     def _parse(self, obj, context):
         return self._parser.parse(obj, context)
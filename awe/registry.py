@@ -24,7 +24,13 @@ class Registry(object):
     def get_variables(self):
         return {k: var.get_variable() for k, var in self.variables.items()}
 
-    def get_roots(self):
+    def get_roots(self, lazy=False):
+        """
+        :param lazy: Return the ``_get_view`` method of each root instead of its view.
+                     (see ``Encoder.iter_json``)
+        """
+        if lazy:
+            return {k: root._get_view for k, root in self.roots.items()}
         return {k: root._get_view() for k, root in self.roots.items()}
 
     def _get_id_and_store(self, obj, obj_id):
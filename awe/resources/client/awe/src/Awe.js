@@ -1,24 +1,63 @@
+import {decode} from '@msgpack/msgpack';
+import Babel from '@babel/standalone';
 import actions from './actions';
 import {updateElementActions} from './store';
 import components from './components';
 
+const minReconnectDelay = 500;
+const maxReconnectDelay = 10000;
+
 class Awe {
   constructor({store, port}) {
     this.store = store;
+    this.port = port || 9000;
     this.finishedInitialFetch = false;
     this.clientId = null;
+    this.version = null;
+    this.token = null;
+    this.syncId = 0;
     this.pendingActions = [];
-    this.ws = new WebSocket(`ws://${window.location.hostname}:${port || 9000}`);
+    // the table pages displayed by this client, fetched again when it reconnects with a new client id
+    this.tableWindows = {};
+    this.reconnectDelay = minReconnectDelay;
+    this.connect();
+    this.syncState();
+  }
+
+  connect() {
+    // once the initial state is applied, the server only sends the actions missed since the last applied version
+    const resume = this.finishedInitialFetch && this.version !== null;
+    // the token makes the server resync clients that applied versions of another page instance (e.g. a restarted one)
+    const query = resume ? `?version=${this.version}&token=${this.token}` : '';
+    this.ws = new WebSocket(`ws://${window.location.hostname}:${this.port}${query}`, ['awe.msgpack', 'awe.json']);
+    this.ws.binaryType = 'arraybuffer';
     this.ws.onmessage = this.onMessage.bind(this);
     this.ws.onerror = (error) => console.error('ws error', error);
+    this.ws.onopen = () => {
+      this.reconnectDelay = minReconnectDelay;
+      if (!resume && this.clientId !== null) {
+        // reconnected before the initial state was applied, some actions may have been missed
+        this.syncState();
+      }
+    };
+    this.ws.onclose = () => {
+      setTimeout(() => this.connect(), this.reconnectDelay);
+      this.reconnectDelay = Math.min(this.reconnectDelay * 2, maxReconnectDelay);
+    };
+  }
+
+  syncState() {
+    const syncId = ++this.syncId;
+    this.finishedInitialFetch = false;
+    this.pendingActions = [];
     Awe.fetchInitialState().then((initialState) => {
-      Awe.processInitialState(this.store, initialState);
-      const {version} = initialState;
-      for (const pendingAction of this.pendingActions) {
-        if (pendingAction.version > version) {
-          this.store.dispatch(pendingAction);
-        }
+      if (syncId !== this.syncId) {
+        return;
       }
+      Awe.processInitialState(this.store, initialState);
+      this.version = initialState.version;
+      this.token = initialState.token;
+      this.dispatchActions(this.pendingActions);
       this.pendingActions = [];
       this.finishedInitialFetch = true;
     });
@@ -31,10 +70,12 @@ class Awe {
       instance = {
         call: notSupported,
         updateVariable: notSupported,
-        fetchExport: notSupported
+        fetchExport: notSupported,
+        // offline pages only include the first page of virtual tables
+        fetchRows: () => null
       };
       setTimeout(() => {
-        Awe.processInitialState(store, initialState);
+        Awe.processInitialState(store, Awe.loadShards(initialState));
       }, 0);
     } else {
       instance = new Awe({store, port});
@@ -42,6 +83,8 @@ class Awe {
 
     const loadingScripts = [];
     const onScriptsLoadedCallbacks = [];
+    const addedScripts = new Set();
+    const addedStyles = new Set();
 
     function scriptLoaded() {
       loadingScripts.pop();
@@ -54,7 +97,7 @@ class Awe {
 
     function runFinishScriptIfRequired() {
       if (loadingScripts.length === 0) {
-        for (const callback of onScriptsLoadedCallbacks) {
+        for (const callback of onScriptsLoadedCallbacks.splice(0)) {
           callback();
         }
         store.dispatch({type: "reload"});
@@ -62,6 +105,10 @@ class Awe {
     }
 
     function addScript(script) {
+      if (addedScripts.has(script.src)) {
+        return;
+      }
+      addedScripts.add(script.src);
       loadingScripts.push(1);
       const scriptElement = document.createElement('script');
       Object.assign(scriptElement, script);
@@ -70,22 +117,100 @@ class Awe {
     }
 
     function addStyle(style) {
+      if (addedStyles.has(style.href)) {
+        return;
+      }
+      addedStyles.add(style.href);
       const linkElement = document.createElement('link');
       Object.assign(linkElement, style);
       document.head.append(linkElement);
     }
 
+    function registerComponent({name, hash, source}) {
+      const code = Awe.transpileComponent(hash, source);
+      // eslint-disable-next-line no-new-func
+      new Function('register', code)((fn) => {components[name] = fn});
+    }
+
+    // registers a custom element type after the page was loaded, the reload that follows re-renders its elements
+    function loadComponent({component, scripts, styles}) {
+      styles.forEach(addStyle);
+      scripts.forEach(addScript);
+      onScriptsLoaded(() => registerComponent(component));
+      runFinishScriptIfRequired();
+    }
+
+    // directory exports store the content of collapsed panels and inactive tabs in shards loaded when first shown
+    const loadedShards = new Set();
+    function loadLazyShard(elementId) {
+      const shardHash = ((initialState || {}).lazyShards || {})[elementId];
+      if (!shardHash || loadedShards.has(shardHash)) {
+        return;
+      }
+      loadedShards.add(shardHash);
+      const scriptElement = document.createElement('script');
+      scriptElement.src = Awe.shardPath(shardHash);
+      scriptElement.onload = () => store.dispatch({type: 'processRoots', roots: window.aweShards[shardHash]});
+      document.head.append(scriptElement);
+    }
+
     window.Awe = {
       register: (name, fn) => {components[name] = fn},
+      registerComponent,
+      loadComponent,
       registerUpdateElementAction: (name, fn) => {updateElementActions[name] = fn},
       addStyle,
       addScript,
       onScriptsLoaded,
       scriptSetupDone: runFinishScriptIfRequired,
+      loadLazyShard,
       call: instance.call.bind(instance),
       updateVariable: instance.updateVariable.bind(instance),
+      fetchRows: instance.fetchRows.bind(instance),
       fetchExport: instance.fetchExport.bind(instance)
     };
+
+    // the custom components script may run before the client is loaded, in which case it queues its setup
+    const queuedSetups = window.aweComponentQueue || [];
+    window.aweComponentQueue = {push: (setup) => setup(window.Awe)};
+    for (const setup of queuedSetups) {
+      setup(window.Awe);
+    }
+  }
+
+  static loadShards(initialState) {
+    if (!initialState.shards) {
+      return initialState;
+    }
+    // the shards of directory exports are loaded by script tags that precede the client
+    const roots = {};
+    for (const shardHash of initialState.shards) {
+      Object.assign(roots, window.aweShards[shardHash]);
+    }
+    return {...initialState, roots};
+  }
+
+  static shardPath(shardHash) {
+    return `state/${shardHash}.js`;
+  }
+
+  static transpileComponent(hash, source) {
+    const key = `awe-component-${hash}`;
+    let code = null;
+    try {
+      code = window.localStorage.getItem(key);
+    } catch (e) {
+      // storage may not be available, e.g. when disabled by the browser
+    }
+    if (code === null) {
+      code = Babel.transform(source, {presets: ['react']}).code;
+      try {
+        window.localStorage.setItem(key, code);
+      } catch (e) {
+        // storage may be full
+      }
+    }
+    return code;
   }
 
   static async fetchInitialState() {
@@ -100,6 +225,17 @@ class Awe {
     this.sendMessage({type: 'call', functionId, kwargs, clientId: this.clientId})
   }
 
+  fetchRows(id, offset, limit, query) {
+    this.tableWindows[id] = {offset, limit, query};
+    if (this.clientId !== null && this.ws.readyState === WebSocket.OPEN) {
+      this.sendFetchRows(id, offset, limit, query);
+    }
+  }
+
+  sendFetchRows(id, offset, limit, query) {
+    this.sendMessage({type: 'fetchRows', id, offset, limit, query, clientId: this.clientId});
+  }
+
   updateVariable(variableId, value) {
     this.store.dispatch(actions.updateVariable(variableId, value));
     this.sendMessage({type: 'updateVariable', variableId, value, clientId: this.clientId})
@@ -110,18 +246,49 @@ class Awe {
   }
 
   onMessage(message) {
-    const action = JSON.parse(message.data);
-    if (action.type === 'setClientId') {
-      this.clientId = action.clientId;
-    } else if (action.type === 'refresh') {
-      document.location.reload();
-    } else if (!this.finishedInitialFetch) {
-      this.pendingActions.push(action);
-    } else {
-      this.store.dispatch(action);
+    const {data} = message;
+    const action = typeof data === 'string' ? JSON.parse(data) : decode(new Uint8Array(data));
+    // messages batched by the server have no version, unlike batch actions dispatched by page.batch()
+    const actions = action.type === 'batch' && action.version === undefined ? action.actions : [action];
+    const storeActions = [];
+    for (const currentAction of actions) {
+      if (currentAction.type === 'setClientId') {
+        this.clientId = currentAction.clientId;
+        for (const [id, {offset, limit, query}] of Object.entries(this.tableWindows)) {
+          this.sendFetchRows(id, offset, limit, query);
+        }
+      } else if (currentAction.type === 'refresh') {
+        document.location.reload();
+        return;
+      } else if (currentAction.type === 'registerComponent') {
+        window.Awe.loadComponent(currentAction);
+      } else if (currentAction.type === 'resync') {
+        storeActions.length = 0;
+        this.syncState();
+      } else if (!this.finishedInitialFetch) {
+        this.pendingActions.push(currentAction);
+      } else {
+        storeActions.push(currentAction);
+      }
     }
+    this.dispatchActions(storeActions);
   };
 
+  dispatchActions(allActions) {
+    // skip actions already included in the initial state, or received before reconnecting
+    const actions = allActions.filter(action => action.version === undefined || action.version > this.version);
+    for (const action of actions) {
+      if (action.version !== undefined) {
+        this.version = action.version;
+      }
+    }
+    if (actions.length === 1) {
+      this.store.dispatch(actions[0]);
+    } else if (actions.length > 1) {
+      this.store.dispatch({type: 'batch', actions});
+    }
+  }
+
   static processInitialState(store, initialState) {
     document.title = initialState.title;
     store.dispatch({type: 'processInitialState', ...initialState});
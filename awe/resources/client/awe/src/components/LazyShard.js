@@ -0,0 +1,14 @@
+import {Component} from 'react';
+
+// mounted when a collapsed panel or an inactive tab is first shown, loads its content in directory exports
+class LazyShard extends Component {
+  componentDidMount() {
+    window.Awe.loadLazyShard(this.props.elementId);
+  }
+
+  render() {
+    return null;
+  }
+}
+
+export default LazyShard;
@@ -1,5 +1,6 @@
 import React, {Component} from 'react';
 import * as antd from 'antd';
+import {fromJS, is} from 'immutable';
 
 
 const sorter = (key) => (a, b) => {
@@ -18,15 +19,87 @@ const sorter = (key) => (a, b) => {
 
 
 class Table extends Component {
+  constructor(props) {
+    super(props);
+    this.state = {current: 1, query: null, search: ''};
+  }
+
+  componentDidMount() {
+    if (this.props.table.data.virtual) {
+      this.fetchPage(this.state.current, this.state.query);
+    }
+  }
+
+  pageSize() {
+    return this.props.table.props.pagination.pageSize;
+  }
+
+  fetchPage(current, query) {
+    const pageSize = this.pageSize();
+    window.Awe.fetchRows(this.props.table.id, (current - 1) * pageSize, pageSize, query);
+  }
+
+  onChange(pagination, filters, sorter) {
+    const query = {};
+    if (sorter && sorter.order) {
+      query.sort = sorter.columnKey;
+      query.order = sorter.order;
+    }
+    const activeFilters = {};
+    for (const [header, values] of Object.entries(filters || {})) {
+      if (values && values.length > 0) {
+        activeFilters[header] = values;
+      }
+    }
+    if (Object.keys(activeFilters).length > 0) {
+      query.filters = activeFilters;
+    }
+    if (this.state.search) {
+      query.search = this.state.search;
+    }
+    const newQuery = Object.keys(query).length > 0 ? query : null;
+    // a new query starts from its first page
+    const current = is(fromJS(newQuery), fromJS(this.state.query)) ? pagination.current : 1;
+    this.setState({current, query: newQuery});
+    this.fetchPage(current, newQuery);
+  }
+
+  onSearch(search) {
+    const query = {...this.state.query};
+    delete query.search;
+    if (search) {
+      query.search = search;
+    }
+    const newQuery = Object.keys(query).length > 0 ? query : null;
+    this.setState({current: 1, query: newQuery, search});
+    this.fetchPage(1, newQuery);
+  }
+
   render() {
     const table = this.props.table;
     const {process} = table;
-    const {headers, rows} = table.data;
+    const {headers, virtual, rowCount, sortColumns = [], searchable} = table.data;
+    let {rows} = table.data;
+    let {pagination} = table.props;
+    if (virtual) {
+      // rows are fetched from the server a page at a time, so they are sorted, filtered and searched by the server
+      const {window = {offset: 0, query: null, rows: []}} = table.data;
+      const pageSize = this.pageSize();
+      const offset = (this.state.current - 1) * pageSize;
+      const current = window.offset === offset && is(fromJS(window.query || null), fromJS(this.state.query));
+      rows = current ? window.rows : [];
+      pagination = {
+        ...pagination,
+        current: this.state.current,
+        // windows without a query are only resent when their rows change, so their match count may be stale
+        total: current && window.query && window.matchCount !== undefined ? window.matchCount : rowCount
+      };
+    }
     const columns = headers.map((header) => ({
       title: header,
       dataIndex: header,
       key: header,
-      sorter: sorter(header)
+      sorter: virtual ? sortColumns.includes(header) : sorter(header)
     }));
     const dataSource = rows.map((row) => {
       const {data, id} = row;
@@ -37,13 +110,28 @@ class Table extends Component {
       }
       return result;
     });
-    return (
+    const tableElement = (
       <antd.Table
         {...table.props}
+        pagination={pagination}
+        onChange={virtual ? this.onChange.bind(this) : table.props.onChange}
         dataSource={dataSource}
         columns={columns}
       />
     );
+    if (!searchable) {
+      return tableElement;
+    }
+    return (
+      <div>
+        <antd.Input.Search
+          placeholder="Search"
+          style={{marginBottom: 8}}
+          onSearch={this.onSearch.bind(this)}
+        />
+        {tableElement}
+      </div>
+    );
   }
 }
 
@@ -8,6 +8,7 @@ import Inline from './Inline';
 import Grid from './Grid';
 import Text from './Text'
 import Chart from './Chart';
+import LazyShard from './LazyShard';
 
 const nativeComponents = {
   div: div => (
@@ -57,13 +58,13 @@ const connectedComponents = {
   Panel: panel => (
     <antd.Collapse.Panel
       {...panel.props}>
-      {panel.children}
+      {panel.children.length > 0 ? panel.children : <LazyShard elementId={panel.id}/>}
     </antd.Collapse.Panel>
   ),
   Tab: tab => (
     <antd.Tabs.TabPane
       {...tab.props}>
-      {tab.children}
+      {tab.children.length > 0 ? tab.children : <LazyShard elementId={tab.id}/>}
     </antd.Tabs.TabPane>
   ),
   Tabs: tabs => (
@@ -79,6 +79,8 @@ function processElement(map, element, rootId) {
 function processInitialState(state, {style, variables, roots}) {
   return state.withMutations(map => {
     map = map.set('style', fromJS(style));
+    map = map.set('roots', initialState.get('roots'));
+    map = map.set('variables', initialState.get('variables'));
     for (const variable of Object.values(variables)) {
       map = newVariable(map, variable)
     }
@@ -105,6 +107,17 @@ function newElement(state, {id, rootId, index, data, parentId, elementType, prop
   return state.setIn(['roots', rootId, id], fromJS({index, id, parentId, data, elementType, props, children: [], propChildren}));
 }
 
+function reorderElements(state, {rootId, entries}) {
+  return state.withMutations(map => {
+    for (const {id, index, parentId} of entries) {
+      if (map.hasIn(['roots', rootId, id])) {
+        map = map.updateIn(['roots', rootId, id], element => element.merge({index, parentId}));
+      }
+    }
+    return map;
+  });
+}
+
 function removeElements(state, {entries}) {
   return state.withMutations(map => {
     for (const entry of entries) {
@@ -148,6 +161,17 @@ function updatePath(state, {id, rootId, updateData}){
   }
 }
 
+function tableRows(state, {id, rootId, offset, query, rows, rowCount, matchCount}) {
+  const dataPath = ['roots', rootId, id, 'data'];
+  if (!state.hasIn(dataPath)) {
+    return state;
+  }
+  return state.withMutations(map => {
+    map = map.setIn(dataPath.concat(['window']), fromJS({offset, query, rows, matchCount}));
+    return map.setIn(dataPath.concat(['rowCount']), rowCount);
+  });
+}
+
 function displayError(state, {error}) {
   return state.set('displayError', error);
 }
@@ -168,20 +192,32 @@ function reload(state) {
   return state.set('reload', state.get('reload') + 1);
 }
 
+function batch(state, {actions}) {
+  return state.withMutations(map => {
+    for (const action of actions) {
+      map = reducer(map, action);
+    }
+    return map;
+  });
+}
+
 const reducers = {
   processInitialState,
   processRoots,
   newElement,
   newPropChild,
   removeElements,
+  reorderElements,
   newVariable,
   updatePath,
+  tableRows,
   updateVariable,
   displayError,
   displayOptions,
   exportLoading,
   displayExportObjectResult,
-  reload
+  reload,
+  batch
 };
 
 function reducer(state = initialState, action) {
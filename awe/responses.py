@@ -0,0 +1,123 @@
+import gzip
+import io
+import re
+import threading
+import zlib
+
+import bottle
+import six
+
+from . import static
+
+# responses smaller than this number of bytes are not compressed
+COMPRESS_THRESHOLD = 1024
+# favor speed, as dynamic responses are compressed on the fly
+COMPRESS_LEVEL = 6
+
+
+def content_encoding():
+    """
+    :return: ``'gzip'`` if the current request accepts gzip encoded responses, otherwise ``None``.
+    """
+    return 'gzip' if 'gzip' in static.accepted_encodings() else None
+
+
+def compress(body, encoding):
+    """
+    :param body: The response body.
+    :param encoding: The content encoding accepted by the request. (see ``content_encoding``)
+    :return: A ``(body, encoding)`` tuple, where ``encoding`` is ``None`` if the body was not compressed.
+    """
+    if isinstance(body, six.text_type):
+        body = body.encode('utf-8')
+    if not encoding or len(body) < COMPRESS_THRESHOLD:
+        return body, None
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=COMPRESS_LEVEL, mtime=0) as f:
+        f.write(body)
+    return buffer.getvalue(), encoding
+
+
+def iter_compress(chunks, encoding):
+    """
+    Streaming version of ``compress``, for responses that are too large to build in memory.
+
+    :param chunks: Iterator over the response body chunks.
+    :param encoding: The content encoding accepted by the request. (see ``content_encoding``)
+    """
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if encoding else None
+    for chunk in chunks:
+        if isinstance(chunk, six.text_type):
+            chunk = chunk.encode('utf-8')
+        if compressor:
+            chunk = compressor.compress(chunk)
+        if chunk:
+            yield chunk
+    if compressor:
+        yield compressor.flush()
+
+
+def make_etag(token, version, encoding):
+    """
+    :param token: Distinguishes versions of different page instances.
+    :param version: The page version the response is based on.
+    :param encoding: The content encoding of the response, as different encodings of a response need different
+                     etags.
+    """
+    return '"{}-{}{}"'.format(token, version, '-{}'.format(encoding) if encoding else '')
+
+
+def etag_matches(etag):
+    if_none_match = bottle.request.headers.get('If-None-Match')
+    if not if_none_match:
+        return False
+    # weak comparison, as required for If-None-Match
+    return any(re.sub(r'^W/', '', tag.strip()) in (etag, '*') for tag in if_none_match.split(','))
+
+
+def not_modified(etag):
+    return bottle.HTTPResponse(status=304, headers={'ETag': etag, 'Vary': 'Accept-Encoding'})
+
+
+def set_headers(etag, encoding):
+    """
+    Set the headers of a (possibly) compressed response to a conditional request.
+    """
+    response = bottle.response
+    response.set_header('Vary', 'Accept-Encoding')
+    if etag:
+        response.set_header('ETag', etag)
+        response.set_header('Cache-Control', 'no-cache')
+    if encoding:
+        response.set_header('Content-Encoding', encoding)
+
+
+class VersionedCache(object):
+    """
+    Caches the last value built, for as long as the page version doesn't change.
+
+    Concurrent requests for the same version share a single build.
+    """
+
+    def __init__(self, build):
+        """
+        :param build: Function that builds the cached value.
+        """
+        self._build = build
+        self._lock = threading.Lock()
+        self._version = None
+        self._values = {}
+
+    def get(self, version, encoding=None):
+        """
+        :param version: The page version, read before calling ``get`` so the cached value is never older than it.
+        :param encoding: The content encoding accepted by the request. (see ``content_encoding``)
+        :return: A ``(value, encoding)`` tuple. (see ``compress``)
+        """
+        with self._lock:
+            if self._version != version:
+                self._values = {None: (self._build(), None)}
+                self._version = version
+            if encoding not in self._values:
+                self._values[encoding] = compress(self._values[None][0], encoding)
+            return self._values[encoding]
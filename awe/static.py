@@ -0,0 +1,169 @@
+import atexit
+import gzip
+import io
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+import bottle
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# content encodings in order of preference, and the extension of files compressed with them
+ENCODINGS = [
+    ('br', '.br'),
+    ('gzip', '.gz')
+]
+COMPRESSIBLE_MIMETYPES = ['application/javascript', 'application/json', 'image/svg+xml']
+MIN_COMPRESS_SIZE = 1024
+# files built with a content hash in their name never change
+HASHED_PATH = re.compile(r'(^|/)static/.+\.[0-9a-f]{8}\.')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+class StaticFiles(object):
+    """
+    Serves static files, compressed with the best encoding accepted by the client.
+
+    Compressed files built with the package (see ``compress_directory``) are served as is, other compressed files
+    are built once per process into a temporary directory. Compressed files are served as files, so they can be
+    sent by the server without being read into memory.
+    """
+
+    def __init__(self, root):
+        """
+        :param root: The static files root directory.
+        """
+        self._root = os.path.abspath(root)
+        self._cache_dir = None
+        self._compressed = {}
+        self._lock = threading.Lock()
+
+    def serve(self, path):
+        """
+        :param path: The requested file path, relative to the root directory.
+        """
+        filename = os.path.abspath(os.path.join(self._root, path))
+        if not filename.startswith(self._root + os.sep) or not os.path.isfile(filename):
+            # let bottle generate the appropriate error response
+            return bottle.static_file(path, self._root)
+        headers = {}
+        if HASHED_PATH.search(path):
+            headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = None
+        if is_compressible(filename, mimetype):
+            headers['Vary'] = 'Accept-Encoding'
+            for encoding in accepted_encodings():
+                compressed = self._get_compressed(filename, encoding)
+                if compressed:
+                    headers['Content-Encoding'] = encoding
+                    response = bottle.static_file(
+                        os.path.basename(compressed), os.path.dirname(compressed), mimetype=mimetype)
+                    break
+        if not response:
+            response = bottle.static_file(path, self._root, mimetype=mimetype)
+        for name, value in headers.items():
+            response.set_header(name, value)
+        return response
+
+    def _get_compressed(self, filename, encoding):
+        prebuilt = compressed_filename(filename, encoding)
+        if os.path.isfile(prebuilt):
+            return prebuilt
+        key = (filename, encoding)
+        with self._lock:
+            if key not in self._compressed:
+                self._compressed[key] = self._compress(filename, encoding)
+            return self._compressed[key]
+
+    def _compress(self, filename, encoding):
+        if self._cache_dir is None:
+            self._cache_dir = tempfile.mkdtemp(prefix='awe-static-')
+            atexit.register(shutil.rmtree, self._cache_dir, True)
+        target = compressed_filename(os.path.join(self._cache_dir, os.path.relpath(filename, self._root)), encoding)
+        target_dir = os.path.dirname(target)
+        if not os.path.isdir(target_dir):
+            os.makedirs(target_dir)
+        return compress_file(filename, target, encoding)
+
+
+def is_compressible(filename, mimetype):
+    if mimetypes.guess_type(filename)[1]:
+        # already encoded, e.g. foo.js.gz
+        return False
+    if not (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_MIMETYPES):
+        return False
+    return os.path.getsize(filename) >= MIN_COMPRESS_SIZE
+
+
+def compressed_filename(filename, encoding):
+    return filename + dict(ENCODINGS)[encoding]
+
+
+def compress_file(source, target, encoding):
+    """
+    :return: ``target``, or ``None`` when ``encoding`` is not available or doesn't make the file smaller.
+    """
+    if encoding == 'br' and not brotli:
+        return None
+    with open(source, 'rb') as f:
+        data = f.read()
+    if encoding == 'br':
+        compressed = brotli.compress(data)
+    else:
+        compressed = gzip_compress(data)
+    if len(compressed) >= len(data):
+        return None
+    with open(target, 'wb') as f:
+        f.write(compressed)
+    return target
+
+
+def gzip_compress(data):
+    # gzip.compress is not available in python 2
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=9, mtime=0) as f:
+        f.write(data)
+    return buffer.getvalue()
+
+
+def compress_directory(root):
+    """
+    Build compressed versions of all compressible files in a directory, e.g. while building the package.
+
+    :param root: The directory to compress.
+    """
+    for directory, _, filenames in os.walk(root):
+        for name in filenames:
+            filename = os.path.join(directory, name)
+            mimetype = mimetypes.guess_type(filename)[0] or ''
+            if not is_compressible(filename, mimetype):
+                continue
+            for encoding, _ in ENCODINGS:
+                compress_file(filename, compressed_filename(filename, encoding), encoding)
+
+
+def accepted_encodings():
+    """
+    :return: The content encodings accepted by the current request, in order of preference.
+    """
+    accepted = {}
+    for item in bottle.request.headers.get('Accept-Encoding', '').split(','):
+        name, _, params = item.partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0
+        accepted[name.strip().lower()] = quality
+    default = accepted.get('*', 0)
+    return [encoding for encoding, _ in ENCODINGS if accepted.get(encoding, default) > 0]
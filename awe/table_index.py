@@ -0,0 +1,452 @@
+"""
+Indexes over the rows of virtual tables, so clients can page through sorted, filtered and searched rows without the
+rows being sorted or scanned on every request.
+"""
+import bisect
+import itertools
+import numbers
+import operator
+import re
+
+import six
+
+ASCEND = 'ascend'
+DESCEND = 'descend'
+
+# ranks of values that can't be compared with each other, in ascending sort order
+NUMBER = 0
+STRING = 1
+BYTES = 2
+OTHER = 3
+MISSING = 4
+ORDERED_RANKS = (NUMBER, STRING, BYTES)
+
+# sorted column indexes are split into blocks of about this size, so adding a row only moves the rows of one block
+BLOCK_SIZE = 1000
+# indexes are rebuilt with a single sort, rather than updated row by row, when this fraction of their rows is added
+REBUILD_RATIO = 4
+# above this number of new words, the sorted list of words is sorted again rather than updated word by word
+INSORT_TOKENS_LIMIT = 64
+# query matches are sorted directly when they are at most this fraction of the rows, otherwise the sorted index is
+# scanned for them, which stops as soon as the requested page is complete
+SORT_MATCHES_RATIO = 16
+
+token_pattern = re.compile(r'\w+', re.UNICODE)
+
+
+_type_ranks = {type(None): MISSING, bool: NUMBER, float: NUMBER, six.text_type: STRING, six.binary_type: BYTES}
+_type_ranks.update((t, NUMBER) for t in six.integer_types)
+
+
+def value_rank(value):
+    rank = _type_ranks.get(type(value))
+    if rank is not None:
+        return rank
+    if isinstance(value, numbers.Real):
+        return NUMBER
+    if isinstance(value, six.text_type):
+        return STRING
+    if isinstance(value, six.binary_type):
+        return BYTES
+    return OTHER
+
+
+def sort_key(value, row_id):
+    """
+    :return: The key of a row in a sorted column, consistent with the order of ``ColumnIndex``.
+    """
+    rank = value_rank(value)
+    return rank, value if rank in ORDERED_RANKS else 0, row_id
+
+
+def tokenize(value):
+    """
+    :return: The lower case words of a cell value, only strings and numbers are tokenized.
+    """
+    if type(value) is six.text_type:
+        pass
+    elif isinstance(value, six.binary_type):
+        value = value.decode('utf-8', 'replace')
+    elif isinstance(value, numbers.Number):
+        value = six.text_type(value)
+    elif not isinstance(value, six.text_type):
+        return []
+    return token_pattern.findall(value.lower())
+
+
+class Rows(object):
+    """
+    Table rows, in table order. Rows are prepended in constant time, like they are appended, unlike at the start of
+    a list.
+    """
+
+    __slots__ = ('_head', '_tail')
+
+    def __init__(self, rows=None):
+        # prepended rows, newest last
+        self._head = []
+        self._tail = list(rows or [])
+
+    def __len__(self):
+        return len(self._head) + len(self._tail)
+
+    def __iter__(self):
+        return itertools.chain(reversed(self._head), self._tail)
+
+    def __getitem__(self, item):
+        head_size = len(self._head)
+        if not isinstance(item, slice):
+            if item < 0:
+                item += len(self)
+            if not 0 <= item < len(self):
+                raise IndexError('row index out of range')
+            return self._head[head_size - 1 - item] if item < head_size else self._tail[item - head_size]
+        start, stop, step = item.indices(len(self))
+        assert step == 1
+        result = []
+        if start < head_size:
+            result = self._head[head_size - min(stop, head_size):head_size - start][::-1]
+        if stop > head_size:
+            result.extend(self._tail[max(start - head_size, 0):stop - head_size])
+        return result
+
+    def append(self, row):
+        self._tail.append(row)
+
+    def prepend(self, row):
+        self._head.append(row)
+
+    def extend(self, rows):
+        self._tail.extend(rows)
+
+
+class Segment(object):
+    """
+    Values of a single rank and the matching row ids, in blocks of at most twice ``BLOCK_SIZE`` values.
+    """
+
+    __slots__ = ('values', 'ids', 'maxes')
+
+    def __init__(self):
+        self.values = []
+        self.ids = []
+        # the last value of each block
+        self.maxes = []
+
+    def insert(self, value, row_id, ordered):
+        if not self.values:
+            self.values.append([])
+            self.ids.append([])
+            self.maxes.append(value)
+        # rows are inserted after rows with an equal value
+        i = min(bisect.bisect_right(self.maxes, value), len(self.maxes) - 1) if ordered else len(self.maxes) - 1
+        values, ids = self.values[i], self.ids[i]
+        position = bisect.bisect_right(values, value) if ordered else len(values)
+        values.insert(position, value)
+        ids.insert(position, row_id)
+        self.maxes[i] = values[-1]
+        if len(values) > 2 * BLOCK_SIZE:
+            self.values[i:i + 1] = [values[:BLOCK_SIZE], values[BLOCK_SIZE:]]
+            self.ids[i:i + 1] = [ids[:BLOCK_SIZE], ids[BLOCK_SIZE:]]
+            self.maxes[i:i + 1] = [values[BLOCK_SIZE - 1], values[-1]]
+
+    def rebuild(self, entries, ordered):
+        """
+        :param entries: New ``(value, row_id)`` pairs.
+        """
+        merged = list(itertools.chain(six.moves.zip(self.flat(self.values), self.flat(self.ids)), entries))
+        if ordered:
+            # the sort is stable, so existing rows stay ahead of new rows with equal values
+            merged.sort(key=operator.itemgetter(0))
+        blocks = [merged[i:i + BLOCK_SIZE] for i in range(0, len(merged), BLOCK_SIZE)]
+        self.values = [[e[0] for e in block] for block in blocks]
+        self.ids = [[e[1] for e in block] for block in blocks]
+        self.maxes = [values[-1] for values in self.values]
+
+    @staticmethod
+    def flat(blocks):
+        return itertools.chain.from_iterable(blocks)
+
+
+class ColumnIndex(object):
+    """
+    Row ids of a table column, ordered by cell value.
+
+    Values of different ranks (see ``value_rank``) are kept in separate segments, so numbers and strings in the same
+    column don't have to be compared. Rows with equal values are kept in the order they were added.
+    """
+
+    __slots__ = ('_segments', '_size')
+
+    def __init__(self):
+        self._segments = [Segment() for _ in range(MISSING + 1)]
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, entries):
+        """
+        :param entries: ``(value, row_id)`` pairs, in the order the rows were added.
+        """
+        by_rank = {}
+        for entry in entries:
+            by_rank.setdefault(value_rank(entry[0]), []).append(entry)
+        for rank, new_entries in by_rank.items():
+            segment = self._segments[rank]
+            ordered = rank in ORDERED_RANKS
+            if len(new_entries) * REBUILD_RATIO > self._size:
+                segment.rebuild(new_entries, ordered)
+            else:
+                for value, row_id in new_entries:
+                    segment.insert(value, row_id, ordered)
+            self._size += len(new_entries)
+
+    def iter_ids(self, reverse=False):
+        """
+        :param reverse: Iterate in descending order.
+        """
+        return itertools.chain.from_iterable(reversed(ids) if reverse else ids for ids in self._id_blocks(reverse))
+
+    def slice_ids(self, start, stop, reverse=False):
+        """
+        :return: The ids in positions ``start`` to ``stop``, skipping whole blocks before ``start``.
+        """
+        result = []
+        for ids in self._id_blocks(reverse):
+            if stop <= 0:
+                break
+            size = len(ids)
+            if start < size:
+                result.extend((ids[::-1] if reverse else ids)[start:stop])
+            start = max(0, start - size)
+            stop -= size
+        return result
+
+    def equal_ids(self, value):
+        """
+        :return: The ids of rows whose value equals ``value``.
+        """
+        rank = value_rank(value)
+        segment = self._segments[rank]
+        if rank == MISSING:
+            return list(Segment.flat(segment.ids))
+        if rank not in ORDERED_RANKS:
+            return [i for v, i in six.moves.zip(Segment.flat(segment.values), Segment.flat(segment.ids)) if v == value]
+        result = []
+        for i in range(bisect.bisect_left(segment.maxes, value), len(segment.maxes)):
+            values = segment.values[i]
+            end = bisect.bisect_right(values, value)
+            result.extend(segment.ids[i][bisect.bisect_left(values, value):end])
+            if end < len(values):
+                break
+        return result
+
+    def _id_blocks(self, reverse):
+        segments = reversed(self._segments) if reverse else self._segments
+        return itertools.chain.from_iterable(reversed(s.ids) if reverse else s.ids for s in segments)
+
+
+class TokenIndex(object):
+    """
+    Row ids by the words in their cells.
+    """
+
+    __slots__ = ('_postings', '_tokens')
+
+    def __init__(self):
+        self._postings = {}
+        # sorted, for prefix searches
+        self._tokens = []
+
+    def add(self, entries):
+        """
+        :param entries: ``(values, row_id)`` pairs, ordered by row id.
+        """
+        new_tokens = []
+        postings = self._postings
+        for values, row_id in entries:
+            for value in values:
+                for token in tokenize(value):
+                    # most words are in a single row, their row id is kept as is rather than in a list
+                    ids = postings.get(token)
+                    if ids is None:
+                        postings[token] = row_id
+                        new_tokens.append(token)
+                    elif type(ids) is not list:
+                        if ids != row_id:
+                            postings[token] = [ids, row_id]
+                    elif ids[-1] != row_id:
+                        # row ids only increase, so lists take less memory than sets without holding duplicates
+                        ids.append(row_id)
+        if len(new_tokens) <= INSORT_TOKENS_LIMIT:
+            for token in new_tokens:
+                bisect.insort(self._tokens, token)
+        else:
+            self._tokens.extend(new_tokens)
+            self._tokens.sort()
+
+    def search(self, text):
+        """
+        :param text: The words to search for. The last word matches any word it is a prefix of, so results can be
+                     updated as the user types.
+        :return: The ids of rows that contain all words, or ``None`` when ``text`` has no words.
+        """
+        tokens = tokenize(text)
+        if not tokens:
+            return None
+        results = [self._ids(token) for token in tokens[:-1]]
+        results.append(self._prefix_ids(tokens[-1]))
+        results.sort(key=len)
+        return set(results[0]).intersection(*results[1:])
+
+    def _prefix_ids(self, prefix):
+        result = set()
+        for token in itertools.islice(self._tokens, bisect.bisect_left(self._tokens, prefix), None):
+            if not token.startswith(prefix):
+                break
+            result.update(self._ids(token))
+        return result
+
+    def _ids(self, token):
+        ids = self._postings.get(token, ())
+        return ids if type(ids) in (list, tuple) else (ids,)
+
+
+class TableIndex(object):
+    """
+    Answers sort, filter and search queries over the rows of a virtual table. (see ``Table.query_rows``)
+
+    Indexes are updated incrementally as rows are added, rows are never removed from a table one by one, so the
+    index is rebuilt from scratch only when all table rows are replaced.
+    """
+
+    __slots__ = ('_headers', '_sort_columns', '_search_columns', '_columns', '_tokens', '_rows_by_id', '_prepended')
+
+    def __init__(self, headers, sort_columns=None, search_columns=None):
+        """
+        :param headers: The table headers.
+        :param sort_columns: The headers of columns rows can be sorted by.
+        :param search_columns: The headers of columns searched for words, or ``None`` when rows can't be searched.
+        """
+        for header in (sort_columns or []) + (search_columns or []):
+            if header not in headers:
+                raise ValueError('Unknown column: {}'.format(header))
+        self._headers = headers
+        self._sort_columns = [(headers.index(h), h) for h in sort_columns or []]
+        self._search_columns = None if search_columns is None else [headers.index(h) for h in search_columns]
+        self.clear()
+
+    def clear(self):
+        self._columns = {header: ColumnIndex() for _, header in self._sort_columns}
+        self._tokens = None if self._search_columns is None else TokenIndex()
+        self._rows_by_id = {}
+        # rows are positioned by id: prepended rows come first, newest first, followed by all other rows oldest first
+        self._prepended = set()
+
+    def add(self, rows, prepend=False):
+        """
+        :param rows: The table rows that were added.
+        :param prepend: Whether the rows were added before existing rows.
+        """
+        for row in rows:
+            self._rows_by_id[row['id']] = row
+        if prepend:
+            self._prepended.update(row['id'] for row in rows)
+        for position, header in self._sort_columns:
+            self._columns[header].add([(row['data'][position], row['id']) for row in rows])
+        if self._tokens is not None:
+            self._tokens.add([([row['data'][p] for p in self._search_columns], row['id']) for row in rows])
+
+    def query(self, rows, offset, limit, sort=None, order=ASCEND, filters=None, search=None):
+        """
+        :param rows: The table rows, in table order.
+        :return: A ``(rows, count)`` tuple of the requested page of matching rows and the number of matching rows.
+        """
+        if order not in (ASCEND, DESCEND):
+            raise ValueError('Invalid sort order: {}'.format(order))
+        index = None
+        if sort is not None:
+            index = self._columns.get(sort)
+            if index is None:
+                raise ValueError('Table is not sortable by column: {}'.format(sort))
+        matches = None
+        if search:
+            if self._tokens is None:
+                raise ValueError('Table is not searchable')
+            matches = self._tokens.search(search)
+        for header, values in (filters or {}).items():
+            ids = self._filter(rows, header, values)
+            matches = ids if matches is None else matches & ids
+        reverse = index is not None and order == DESCEND
+        end = offset + limit
+        if matches is None:
+            if index is None:
+                return rows[offset:end], len(rows)
+            page_ids = index.slice_ids(offset, end, reverse)
+        elif len(matches) * SORT_MATCHES_RATIO <= len(rows):
+            page_ids = sorted(matches, key=self._sort_key(sort), reverse=reverse)[offset:end]
+        else:
+            ordered_ids = index.iter_ids(reverse) if index is not None else (row['id'] for row in rows)
+            page_ids = itertools.islice((i for i in ordered_ids if i in matches), offset, end)
+        count = len(rows) if matches is None else len(matches)
+        return [self._rows_by_id[row_id] for row_id in page_ids], count
+
+    def added_matches(self, added, page, limit, sort=None, order=ASCEND, filters=None, search=None):
+        """
+        Check how added rows change a page of a query, without running the query again.
+
+        :param added: The rows that were added since ``page`` was queried.
+        :param page: The rows of the page, as returned by ``query``.
+        :param limit: The number of rows requested for the page.
+        :return: The number of added rows that match the query, or ``None`` when added rows are in the page (or
+                 before it) so the page has to be queried again.
+        """
+        matching = [row for row in added if self._matches(row, filters, search)]
+        if not matching:
+            return 0
+        if len(page) < limit:
+            return None
+        key = self._sort_key(sort)
+        last = key(page[-1]['id'])
+        reverse = sort is not None and order == DESCEND
+        for row in matching:
+            # keys are unique, since they end with the row id
+            if (key(row['id']) > last) if reverse else (key(row['id']) < last):
+                return None
+        return len(matching)
+
+    def _matches(self, row, filters, search):
+        for header, values in (filters or {}).items():
+            if not isinstance(values, (list, tuple)):
+                values = [values]
+            if row['data'][self._headers.index(header)] not in values:
+                return False
+        tokens = tokenize(search) if search else None
+        if not tokens:
+            return True
+        row_tokens = set(itertools.chain.from_iterable(tokenize(row['data'][p]) for p in self._search_columns))
+        return (all(t in row_tokens for t in tokens[:-1]) and
+                any(t.startswith(tokens[-1]) for t in row_tokens))
+
+    def _filter(self, rows, header, values):
+        """
+        :param values: Rows match when their value is any of ``values``.
+        """
+        if header not in self._headers:
+            raise ValueError('Unknown column: {}'.format(header))
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        index = self._columns.get(header)
+        if index is not None:
+            return set(itertools.chain.from_iterable(index.equal_ids(v) for v in values))
+        position = self._headers.index(header)
+        return {row['id'] for row in rows if row['data'][position] in values}
+
+    def _sort_key(self, header):
+        if header is None:
+            prepended = self._prepended
+            return lambda row_id: (0, -row_id) if row_id in prepended else (1, row_id)
+        position = self._headers.index(header)
+        rows_by_id = self._rows_by_id
+        return lambda row_id: sort_key(rows_by_id[row_id]['data'][position], row_id)
@@ -1,5 +1,7 @@
 class Variable(object):
 
+    __slots__ = ('id', 'value', 'version')
+
     def __init__(self, value, variable_id=None):
         self.id = variable_id or str(id(self))
         self.value = value
@@ -1,15 +1,26 @@
+import bisect
+import threading
 from collections import deque
 
 import pydash
 import six
 from typing import List  # noqa
 
+from . import custom
 from . import variables
 from . import element_updater
+from . import table_index
 
 
 builtin_element_types = {}
 
+# the default number of rows in a page of a virtual table
+DEFAULT_VIRTUAL_PAGE_SIZE = 50
+# the maximum number of rows a client can fetch at once
+MAX_FETCH_ROWS = 1000
+# relative to their magnitude, the minimal spacing between child indices after making room for inserted children
+MIN_INDEX_SPACING = 2 ** -30
+
 
 def builtin(cls):
     builtin_element_types[cls.__name__] = cls
@@ -18,28 +29,62 @@ def builtin(cls):
 
 class Element(object):
 
+    # pages may hold a very large number of elements, so their attributes are stored in slots rather than a dict.
+    # subclasses that don't define __slots__ (e.g. custom elements) can still add any attributes.
+    __slots__ = ('root', 'id', 'parent', 'index', 'children', 'data', 'props', '_ref', '_prop_children',
+                 '_init_complete', '_removed', '_stack', '__weakref__')
+
     allow_children = True
 
     def __init__(self, root, parent, element_id, props, style, stack):
         self.root = root
         self.id = element_id or str(id(self))
-        self.root_id = getattr(root, 'id', self.id)
-        self.element_builder = getattr(root, 'element_builder', ElementBuilder(root))
-        self.element_type = type(self).__name__
         self.parent = parent  # type: Element
-        self.index = len(parent.children) + 1 if isinstance(parent, Element) else 0
-        self.children = []  # type: List[Element]
-        self.ref = Ref()
+        self.index = parent.children.next_index() if isinstance(parent, Element) else 0
+        self.children = Children(self)
+        self._ref = None
         self.data = {}
         self.props = props or {}
         self.props['key'] = self.id
         if style:
             self.props['style'] = style
-        self._prop_children = {}
+        # created when the first prop child is added, most elements have none
+        self._prop_children = None
         self._init_complete = False
         self._removed = False
         self._stack = stack
 
+    @property
+    def root_id(self):
+        return getattr(self.root, 'id', self.id)
+
+    @property
+    def element_type(self):
+        return type(self).__name__
+
+    @property
+    def element_builder(self):
+        """
+        Builds elements in new roots, e.g. to pass them as props. (see ``new_prop``)
+        """
+        return ElementBuilder(self.root)
+
+    @property
+    def prop_children(self):
+        """
+        Dict from prop names to the ids of the roots created for them. (see ``new_prop``)
+        """
+        return self._prop_children or {}
+
+    @property
+    def ref(self):
+        """
+        Elements created with a ``ref`` field by the parser. (created on first access)
+        """
+        if self._ref is None:
+            self._ref = Ref()
+        return self._ref
+
     def new_grid(self, columns, **kwargs):
         """
         Add a grid child.
@@ -62,15 +107,20 @@ class Element(object):
         """
         return self._new_child(Tabs, **kwargs)
 
-    def new_table(self, headers, page_size=None, **kwargs):
+    def new_table(self, headers, page_size=None, virtual=False, sort_columns=None, search=False, **kwargs):
         """
         Add a table child.
 
         :param headers: list of string headers or dict, in which case, it's keys are used.
         :param page_size: Optionally, enable table pagination by specifying a page size.
+        :param virtual: Keep rows on the server and send clients only the page they display.
+        :param sort_columns: Optionally, headers of columns virtual table rows can be sorted by on the server.
+        :param search: Make virtual table rows searchable on the server. ``True`` to search all columns, or a list of
+                       headers of the columns to search.
         :return: The created table element.
         """
-        return self._new_child(Table, headers=headers, page_size=page_size, **kwargs)
+        return self._new_child(Table, headers=headers, page_size=page_size, virtual=virtual,
+                               sort_columns=sort_columns, search=search, **kwargs)
 
     def new_button(self, function, text='', icon=None, shape=None, type='default', block=False, **kwargs):
         """
@@ -247,10 +297,10 @@ class Element(object):
         """
         assert self.parent
         assert prop not in self.props
-        assert prop not in self._prop_children
+        assert prop not in self.prop_children
         result = root or self._new_root()
-        self._prop_children[prop] = result.id
-        if self._init_complete:
+        self._add_prop_child(prop, result.id)
+        if self._init_complete and not self._is_batched():
             self._dispatch({
                 'type': 'newPropChild',
                 'id': result.id,
@@ -300,7 +350,8 @@ class Element(object):
             return
         self._register(custom_element_cls, obj_id=custom_element_cls.__name__)
         custom_element_cls._registered = True
-        self._dispatch({'type': 'refresh'})
+        # sent right away in batch scopes too, so clients load the component before its elements are created
+        self.root._dispatch(custom.register_component_action(custom_element_cls.__name__, custom_element_cls))
 
     def remove(self, element=None):
         """
@@ -313,6 +364,72 @@ class Element(object):
         assert parent
         return parent._remove_child(element)
 
+    def insert_before(self, obj, **kwargs):
+        """
+        Create a new element (see ``new``) and place it before this element.
+
+        :return: The created element.
+        """
+        assert self.parent
+        return self.parent.new(obj, before=self, **kwargs)
+
+    def insert_after(self, obj, **kwargs):
+        """
+        Create a new element (see ``new``) and place it after this element.
+
+        :return: The created element.
+        """
+        assert self.parent
+        return self.parent.new(obj, after=self, **kwargs)
+
+    def move(self, before=None, after=None, parent=None):
+        """
+        Move this element before or after another element, or to the end of the children of ``parent``.
+
+        The element keeps its state and is only repositioned by clients, rather than removed and created again.
+        Elements can only be moved within the root they were created in.
+
+        :param before: Place this element before the supplied element, as a child of its parent.
+        :param after: Place this element after the supplied element, as a child of its parent.
+        :param parent: Place this element after the existing children of the supplied element.
+        """
+        if len([e for e in (before, after, parent) if e is not None]) != 1:
+            raise ValueError('Exactly one of before, after or parent should be supplied')
+        assert self.parent and not self._removed
+        target = parent or (before or after).parent
+        if target.root is not self.root or not target.allow_children or target._removed:
+            raise ValueError('Cannot move element {} into {}'.format(self.id, target.id))
+        ancestor = target
+        while ancestor is not None:
+            if ancestor is self:
+                raise ValueError('Cannot move element {} into itself'.format(self.id))
+            ancestor = ancestor.parent
+        if before is self or after is self:
+            return
+        source = self.parent
+        source.children.remove(self)
+        self.parent = target
+        self.index = target._insert_index(before, after) if before or after else target.children.next_index()
+        target.children.add(self)
+        source._on_children_changed()
+        if target is not source:
+            target._on_children_changed()
+        if not self._is_batched():
+            self._reorder([self])
+
+    def batch(self):
+        """
+        Context manager that collects the changes made while it is active: created elements, variables and prop roots
+        and removed elements. They are sent to clients as a single action when the outermost batch scope exits,
+        instead of sending an action for each change. Other changes made in the scope, e.g. updates of existing
+        elements, are sent in the same action, after the created elements they may refer to.
+
+        Batches are per thread, changes made by other threads while a batch is active are sent as usual.
+
+        :return: The batch context manager.
+        """
+        return self.root.batch()
+
     def update_data(self, data):
         """
         Update element data.
@@ -359,7 +476,7 @@ class Element(object):
         Very low level method that dispatches an ``updateElement`` action to the react application running the page.
         Usually preceded by an internal element data update.
         """
-        if not self._init_complete:
+        if not self._init_complete or self._is_batched():
             return
         assert not self._removed
         self._dispatch({
@@ -416,7 +533,7 @@ class Element(object):
             'data': self.data,
             'parentId': (self.parent.id or None) if self.parent else None,
             'props': self.props,
-            'propChildren': self._prop_children
+            'propChildren': self.prop_children
         }
 
     def _get_view(self):
@@ -448,13 +565,15 @@ class Element(object):
                 prop_root = self._new_root()
                 roots[prop_root.id] = prop_root
                 process(prop_root, prop_child_conf)
-                element._prop_children[prop] = prop_root.id
+                element._add_prop_child(prop, prop_root.id)
             for child_conf in children:
                 process(element, child_conf)
             return element
 
         top_level = process(self, element_configuration)
         top_level.ref.refs.update(fields)
+        if self._get_batch():
+            return top_level
         dispatch_roots = {k: root._get_view() for k, root in roots.items()}
         dispatch_roots['root'] = [top_level._get_view()]
         self._dispatch({
@@ -463,6 +582,11 @@ class Element(object):
         })
         return top_level
 
+    def _add_prop_child(self, prop, root_id):
+        if self._prop_children is None:
+            self._prop_children = {}
+        self._prop_children[prop] = root_id
+
     def _new_child(self, element_type, **kwargs):
         assert self.allow_children
         assert not self._removed
@@ -471,6 +595,8 @@ class Element(object):
         style = kwargs.pop('style', None)
         element_id = kwargs.pop('id', None)
         updater = kwargs.pop('updater', None)
+        before = kwargs.pop('before', None)
+        after = kwargs.pop('after', None)
         skip_dispatch = kwargs.pop('_awe_skip_dispatch', None)
         arg = kwargs.pop('_awe_arg', None)
         args = [arg] if arg else []
@@ -483,6 +609,8 @@ class Element(object):
             style=style,
             stack=self._stack,
         )
+        if before or after:
+            result.index = self._insert_index(before, after)
         self._register(result)
         result._init(*args, **kwargs)
         if updater:
@@ -491,8 +619,14 @@ class Element(object):
                 updater=updater
             ))
         result._init_complete = True
-        self.children.append(result)
-        if not skip_dispatch:
+        self.children.add(result)
+        if before or after:
+            self._on_children_changed()
+        batch = self._get_batch()
+        if batch:
+            batch.elements.append(result)
+            batch.created.add(result.id)
+        elif not skip_dispatch:
             self._dispatch(result._get_new_element_action())
         return result
 
@@ -503,23 +637,71 @@ class Element(object):
         entries = element._remove()
         self._increase_version()
         self.children.remove(element)
-        self._dispatch({
-            'type': 'removeElements',
-            'entries': entries
-        })
+        batch = self._get_batch()
+        if batch:
+            batch.removed.extend(entries)
+        else:
+            self._dispatch({
+                'type': 'removeElements',
+                'entries': entries
+            })
+        self._on_children_changed()
         return entries
 
+    def _insert_index(self, before, after):
+        """
+        :return: The index of a child inserted before or after an existing child.
+        """
+        sibling = before or after
+        assert sibling.parent is self and not (before and after)
+        index = self.children.index_between(sibling, before=bool(before))
+        if index is None:
+            # the gap between the sibling indices is too small to split
+            self._reorder(self.children.make_room(sibling))
+            index = self.children.index_between(sibling, before=bool(before))
+        return index
+
+    def _reorder(self, elements):
+        if not elements:
+            return
+        self._increase_version()
+        entries = [{
+            'id': element.id,
+            'index': element.index,
+            'parentId': (element.parent.id or None) if element.parent else None
+        } for element in elements]
+        batch = self._get_batch()
+        if batch:
+            batch.reordered.extend((self.root_id, entry) for entry in entries)
+        else:
+            self._dispatch({
+                'type': 'reorderElements',
+                'rootId': self.root_id,
+                'entries': entries
+            })
+
+    def _on_children_changed(self):
+        """
+        Called when children are removed, moved or inserted before existing children.
+        """
+        pass
+
     def _new_variable(self, value, variable_id=None):
         assert not self._removed
         self._increase_version()
         variable = variables.Variable(value, variable_id)
         self._register(variable)
-        self._dispatch({
+        action = {
             'type': 'newVariable',
             'id': variable.id,
             'value': variable.value,
             'version': variable.version
-        })
+        }
+        batch = self._get_batch()
+        if batch:
+            batch.variables.append(action)
+        else:
+            self._dispatch(action)
         return variable
 
     def _new_root(self):
@@ -527,11 +709,15 @@ class Element(object):
         self._increase_version()
         result = Root(owner=self.root)
         self._register(result)
+        batch = self._get_batch()
+        if batch:
+            batch.roots.append(result)
+            batch.created.add(result.id)
         return result
 
     def _remove(self):
         entries = [{'id': self.id, 'rootId': self.root_id, 'type': 'element'}]
-        for prop_child_id in self._prop_children.values():
+        for prop_child_id in self.prop_children.values():
             entries.append({'id': prop_child_id, 'type': 'root'})
         for child in self.children:
             entries.extend(child._remove())
@@ -545,8 +731,21 @@ class Element(object):
     def _unregister(self, obj, obj_id=None):
         self.root._unregister(obj, obj_id)
 
-    def _dispatch(self, action):
-        self.root._dispatch(action)
+    def _dispatch(self, action, client_id=None):
+        batch = self._get_batch()
+        if batch and not client_id:
+            # sent when the batch scope exits, so they don't reach clients before the elements they refer to
+            batch.actions.append(action)
+        else:
+            self.root._dispatch(action, client_id)
+
+    def _get_batch(self):
+        return self.root._get_batch()
+
+    def _is_batched(self):
+        # elements created in a batch scope are dispatched with their final state when it exits
+        batch = self._get_batch()
+        return batch is not None and self.id in batch.created
 
     def _increase_version(self):
         self.root._increase_version()
@@ -567,6 +766,8 @@ class Element(object):
 
 class Root(Element):
 
+    __slots__ = ('_owner',)
+
     def __init__(self, owner, element_id=None):
         super(Root, self).__init__(
             root=self,
@@ -590,15 +791,287 @@ class Root(Element):
     def _unregister(self, obj, obj_id=None):
         self._owner._unregister(obj, obj_id)
 
+    def batch(self):
+        return self._owner.batch()
+
     def _dispatch(self, action, client_id=None):
-        self._owner._dispatch(action)
+        self._owner._dispatch(action, client_id)
+
+    def _get_batch(self):
+        return self._owner._get_batch()
 
     def _parse(self, obj, context):
         return self._owner._parse(obj, context)
 
 
+class Children(object):
+    """
+    The children of an element, ordered by their index.
+
+    Children are kept in blocks ordered by index (see ``table_index.Segment``), so inserting a child only moves the
+    children of one block, and are found by a binary search over their indices. Removed and moved children are only
+    dropped from the order when they make up half of it, so removal takes constant (amortized) time.
+
+    Positions of children are ``(block, offset)`` pairs.
+    """
+
+    # most elements have no children, so the blocks are created on first use
+    __slots__ = ('_owner', '_segment', '_count', '_stale')
+
+    def __init__(self, owner):
+        self._owner = owner  # type: Element
+        self._segment = None  # type: table_index.Segment
+        self._count = 0
+        self._stale = 0
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        if not self._segment:
+            return iter(())
+        return (element for index, element in self._entries() if self._is_live(index, element))
+
+    def __getitem__(self, item):
+        self._compact()
+        if isinstance(item, slice):
+            return list(self)[item]
+        if item < 0:
+            item += self._count
+        if 0 <= item < self._count:
+            for elements in self._segment.ids:
+                if item < len(elements):
+                    return elements[item]
+                item -= len(elements)
+        raise IndexError('children index out of range')
+
+    def __contains__(self, element):
+        return element.parent is self._owner and not element._removed
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def next_index(self):
+        """
+        :return: The index of a child added after all existing children.
+        """
+        last = self._last_live(self._last()) if self._segment else None
+        return self._index_at(last) + 1 if last is not None else 1
+
+    def add(self, element):
+        """
+        Add an element (whose parent is the owner of the children), in the position of its index.
+        """
+        if self._segment is None:
+            self._segment = table_index.Segment()
+        self._count += 1
+        position = self._find(element.index)
+        while position is not None and self._index_at(position) == element.index:
+            if self._element_at(position) is element:
+                # added again with the index it was removed with
+                self._stale -= 1
+                return
+            position = self._next(position)
+        self._segment.insert(element.index, element, ordered=True)
+
+    def remove(self, element):
+        """
+        Remove an element, which is then either marked as removed or given a different parent or index.
+        """
+        self._count -= 1
+        self._stale += 1
+        if self._stale > self._count:
+            self._compact()
+
+    def index_between(self, sibling, before):
+        """
+        :param sibling: An existing child.
+        :param before: Find an index before the sibling (``True``) or after it (``False``).
+        :return: An index between the sibling index and the index of its neighbour, or ``None`` if there is none.
+        """
+        position = self._find(sibling.index)
+        while self._element_at(position) is not sibling:
+            position = self._next(position)
+        if before:
+            neighbour = self._last_live(self._previous(position))
+            bound = self._index_at(neighbour) if neighbour is not None else sibling.index - 1
+        else:
+            neighbour = self._first_live(self._next(position))
+            bound = self._index_at(neighbour) if neighbour is not None else sibling.index + 1
+        index = (sibling.index + bound) / 2.0
+        return index if index not in (sibling.index, bound) else None
+
+    def make_room(self, sibling):
+        """
+        Spread out the indices of the children around a sibling, so that there is room to insert children next to it.
+
+        The indices are spread over the smallest window of children (doubling its size as needed) whose bounds
+        leave enough room between every two indices, so usually only a few children change.
+
+        :return: The children whose index changed.
+        """
+        self._compact()
+        segment = self._segment
+        # the position of the first child of each block, to address children by their position among all children
+        starts = [0]
+        for indices in segment.values[:-1]:
+            starts.append(starts[-1] + len(indices))
+
+        def locate(i):
+            block = bisect.bisect_right(starts, i) - 1
+            return block, i - starts[block]
+
+        def index_at(i):
+            return self._index_at(locate(i))
+        block, offset = self._find(sibling.index)
+        position = starts[block] + offset
+        count = self._count
+        size = 1
+        while True:
+            size *= 2
+            start = max(0, position - size)
+            end = min(count, position + size + 1)
+            if start == 0 and end == count:
+                low, high = 0, count + 1
+                break
+            low = index_at(start - 1) if start else index_at(0) - size
+            high = index_at(end) if end < count else index_at(count - 1) + size
+            if (high - low) / (end - start + 1) > max(abs(low), abs(high)) * MIN_INDEX_SPACING:
+                break
+        spacing = (high - low) / float(end - start + 1)
+        changed = []
+        for i in range(start, end):
+            index = low + spacing * (i - start + 1)
+            block, offset = locate(i)
+            element = segment.ids[block][offset]
+            if segment.values[block][offset] != index:
+                segment.values[block][offset] = element.index = index
+                changed.append(element)
+        for block in range(locate(start)[0], locate(end - 1)[0] + 1):
+            segment.maxes[block] = segment.values[block][-1]
+        return changed
+
+    def _entries(self):
+        return six.moves.zip(table_index.Segment.flat(self._segment.values),
+                             table_index.Segment.flat(self._segment.ids))
+
+    def _find(self, index):
+        """
+        :return: The position of the first child whose index is at least ``index``, or ``None`` if there is none.
+        """
+        block = bisect.bisect_left(self._segment.maxes, index)
+        if block == len(self._segment.maxes):
+            return None
+        return block, bisect.bisect_left(self._segment.values[block], index)
+
+    def _index_at(self, position):
+        return self._segment.values[position[0]][position[1]]
+
+    def _element_at(self, position):
+        return self._segment.ids[position[0]][position[1]]
+
+    def _last(self):
+        blocks = self._segment.values
+        return (len(blocks) - 1, len(blocks[-1]) - 1) if blocks else None
+
+    def _next(self, position):
+        block, offset = position
+        if offset + 1 < len(self._segment.values[block]):
+            return block, offset + 1
+        return (block + 1, 0) if block + 1 < len(self._segment.values) else None
+
+    def _previous(self, position):
+        block, offset = position
+        if offset:
+            return block, offset - 1
+        return (block - 1, len(self._segment.values[block - 1]) - 1) if block else None
+
+    def _is_live(self, index, element):
+        # moved children are added again with a different parent or index
+        return element.index == index and element.parent is self._owner and not element._removed
+
+    def _first_live(self, position):
+        while position is not None and not self._is_live(self._index_at(position), self._element_at(position)):
+            position = self._next(position)
+        return position
+
+    def _last_live(self, position):
+        while position is not None and not self._is_live(self._index_at(position), self._element_at(position)):
+            position = self._previous(position)
+        return position
+
+    def _compact(self):
+        if not self._stale:
+            return
+        live = [(index, element) for index, element in self._entries() if self._is_live(index, element)]
+        self._segment = table_index.Segment()
+        # already in order
+        self._segment.rebuild(live, ordered=False)
+        self._stale = 0
+
+
+class Batch(object):
+    """
+    The changes made in a batch scope. (see ``Element.batch``)
+    """
+
+    def __init__(self):
+        self.depth = 0
+        # ids of elements and roots created in the batch
+        self.created = set()
+        self.elements = []  # type: List[Element]
+        self.roots = []  # type: List[Root]
+        self.variables = []
+        self.removed = []
+        self.reordered = []
+        # other actions dispatched in the batch, e.g. updates of elements that existed before it
+        self.actions = []
+
+    def get_action(self):
+        """
+        :return: A single action that applies the batch changes, or ``None`` if nothing changed.
+        """
+        removed_ids = set(entry['id'] for entry in self.removed)
+        actions = []
+        # elements created and removed in the batch were never sent
+        removed = [entry for entry in self.removed if entry['id'] not in self.created]
+        if removed:
+            actions.append({'type': 'removeElements', 'entries': removed})
+        actions.extend(v for v in self.variables if v['id'] not in removed_ids)
+        roots = {}
+        for root in self.roots:
+            if root.id not in removed_ids:
+                roots[root.id] = root._get_view()
+        for element in self.elements:
+            # the views of other elements created in the batch already include their children
+            if element.parent.id not in self.created and not element._removed:
+                roots.setdefault(element.root_id, []).append(element._get_view())
+        if roots:
+            actions.append({'type': 'processRoots', 'roots': roots})
+        reordered = {}
+        for root_id, entry in self.reordered:
+            if entry['id'] not in self.created and entry['id'] not in removed_ids:
+                reordered.setdefault(root_id, []).append(entry)
+        actions.extend({'type': 'reorderElements', 'rootId': root_id, 'entries': entries}
+                       for root_id, entries in reordered.items())
+        # in order, after the created elements and roots they may refer to
+        actions.extend(a for a in self.actions
+                       if a.get('id') not in removed_ids and a.get('elementId') not in removed_ids)
+        if len(actions) > 1:
+            return {'type': 'batch', 'actions': actions}
+        return actions[0] if actions else None
+
+
 class ElementBuilder(object):
 
+    __slots__ = ('_owner',)
+
     def __init__(self, owner):
         self._owner = owner  # type: Element
 
@@ -613,6 +1086,8 @@ class ElementBuilder(object):
 
 class Ref(object):
 
+    __slots__ = ('refs',)
+
     def __init__(self):
         self.refs = {}
 
@@ -625,6 +1100,8 @@ class CustomElement(Element):
     Base class for all custom element implementations.
     """
 
+    __slots__ = ()
+
     _registered = False
     _scripts = []
     _styles = []
@@ -645,6 +1122,8 @@ class CustomElement(Element):
 
 class Raw(Element):
 
+    __slots__ = ()
+
     def _init(self, tag):
         self.update_data({'tag': tag})
 
@@ -652,26 +1131,50 @@ class Raw(Element):
 @builtin
 class Grid(Element):
 
+    __slots__ = ('_child_columns', '_inserted_columns')
+
     def _init(self, columns):
+        # the columns of each child by id, as childColumns is ordered like the children
+        self._child_columns = {}
+        self._inserted_columns = 1
         self.update_data({'columns': columns, 'childColumns': []})
         self.update_props({'gutter': 5}, override=False)
 
     def _new_child(self, cls, **kwargs):
         columns = kwargs.pop('cols', 1)
+        if kwargs.get('before') or kwargs.get('after'):
+            # childColumns is rebuilt by _on_children_changed once the child is inserted
+            self._inserted_columns = columns
+            try:
+                return super(Grid, self)._new_child(cls, **kwargs)
+            finally:
+                self._inserted_columns = 1
         self.data['childColumns'].append(columns)
         if not kwargs.get('_awe_skip_dispatch'):
             self.update_element(['data', 'childColumns'], action='append', data=columns)
-        return super(Grid, self)._new_child(cls, **kwargs)
+        result = super(Grid, self)._new_child(cls, **kwargs)
+        self._child_columns[result.id] = columns
+        return result
+
+    def _on_children_changed(self):
+        self._child_columns = {child.id: self._child_columns.get(child.id, self._inserted_columns)
+                               for child in self.children}
+        self.data['childColumns'] = [self._child_columns[child.id] for child in self.children]
+        self.update_element(['data', 'childColumns'], action='set', data=self.data['childColumns'])
 
 
 @builtin
 class Divider(Element):
+
+    __slots__ = ()
     allow_children = False
 
 
 @builtin
 class Collapse(Element):
 
+    __slots__ = ()
+
     def _init(self):
         self.update_props({'defaultActiveKey': []}, override=False)
 
@@ -701,6 +1204,8 @@ class Collapse(Element):
 @builtin
 class Panel(Element):
 
+    __slots__ = ('header',)
+
     def _init(self, header):
         if header:
             if isinstance(header, Element):
@@ -717,6 +1222,8 @@ class Panel(Element):
 @builtin
 class Text(Element):
 
+    __slots__ = ()
+
     allow_children = False
 
     def _init(self, text=''):
@@ -743,27 +1250,70 @@ class Text(Element):
 
 @builtin
 class Card(Text):
+
+    __slots__ = ()
     allow_children = True
 
 
 @builtin
 class Table(Element):
 
+    __slots__ = ('_rows', '_windows', '_index', '_lock')
+
     allow_children = False
 
-    def _init(self, headers, page_size=None):
+    def _init(self, headers, page_size=None, virtual=False, sort_columns=None, search=False):
         if isinstance(headers, dict):
             headers = list(headers.keys())
-        self.update_data({'headers': headers, 'rows': deque()})
+        if (sort_columns or search) and not virtual:
+            raise ValueError('Only virtual tables can be sorted and searched on the server')
+        if virtual:
+            # rows are kept on the server, clients fetch the page they display (see ``fetch_rows``)
+            page_size = page_size or DEFAULT_VIRTUAL_PAGE_SIZE
+            sort_columns = list(sort_columns or [])
+            search_columns = list(headers if search is True else search) if search else None
+            self._rows = table_index.Rows()
+            self._windows = {}
+            self._index = table_index.TableIndex(headers, sort_columns, search_columns)
+            # rows and windows are changed by the threads that add rows and by the threads handling client requests
+            self._lock = threading.RLock()
+            self.update_data({
+                'headers': headers,
+                'rows': [],
+                'virtual': True,
+                'rowCount': 0,
+                'sortColumns': sort_columns,
+                'searchable': bool(search)
+            })
+        else:
+            self._rows = None
+            self._windows = None
+            self._index = None
+            self._lock = None
+            self.update_data({'headers': headers, 'rows': deque()})
         self.update_props({
             'size': 'small',
             'pagination': {'pageSize': page_size, 'position': 'top'} if page_size else False
         }, override=False)
 
+    @property
+    def virtual(self):
+        return self._rows is not None
+
+    @property
+    def row_count(self):
+        return len(self._rows if self.virtual else self.data['rows'])
+
     def clear(self):
         """
         Clear all table rows.
         """
+        if self.virtual:
+            with self._lock:
+                self._rows = table_index.Rows()
+                self._index.clear()
+                self._rows_changed(0)
+            return
         if not self.data['rows']:
             return
         self.data['rows'] = deque()
@@ -775,6 +1325,14 @@ class Table(Element):
 
         :param rows: The rows to set.
         """
+        if self.virtual:
+            with self._lock:
+                self._rows = table_index.Rows()
+                self._rows.extend([self._row_data(r, i) for i, r in enumerate(rows)])
+                self._index.clear()
+                self._index.add(self._rows)
+                self._rows_changed(0)
+            return
         self.data['rows'] = deque([self._row_data(r, i) for i, r in enumerate(rows)])
         self.update_data(self.data)
 
@@ -800,11 +1358,74 @@ class Table(Element):
 
         :param rows: The rows to append.
         """
+        if self.virtual:
+            with self._lock:
+                rows_data = [self._row_data(r, i) for i, r in enumerate(rows)]
+                start = len(self._rows)
+                self._rows.extend(rows_data)
+                self._index.add(rows_data)
+                self._rows_changed(start, rows_data)
+            return
         rows_data = [self._row_data(r, i) for i, r in enumerate(rows)]
         self.data['rows'].extend(rows_data)
         self.update_element(path=['data', 'rows'], action='extend', data=rows_data)
 
+    def fetch_rows(self, client_id, offset, limit, query=None):
+        """
+        Send a client the rows of the page it displays, and keep it updated when rows in that page change.
+
+        Only applicable to virtual tables.
+
+        :param client_id: The client to send rows to.
+        :param offset: The position of the first row of the page.
+        :param limit: The number of rows in the page.
+        :param query: Optionally, keyword arguments of ``query_rows`` the page is taken from.
+        """
+        assert self.virtual
+        offset = max(0, int(offset))
+        limit = max(0, min(int(limit), MAX_FETCH_ROWS))
+        query = query or None
+        with self._lock:
+            self._send_window(client_id, offset, limit, query)
+
+    def release_rows(self, client_id):
+        """
+        Stop updating the page a client displays, e.g. once it disconnects. (see ``fetch_rows``)
+
+        :param client_id: The client that displayed the page.
+        """
+        with self._lock:
+            self._windows.pop(client_id, None)
+
+    def query_rows(self, offset=0, limit=DEFAULT_VIRTUAL_PAGE_SIZE, sort=None, order='ascend', filters=None,
+                   search=None):
+        """
+        Get a page of sorted, filtered and searched rows. Only applicable to virtual tables.
+
+        :param offset: The position of the first row of the page, among matching rows.
+        :param limit: The number of rows in the page.
+        :param sort: Optionally, the header of the column to sort rows by. It must be one of the table
+                     ``sort_columns``.
+        :param order: ``ascend`` or ``descend``.
+        :param filters: Optionally, a dict from headers to the values rows may have in that column.
+        :param search: Optionally, words rows must contain. Only applicable to tables created with ``search``.
+        :return: A ``(rows, count)`` tuple of the rows in the page and the number of matching rows.
+        """
+        assert self.virtual
+        with self._lock:
+            return self._index.query(self._rows, offset, limit, sort, order, filters, search)
+
     def _add_row(self, row, action):
+        if self.virtual:
+            with self._lock:
+                row_data = self._row_data(row)
+                if action == 'append':
+                    self._rows.append(row_data)
+                else:
+                    self._rows.prepend(row_data)
+                self._index.add([row_data], prepend=action == 'prepend')
+                self._rows_changed(len(self._rows) - 1 if action == 'append' else 0, [row_data])
+            return
         row_data = self._row_data(row)
         if action == 'append':
             self.data['rows'].append(row_data)
@@ -812,15 +1433,71 @@ class Table(Element):
             self.data['rows'].appendleft(row_data)
         self.update_element(path=['data', 'rows'], action=action, data=row_data)
 
+    def _rows_changed(self, start, added=None):
+        """
+        Send the new row count to all clients, and the rows of the pages they display to clients whose page has
+        changed.
+
+        :param start: The position of the first changed row.
+        :param added: The rows that were added, or ``None`` when all rows were replaced.
+        """
+        self.data['rowCount'] = len(self._rows)
+        self.update_element(path=['data', 'rowCount'], action='set', data=self.data['rowCount'])
+        if not self._init_complete:
+            return
+        for client_id, (offset, limit, query, rows, match_count) in list(self._windows.items()):
+            if not query:
+                if start < offset + limit:
+                    self._send_window(client_id, offset, limit, query)
+                continue
+            # the index tells whether added rows are in the page of a query, without running the query again
+            added_matches = None if added is None else self._index.added_matches(added, rows, limit, **query)
+            if added_matches is None:
+                self._send_window(client_id, offset, limit, query)
+            elif added_matches:
+                self._send_window(client_id, offset, limit, query, rows, match_count + added_matches)
+
+    def _send_window(self, client_id, offset, limit, query, rows=None, match_count=None):
+        """
+        :param rows: The rows of the page, when known to be unchanged, otherwise the page is queried.
+        :param match_count: The number of rows matching the query, along with ``rows``.
+        """
+        if rows is None:
+            rows, match_count = self.query_rows(offset, limit, **(query or {}))
+        # the window is kept once its query succeeded, so invalid queries aren't run again on every change
+        self._windows[client_id] = (offset, limit, query, rows, match_count)
+        self._dispatch({
+            'type': 'tableRows',
+            'id': self.id,
+            'rootId': self.root_id,
+            'offset': offset,
+            'query': query,
+            'rows': rows,
+            'rowCount': len(self._rows),
+            'matchCount': match_count
+        }, client_id)
+
+    def _get_new_element_action(self):
+        result = super(Table, self)._get_new_element_action()
+        if self.virtual:
+            # the first page is included, so it is displayed without waiting for the client to fetch it (and in
+            # exported pages)
+            page_size = self.props['pagination']['pageSize']
+            with self._lock:
+                result['data'] = dict(self.data, window={'offset': 0, 'rows': self._rows[:page_size]})
+        return result
+
     def _row_data(self, row, offset=0):
         if isinstance(row, dict):
             row = [row[h] for h in self.data['headers']]
-        return {'data': row, 'id': len(self.data['rows']) + 1 + offset}
+        return {'data': row, 'id': self.row_count + 1 + offset}
 
 
 @builtin
 class Button(Element):
 
+    __slots__ = ('_function',)
+
     allow_children = False
 
     def _init(self, function, text='', icon=None, shape=None, type='default', block=False):
@@ -862,6 +1539,8 @@ class Button(Element):
 @builtin
 class Input(Element):
 
+    __slots__ = ('_on_enter', '_variable')
+
     allow_children = False
 
     def _init(self, placeholder=None, on_enter=None):
@@ -885,6 +1564,8 @@ class Input(Element):
 @builtin
 class Tabs(Element):
 
+    __slots__ = ()
+
     def _init(self):
         self.update_props({'size': 'small', 'animated': False}, override=False)
 
@@ -905,6 +1586,8 @@ class Tabs(Element):
 @builtin
 class Tab(Element):
 
+    __slots__ = ()
+
     def _init(self, name):
         self.update_props({'tab': name}, override=False)
 
@@ -912,6 +1595,8 @@ class Tab(Element):
 @builtin
 class Icon(Element):
 
+    __slots__ = ()
+
     def _init(self, type, theme='outlined', spin=False, two_tone_color=None):
         assert theme in ['outlined', 'filled', 'twoTone']
         assert (not two_tone_color) or theme == 'twoTone'
@@ -925,11 +1610,15 @@ class Icon(Element):
 
 @builtin
 class Inline(Text):
+
+    __slots__ = ()
     allow_children = True
 
 
 @builtin
 class Markdown(Element):
+
+    __slots__ = ()
     allow_children = False
 
     def _init(self, source):
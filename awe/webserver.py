@@ -3,11 +3,17 @@ import threading
 import traceback
 
 import bottle
+import six
+
+from . import resources
+from . import responses
+from . import static
 
 
 class WebServer(object):
 
-    def __init__(self, exporter, host, port, websocket_port, custom_component, encoder, api):
+    def __init__(self, exporter, host, port, websocket_port, custom_component, encoder, api, get_version,
+                 etag_token):
         self._api = api
         self._host = host
         self._port = port
@@ -16,18 +22,28 @@ class WebServer(object):
         self._custom_component = custom_component
         self._encoder = encoder
         self._get_initial_state = exporter.get_initial_state
+        self._get_version = get_version
+        self._initial_state_cache = responses.VersionedCache(
+            lambda: self._encoder.to_json_bytes(self._get_initial_state()))
+        self._etag_token = etag_token
         self._client_root = exporter.client_root
-        self._content_root = os.path.join(os.path.dirname(__file__), 'resources', self._client_root)
+        self._content_root = os.path.join(resources.DIR, self._client_root)
+        self._static_files = static.StaticFiles(self._content_root)
         self._app = bottle.Bottle()
         self._app.get('/', callback=self._index)
         self._app.get('/initial-state', callback=self._initial_state)
         self._app.get('/export', callback=self._export)
         self._app.get('/static/<path:path>', callback=self._get_static_file)
         self._app.get('/custom-components', callback=self._components)
+        self._app.get('/custom-components/<script_hash>', callback=self._components)
         self._api.register(self._app)
         self._thread = threading.Thread(target=self._run)
         self._thread.daemon = True
 
+    @property
+    def app(self):
+        return self._app
+
     def start(self):
         self._thread.start()
 
@@ -39,22 +55,54 @@ class WebServer(object):
         return self._exporter.get_index_html(websocket_port=self._websocket_port)
 
     def _get_static_file(self, path):
-        return bottle.static_file(path, self._content_root)
+        return self._static_files.serve(path)
 
     def _initial_state(self):
+        version = self._get_version()
+        encoding = responses.content_encoding()
+        etag = responses.make_etag(self._etag_token, version, encoding)
+        if responses.etag_matches(etag):
+            return responses.not_modified(etag)
+        body, encoding = self._initial_state_cache.get(version, encoding)
         bottle.response.content_type = 'application/json'
-        return self._encoder.to_json(self._get_initial_state())
+        responses.set_headers(etag, encoding)
+        return body
 
     def _export(self):
+        version = self._get_version()
+        encoding = responses.content_encoding()
+        if self._exporter.export_fn == self._exporter.default_export_fn:
+            etag = responses.make_etag(self._etag_token, version, encoding)
+            if responses.etag_matches(etag):
+                return responses.not_modified(etag)
+            # streamed, as exports of large pages may not fit in memory more than once
+            bottle.response.content_type = 'application/octet-stream'
+            responses.set_headers(etag, encoding)
+            return responses.iter_compress(self._exporter.iter_export(), encoding)
+        # custom export functions may have side effects, so they are called on every request
         try:
             result = self._exporter.export()
-            if not isinstance(result, dict):
-                bottle.response.content_type = 'application/octet-stream'
-            return result
         except Exception:
             bottle.response.status = 400
             return {'error': traceback.format_exc()}
+        if isinstance(result, dict):
+            return result
+        bottle.response.content_type = 'application/octet-stream'
+        if not isinstance(result, (six.text_type, six.binary_type)):
+            return result
+        body, encoding = responses.compress(result, encoding)
+        responses.set_headers(None, encoding)
+        return body
 
-    def _components(self):
+    def _components(self, script_hash=None):
+        script, current_hash = self._custom_component.combined_script_with_hash()
+        encoding = responses.content_encoding()
+        etag = responses.make_etag(self._etag_token, current_hash, encoding)
+        if responses.etag_matches(etag):
+            return responses.not_modified(etag)
+        body, encoding = responses.compress(script, encoding)
         bottle.response.content_type = 'text/javascript'
-        return self._custom_component.combined_script()
+        responses.set_headers(etag, encoding)
+        if script_hash == current_hash:
+            bottle.response.set_header('Cache-Control', static.IMMUTABLE_CACHE_CONTROL)
+        return body
@@ -1,8 +1,12 @@
 import sys
 import threading
+from collections import deque
 
 import six
 import txaio
+from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
+
+from . import encoding
 
 if six.PY2:
     from twisted.python import log
@@ -14,43 +18,257 @@ else:
     reactor = None
     from autobahn.asyncio import websocket
     import asyncio
+    from . import httpserver
+
+
+BLOCK = 'block'
+DROP = 'drop'
+RESYNC = 'resync'
+SLOW_CONSUMER_POLICIES = [BLOCK, DROP, RESYNC]
+
+# placeholder of pending actions that are being encoded
+ENCODING = object()
+
+DEFAULT_COMPRESSION = {
+    'window_bits': 15,
+    'mem_level': 8,
+    'threshold': 1024
+}
+# the deflate window sizes autobahn accepts
+MIN_WINDOW_BITS = 9
+MAX_WINDOW_BITS = 15
 
 
 class Connection(websocket.WebSocketServerProtocol):
 
+    message_format = encoding.JSON
+
+    def __init__(self):
+        super(Connection, self).__init__()
+        self.stats = {
+            'outgoing_messages': 0,
+            'outgoing_octets': 0,
+            'outgoing_compressed_octets': 0,
+            'dropped_messages': 0,
+            'resyncs': 0
+        }
+        # messages are queued while the transport is paused due to a full write buffer.
+        # queue entries are [payloads, prepared] lists, payloads is set to None once the entry is sent or dropped
+        self.queue = deque()
+        self.queue_depth = 0
+        self.queue_coalescer = Coalescer()
+        self.paused = False
+        # the last action version applied by a reconnecting client, and the token of the page instance it came from
+        self.resume_version = None
+        self.resume_token = None
+
+    def on_connect(self, request):
+        version = request.params.get('version')
+        if version:
+            try:
+                self.resume_version = int(version[0])
+            except ValueError:
+                pass
+            self.resume_token = (request.params.get('token') or [None])[0]
+        for message_format in self.factory.encoder.formats:
+            protocol = subprotocol(message_format)
+            if protocol in request.protocols:
+                self.message_format = message_format
+                return protocol
+        return None
+
     def on_open(self):
+        if six.PY2:
+            self.transport.registerProducer(self, True)
         client_id = str(id(self))
         self.factory.open_connections[client_id] = self
+        self.factory.update_formats()
         action = {'type': 'setClientId', 'clientId': client_id}
-        message = self.factory.encoder.to_json(action)
-        self.dispatch(message)
+        self.dispatch(self.factory.encode(action, [self.message_format]))
+        if self.resume_version is not None:
+            self.resume(self.resume_version, self.resume_token)
 
-    def on_message(self, payload, _):
-        message = self.factory.encoder.from_json(payload)
+    def on_message(self, payload, is_binary):
+        message_format = encoding.MSGPACK if is_binary else encoding.JSON
+        message = self.factory.encoder.decode(payload, message_format)
         self.factory.message_handler.handle(message)
 
     def on_close(self, *_):
-        self.factory.open_connections.pop(str(id(self)), None)
+        client_id = str(id(self))
+        if self.factory.open_connections.pop(client_id, None) and self.factory.message_handler:
+            self.factory.message_handler.client_closed(client_id)
+        self.factory.update_formats()
+        self.factory.update_writable()
+
+    def resume(self, version, token=None):
+        """
+        Sends a reconnecting client the actions it missed, or a resync action, when they are no longer available.
+
+        :param version: The last action version applied by the client.
+        :param token: The instance token of the page the client applied ``version`` of.
+        """
+        factory = self.factory
+        missed = factory.action_log.since(version) if token == factory.instance_token else None
+        if missed is None:
+            self.resync()
+            self.drain()
+        elif missed:
+            missed = [{self.message_format: factory.transcode(payloads, self.message_format)} for payloads in missed]
+            self.dispatch(factory.batch(missed))
+
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+        self.drain()
+
+    def stop_producing(self):
+        pass
+
+    def dispatch(self, payloads, prepared=None, key=None):
+        """
+        :param payloads: The message encoded in one or more wire formats, keyed by format.
+        :param prepared: Optional dict, shared by all connections a message is broadcast to, that caches the message
+                         websocket frame for each format, so it is only built once.
+        :param key: The message coalesce key. (see ``coalesce_key``)
+        """
+        if not self.paused and not self.queue:
+            self.send(payloads, prepared)
+        else:
+            self.enqueue(payloads, prepared, key)
 
-    def dispatch(self, message):
-        if six.PY3:
-            message = bytes(message, encoding='utf-8')
-        self.sendMessage(message)
+    def coalesces(self):
+        """
+        :return: Whether messages are queued with the 'drop' policy, which needs them one by one, with their coalesce
+                 key.
+        """
+        return self.factory.slow_consumer_policy == DROP and (self.paused or bool(self.queue))
 
+    def enqueue(self, payloads, prepared, key):
+        factory = self.factory
+        entry = [payloads, prepared]
+        superseded = self.queue_coalescer.add(key, entry) if factory.slow_consumer_policy == DROP else None
+        if superseded and superseded[0] is not None:
+            superseded[0] = None
+            self.queue_depth -= 1
+            self.stats['dropped_messages'] += 1
+        elif factory.send_queue_size and self.queue_depth >= factory.send_queue_size:
+            if factory.slow_consumer_policy != BLOCK:
+                self.resync()
+        self.queue.append(entry)
+        self.queue_depth += 1
+        factory.update_writable()
+
+    def drain(self):
+        while self.queue and not self.paused:
+            entry = self.queue.popleft()
+            payloads, prepared = entry
+            if payloads is None:
+                continue
+            entry[0] = None
+            self.queue_depth -= 1
+            self.send(payloads, prepared)
+        if not self.queue:
+            self.queue_coalescer.clear()
+        self.factory.update_writable()
+
+    def resync(self):
+        """
+        Drop all queued messages and make the client fetch the full page state again.
+        """
+        for entry in self.queue:
+            entry[0] = None
+        self.queue.clear()
+        self.queue_coalescer.clear()
+        self.queue.append([self.factory.encode({'type': 'resync'}, [self.message_format]), None])
+        self.queue_depth = 1
+        self.stats['resyncs'] += 1
+
+    def send(self, payloads, prepared=None):
+        message_format = self.message_format
+        payload = payloads.get(message_format)
+        if payload is None:
+            # clients that negotiated a binary format can still read json messages
+            message_format = encoding.JSON
+            payload = payloads.get(message_format)
+        if payload is None:
+            # only possible for messages encoded before this connection was opened
+            payload = self.factory.transcode(payloads, message_format)
+        is_binary = message_format != encoding.JSON
+        do_not_compress = len(payload) < self.factory.compression_threshold
+        octets_before = self.trafficStats.outgoingOctetsWebSocketLevel
+        if prepared is None:
+            self.sendMessage(payload, isBinary=is_binary, doNotCompress=do_not_compress)
+        else:
+            if message_format not in prepared:
+                prepared[message_format] = self.factory.prepareMessage(
+                    payload,
+                    isBinary=is_binary,
+                    doNotCompress=do_not_compress
+                )
+            self.sendPreparedMessage(prepared[message_format])
+        # uncompressed prepared messages are written directly and not tracked in autobahn's traffic stats
+        sent_octets = self.trafficStats.outgoingOctetsWebSocketLevel - octets_before
+        self.stats['outgoing_messages'] += 1
+        self.stats['outgoing_octets'] += len(payload)
+        self.stats['outgoing_compressed_octets'] += sent_octets or len(payload)
+
+    def get_stats(self):
+        result = dict(self.stats)
+        result['message_format'] = self.message_format
+        result['compression'] = self._perMessageCompress is not None
+        result['queue_depth'] = self.queue_depth
+        result['paused'] = self.paused
+        result['compression_ratio'] = (
+            float(result['outgoing_compressed_octets']) / result['outgoing_octets']
+            if result['outgoing_octets'] else None
+        )
+        return result
+
+    onConnect = on_connect
     onOpen = on_open
     onMessage = on_message
     onClose = on_close
+    pauseProducing = pause_writing
+    resumeProducing = resume_writing
+    stopProducing = stop_producing
 
 
 class WebSocketServer(websocket.WebSocketServerFactory):
 
-    def __init__(self, message_handler, encoder, host, port):
+    def __init__(self, message_handler, encoder, host, port, flush_interval=None, compression=None,
+                 send_queue_size=None, slow_consumer_policy=RESYNC, action_log_size=1000, instance_token=None):
         super(WebSocketServer, self).__init__('ws://{}:{}'.format(host, port))
+        assert slow_consumer_policy in SLOW_CONSUMER_POLICIES
+        self.send_queue_size = send_queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self.writable = threading.Event()
+        self.writable.set()
+        if compression:
+            self.compression = dict(DEFAULT_COMPRESSION)
+            if isinstance(compression, dict):
+                self.compression.update(compression)
+            self.compression['window_bits'] = clamp_window_bits(self.compression['window_bits'])
+            self.compression_threshold = self.compression['threshold']
+            self.setProtocolOptions(perMessageCompressionAccept=self.accept_compression)
+        else:
+            self.compression = None
+            self.compression_threshold = 0
         self.protocol = Connection
         self.config = {'host': host, 'port': port}
         self.open_connections = {}
         self.message_handler = message_handler
         self.encoder = encoder
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.pending_coalescer = Coalescer()
+        self.pending_lock = threading.Lock()
+        self.flush_scheduled = False
+        self.formats = [encoding.JSON]
+        self.action_log = ActionLog(action_log_size)
+        self.instance_token = instance_token
+        self.http_app = None
         self.thread = threading.Thread(target=self.run)
         self.thread.daemon = True
         self.loop = None
@@ -58,6 +276,14 @@ class WebSocketServer(websocket.WebSocketServerFactory):
     def start(self):
         self.thread.start()
 
+    def serve_http(self, app):
+        """
+        Serve a WSGI application from the websocket server port. (python 3 only)
+
+        :param app: The WSGI application.
+        """
+        self.http_app = app
+
     def run(self):
         if six.PY2:
             log.startLogging(sys.stdout)
@@ -67,18 +293,270 @@ class WebSocketServer(websocket.WebSocketServerFactory):
             self.loop = asyncio.new_event_loop()
             asyncio.set_event_loop(self.loop)
             txaio.config.loop = self.loop
-            future = self.loop.create_server(self, self.config['host'], self.config['port'])
+            if self.http_app:
+                future = httpserver.create_server(
+                    self.http_app, self, self.config['host'], self.config['port'], self.loop)
+            else:
+                future = self.loop.create_server(self, self.config['host'], self.config['port'])
             self.loop.run_until_complete(future)
             self.loop.run_forever()
 
-    def dispatch(self, message, client_id=None):
-        connections = [self.open_connections[client_id]] if client_id else list(self.open_connections.values())
+    def accept_compression(self, offers):
+        for offer in offers:
+            if not isinstance(offer, PerMessageDeflateOffer):
+                continue
+            # attribute and keyword names differ between autobahn versions
+            requested_window_bits = getattr(offer, 'request_max_window_bits', None)
+            if requested_window_bits is None:
+                requested_window_bits = getattr(offer, 'requestMaxWindowBits', 0)
+            window_bits = self.compression['window_bits']
+            if requested_window_bits:
+                window_bits = min(window_bits, requested_window_bits)
+            window_bits = clamp_window_bits(window_bits)
+            return PerMessageDeflateOfferAccept(offer, False, 0, None, window_bits, self.compression['mem_level'])
+        return None
+
+    def get_stats(self):
+        return {client_id: connection.get_stats() for client_id, connection in list(self.open_connections.items())}
+
+    def update_formats(self):
+        formats = {connection.message_format for connection in self.open_connections.values()}
+        self.formats = list(formats) or [encoding.JSON]
+
+    def encode(self, action, formats=None):
+        return {message_format: self.encoder.encode(action, message_format)
+                for message_format in formats or self.formats}
+
+    def update_writable(self):
+        if self.slow_consumer_policy != BLOCK or not self.send_queue_size:
+            return
+        if any(c.queue_depth >= self.send_queue_size for c in list(self.open_connections.values())):
+            self.writable.clear()
+        else:
+            self.writable.set()
+
+    def dispatch(self, payloads, client_id=None, key=None, version=None):
+        if client_id:
+            connection = self.open_connections.get(client_id)
+            if connection:
+                connection.dispatch(payloads, key=key)
+        else:
+            self.action_log.append(version, payloads)
+            self.broadcast(payloads, list(self.open_connections.values()), key)
+
+    @staticmethod
+    def broadcast(payloads, connections, key=None):
+        prepared = {} if len(connections) > 1 else None
         for connection in connections:
-            connection.dispatch(message)
+            connection.dispatch(payloads, prepared, key)
+
+    def dispatch_from_thread(self, action, client_id, next_version=None):
+        """
+        Queue an action, to be sent from the websocket server thread.
+
+        All actions queued until the queue is flushed are sent together, waking the websocket server thread
+        once per flush instead of once per action.
+
+        :param action: The action to send.
+        :param client_id: Optional client to send the action to, the action is broadcast when not set.
+        :param next_version: Optional function that returns the action version. It is called while the queue is
+                             locked, so that the queue is always ordered by version. The action is encoded after
+                             the lock is released.
+        """
+        # wait for slow clients to catch up, when the 'block' slow consumer policy is used
+        self.writable.wait()
+        key = coalesce_key(action)
+        with self.pending_lock:
+            if next_version:
+                action['version'] = next_version()
+            # the entry holds its place in the queue while the action is encoded
+            entry = [ENCODING, client_id, action.get('version'), key]
+            if not client_id:
+                # Only the last 'set' of each element path in a flush is sent.
+                superseded = self.pending_coalescer.add(key, entry)
+                if superseded:
+                    superseded[0] = None
+            self.pending.append(entry)
+        # actions are encoded immediately, as the objects they reference may be mutated before the next flush.
+        # encoding large actions doesn't hold the lock, so other threads can queue actions meanwhile
+        payloads = self.encode(action)
+        with self.pending_lock:
+            if entry[0] is ENCODING:
+                entry[0] = payloads
+            if self.flush_scheduled:
+                return
+            self.flush_scheduled = True
+        if self.flush_interval:
+            self._call_from_thread(self._call_later, self.flush_interval, self.flush)
+        else:
+            self._call_from_thread(self.flush)
+
+    def flush(self):
+        with self.pending_lock:
+            # entries after one that is still being encoded are left for the flush scheduled once it is encoded
+            ready = next((i for i, entry in enumerate(self.pending) if entry[0] is ENCODING), len(self.pending))
+            pending = [entry for entry in self.pending[:ready] if entry[0]]
+            self.pending = self.pending[ready:]
+            self.pending_coalescer.clear()
+            self.flush_scheduled = False
+        if not pending:
+            return
+        targeted = {client_id for _, client_id, _, _ in pending if client_id}
+        broadcast = []
+        for payloads, client_id, version, key in pending:
+            if not client_id:
+                self.action_log.append(version, payloads)
+                broadcast.append((payloads, key))
+        broadcast_connections = []
+        for client_id, connection in list(self.open_connections.items()):
+            if client_id in targeted:
+                self.dispatch_entries(connection, [(p, k) for p, c, _, k in pending if not c or c == client_id])
+            elif not broadcast:
+                continue
+            elif connection.coalesces():
+                self.dispatch_entries(connection, broadcast)
+            else:
+                broadcast_connections.append(connection)
+        if broadcast_connections:
+            self.broadcast(self.batch([payloads for payloads, _ in broadcast]), broadcast_connections)
+
+    def dispatch_entries(self, connection, entries):
+        """
+        :param entries: ``(payloads, key)`` pairs, sent as a single batch, unless their coalesce keys are needed to
+                        drop superseded entries from the connection queue.
+        """
+        if connection.coalesces():
+            for payloads, key in entries:
+                connection.dispatch(payloads, key=key)
+        else:
+            connection.dispatch(self.batch([payloads for payloads, _ in entries]))
 
-    def dispatch_from_thread(self, action, client_id):
-        message = self.encoder.to_json(action)
+    def batch(self, payloads_list):
+        formats = set.intersection(*[set(payloads) for payloads in payloads_list])
+        if not formats:
+            formats = {encoding.JSON}
+            payloads_list = [{encoding.JSON: self.transcode(p, encoding.JSON)} for p in payloads_list]
+        return {message_format: self.encoder.encode_batch([p[message_format] for p in payloads_list], message_format)
+                for message_format in formats}
+
+    def transcode(self, payloads, message_format):
+        if message_format in payloads:
+            return payloads[message_format]
+        source_format, payload = next(iter(payloads.items()))
+        return self.encoder.encode(self.encoder.decode(payload, source_format), message_format)
+
+    def _call_from_thread(self, fn, *args):
+        if six.PY2:
+            reactor.callFromThread(fn, *args)
+        else:
+            self.loop.call_soon_threadsafe(fn, *args)
+
+    def _call_later(self, delay, fn):
         if six.PY2:
-            reactor.callFromThread(self.dispatch, message, client_id)
+            reactor.callLater(delay, fn)
         else:
-            self.loop.call_soon_threadsafe(self.dispatch, message, client_id)
+            self.loop.call_later(delay, fn)
+
+
+class ActionLog(object):
+    """
+    Bounded log of the last broadcast actions, used to send reconnecting clients only the actions they missed.
+
+    Only accessed from the websocket server thread.
+    """
+
+    def __init__(self, size):
+        """
+        :param size: Maximum number of logged actions. ``0`` disables the log.
+        """
+        self.size = size
+        self.entries = deque()
+        # clients that applied this version (or a later one) are guaranteed to find all actions they missed in the log.
+        # actions with earlier versions were either evicted or dispatched before the page was started, and are
+        # included in the initial state of any client connected at that time.
+        self.floor = 0
+        # the version of the last logged action, clients that applied a later version got it from another page
+        # instance, e.g. before the server was restarted
+        self.latest = 0
+
+    def start(self, version):
+        """
+        :param version: The page version when the page is started.
+        """
+        self.floor = self.latest = version
+
+    def append(self, version, payloads):
+        if version is None:
+            return
+        self.latest = version
+        if not self.size:
+            self.floor = version
+            return
+        if len(self.entries) >= self.size:
+            self.floor = self.entries.popleft()[0]
+        self.entries.append((version, payloads))
+
+    def since(self, version):
+        """
+        :param version: The last action version applied by a client.
+        :return: The payloads of all logged actions with a later version, or ``None`` if some of them were evicted or
+                 the version is unknown.
+        """
+        if not self.floor <= version <= self.latest:
+            return None
+        return [payloads for entry_version, payloads in self.entries if entry_version > version]
+
+
+class Coalescer(object):
+    """
+    Tracks the last pending 'set' update of each element path.
+
+    Any other update of an element (e.g. append) makes previous sets on that element order sensitive, so they
+    are no longer tracked. Non element update actions (e.g. newElement) have the same effect on all tracked sets.
+    """
+
+    def __init__(self):
+        self.sets = {}
+
+    def add(self, key, entry):
+        """
+        :param key: The entry coalesce key. (see ``coalesce_key``)
+        :param entry: The pending entry.
+        :return: The pending entry superseded by ``entry``, if any.
+        """
+        if not key:
+            self.sets.clear()
+            return None
+        element_key, path_key = key
+        if not path_key:
+            self.sets.pop(element_key, None)
+            return None
+        element_sets = self.sets.setdefault(element_key, {})
+        superseded = element_sets.get(path_key)
+        element_sets[path_key] = entry
+        return superseded
+
+    def clear(self):
+        self.sets.clear()
+
+
+def coalesce_key(action):
+    """
+    :return: ``None`` for actions that are not element updates, otherwise, an ``(element_key, path_key)`` tuple,
+             where ``path_key`` is ``None`` for updates that can't be coalesced.
+    """
+    if action.get('type') != 'updatePath':
+        return None
+    element_key = (action['rootId'], action['id'])
+    update_data = action['updateData']
+    if update_data['action'] != 'set':
+        return element_key, None
+    return element_key, tuple(update_data['path'])
+
+
+def clamp_window_bits(window_bits):
+    return max(MIN_WINDOW_BITS, min(MAX_WINDOW_BITS, window_bits))
+
+
+def subprotocol(message_format):
+    return 'awe.{}'.format(message_format)
@@ -35,6 +35,10 @@ setup(
         'requests',
         'click'
     ],
+    extras_require={
+        'msgpack': ['msgpack'],
+        'brotli': ['brotli']
+    },
     include_package_data=True,
     zip_safe=False,
     entry_points={
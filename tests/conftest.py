@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+from awe import resources
+
+CLIENT_ROOT = os.path.join('client', 'awe', 'build')
+INDEX_HTML = (
+    '<!DOCTYPE html><html lang="en"><head><meta charset="utf-8">'
+    '<link rel="shortcut icon" href="/static/favicon.ico"><title>Awe</title>'
+    '<link href="/static/static/css/main.0123abcd.chunk.css" rel="stylesheet"></head>'
+    '<body><div id="root"></div>'
+    '<script>window.aweWebsocketPort=null</script>'
+    '<script>window.frozenState=null</script>'
+    '<script src="/custom-components"></script>'
+    '<script src="/static/static/js/main.0123abcd.chunk.js"></script></body></html>'
+)
+
+
+def client_built():
+    return os.path.isfile(os.path.join(resources.DIR, CLIENT_ROOT, 'index.html'))
+
+
+@pytest.fixture(autouse=True, scope='session')
+def client_build(tmpdir_factory):
+    """
+    Tests run against a minimal client build when the client wasn't built with ``make build``.
+    """
+    if client_built():
+        yield
+        return
+    root = tmpdir_factory.mktemp('resources')
+    build = root.join(CLIENT_ROOT)
+    build.join('index.html').write(INDEX_HTML, ensure=True)
+    build.join('favicon.ico').write_binary(b'\x00icon')
+    build.join('static', 'css', 'main.0123abcd.chunk.css').write('a{color:red}', ensure=True)
+    build.join('static', 'js', 'main.0123abcd.chunk.js').write('var a = 1;', ensure=True)
+    original = resources.DIR
+    resources.DIR = str(root)
+    yield
+    resources.DIR = original
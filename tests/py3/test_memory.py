@@ -0,0 +1,33 @@
+import gc
+import tracemalloc
+
+import pytest
+
+from awe import Page
+
+# measured bytes per element, including its data, props and registration (about 690 for text elements on python
+# 3.11), with headroom for other python versions
+ELEMENT_MEMORY_BUDGET = 800
+COUNT = 10000
+
+
+@pytest.mark.parametrize('new_element', [
+    lambda parent: parent.new_text('text'),
+    lambda parent: parent.new_icon('up'),
+    lambda parent: parent.new_inline('text'),
+])
+def test_element_memory(new_element):
+    page = Page(offline=True)
+    parent = page.new_card()
+    new_element(parent)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        for _ in range(COUNT):
+            new_element(parent)
+        gc.collect()
+        per_element = (tracemalloc.get_traced_memory()[0] - before) / COUNT
+    finally:
+        tracemalloc.stop()
+    assert per_element < ELEMENT_MEMORY_BUDGET
@@ -0,0 +1,92 @@
+import base64
+import os
+import socket
+import threading
+import time
+
+import requests
+
+from awe import Page, APIClient
+
+PORT = 8090
+
+
+def _wait_for_server(port=PORT):
+    for _ in range(50):
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return
+        except socket.error:
+            time.sleep(0.1)
+    raise RuntimeError('server did not start')
+
+
+def test_single_port():
+    exports = []
+
+    def slow_export_fn(index_html):
+        exports.append(True)
+        time.sleep(2)
+        return index_html
+
+    page = Page(port=PORT, single_port=True, export_fn=slow_export_fn)
+    page.new_text('text1')
+    page.start(open_browser=False)
+    _wait_for_server()
+    base_url = 'http://127.0.0.1:{}'.format(PORT)
+
+    index = requests.get(base_url).text
+    assert 'window.aweWebsocketPort={}'.format(PORT) in index
+
+    # slow requests don't block other requests
+    export_thread = threading.Thread(target=requests.get, args=('{}/export'.format(base_url),))
+    export_thread.start()
+    while not exports:
+        time.sleep(0.01)
+    start = time.time()
+    with requests.Session() as session:
+        for _ in range(3):
+            response = session.get('{}/initial-state'.format(base_url))
+            assert response.json()['version'] == page._version
+            assert response.headers['Connection'] == 'keep-alive'
+    client = APIClient(port=PORT)
+    text2 = client.new_element(obj='Text')
+    assert text2['element_type'] == 'Text'
+    assert time.time() - start < 1
+    export_thread.join()
+
+    # websocket upgrades are served from the same port
+    connection = socket.create_connection(('127.0.0.1', PORT))
+    key = base64.b64encode(os.urandom(16)).decode('ascii')
+    connection.sendall((
+        'GET / HTTP/1.1\r\n'
+        'Host: 127.0.0.1:{}\r\n'
+        'Upgrade: websocket\r\n'
+        'Connection: Upgrade\r\n'
+        'Sec-WebSocket-Key: {}\r\n'
+        'Sec-WebSocket-Version: 13\r\n'
+        '\r\n'
+    ).format(PORT, key).encode('ascii'))
+    response = b''
+    while b'\r\n\r\n' not in response:
+        response += connection.recv(4096)
+    connection.close()
+    assert response.startswith(b'HTTP/1.1 101')
+
+
+def test_single_port_streams_export():
+    port = PORT + 1
+    page = Page(port=port, single_port=True)
+    table = page.new_table(['a', 'b'])
+    table.extend([[i, 'row {}'.format(i)] for i in range(20000)])
+    page.start(open_browser=False)
+    _wait_for_server(port)
+    response = requests.get('http://127.0.0.1:{}/export'.format(port), headers={'Accept-Encoding': 'identity'})
+    assert response.headers['Transfer-Encoding'] == 'chunked'
+    assert 'Content-Length' not in response.headers
+    assert response.text.rstrip().endswith('</html>')
+    assert 'row 19999' in response.text
+    # small responses are still sent with a content length
+    response = requests.get('http://127.0.0.1:{}/initial-state'.format(port))
+    assert 'Content-Length' in response.headers
+    assert 'Transfer-Encoding' not in response.headers
@@ -4,7 +4,7 @@ import time
 import pytest
 import requests
 
-from awe import Page, APIClient
+from awe import Page, APIClient, CustomElement
 
 
 def test_get_elements(page, client):
@@ -211,6 +211,78 @@ def test_call_function(page, client):
     assert state['kwargs'] == {'key1': 'value1'}
 
 
+def test_initial_state_cache(page, client):
+    url = 'http://127.0.0.1:{}/initial-state'.format(page._port)
+    page.new_text('text1')
+    response = requests.get(url)
+    etag = response.headers['ETag']
+    assert response.json()['version'] == page._version
+    assert requests.get(url).content == response.content
+    response = requests.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert not response.content
+    page.new_text('text2')
+    response = requests.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.json()['version'] == page._version
+
+
+def test_conditional_compressed_responses(page, client):
+    url = 'http://127.0.0.1:{}/api/elements?include_data=true'.format(page._port)
+    page.new_text('text1')
+    response = requests.get(url, headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in response.headers
+    identity_etag = response.headers['ETag']
+    page.new_text('a' * 2000)
+    response = requests.get(url)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(response.json()['elements']) == 2
+    etag = response.headers['ETag']
+    assert etag != identity_etag
+    assert requests.get(url, headers={'If-None-Match': etag}).status_code == 304
+    # not versioned
+    response = requests.get('http://127.0.0.1:{}/api/status'.format(page._port), headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert 'ETag' not in response.headers
+    export_url = 'http://127.0.0.1:{}/export'.format(page._port)
+    response = requests.get(export_url)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'a' * 2000 in response.text
+    assert requests.get(export_url, headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    page.new_text('text3')
+    assert requests.get(url, headers={'If-None-Match': etag}).status_code == 200
+    assert requests.get(export_url, headers={'If-None-Match': response.headers['ETag']}).status_code == 200
+
+
+def test_custom_components_bundle(page, client):
+    calls = []
+
+    class TestElement(CustomElement):
+        @classmethod
+        def _js(cls):
+            calls.append(True)
+            return 'register((e) => <div>test</div>)'
+
+    base_url = 'http://127.0.0.1:{}'.format(page._port)
+    empty_hash = page._custom_component.combined_script_hash()
+    page.new(TestElement)
+    script_hash = page._custom_component.combined_script_hash()
+    build_calls = len(calls)
+    assert script_hash != empty_hash
+    assert 'src="/custom-components/{}"'.format(script_hash) in requests.get(base_url).text
+    response = requests.get('{}/custom-components/{}'.format(base_url, script_hash))
+    assert '"name":"TestElement"' in response.text
+    assert 'immutable' in response.headers['Cache-Control']
+    assert requests.get('{}/custom-components'.format(base_url)).text == response.text
+    # stale hashes are not cached
+    response = requests.get('{}/custom-components/{}'.format(base_url, empty_hash))
+    assert response.headers['Cache-Control'] == 'no-cache'
+    page.new(TestElement)
+    page.export()
+    assert len(calls) == build_calls
+
+
 @pytest.fixture()
 def page():
     result = Page()
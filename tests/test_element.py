@@ -1,6 +1,9 @@
+import threading
+
 import pytest
 
-from awe import view, Page
+from awe import view, variables, table_index, Page
+from awe.messages import MessageHandler
 
 
 def test_base():
@@ -291,3 +294,322 @@ def test_element_builder():
     assert text_element2.element_type == 'Text'
     assert text_element2.text == 'hello'
     assert text_element2.props['test_key2'] == 'test_value2'
+
+
+def test_slots():
+    page = Page()
+    text = page.new_text('text')
+    assert not hasattr(text, '__dict__')
+    assert not hasattr(variables.Variable(1), '__dict__')
+    with pytest.raises(AttributeError):
+        text.attribute = 1
+
+    class TestElement(view.CustomElement):
+        def _init(self, arg1):
+            self.arg1 = arg1
+
+        @classmethod
+        def _js(cls):
+            return ''
+
+    element = page.new(TestElement, arg1='value1')
+    element.arg2 = 'value2'
+    assert (element.arg1, element.arg2) == ('value1', 'value2')
+    assert element.root_id == 'root'
+    assert element.prop_children == {}
+    assert element.ref.missing is None
+
+
+def test_batch():
+    page = Page()
+    existing = page.new_text('existing')
+    removed = page.new_text('removed')
+    actions = []
+    page._dispatch = lambda action, client_id=None: actions.append(action)
+    with page.batch():
+        grid = page.new_grid(columns=2)
+        with grid.batch():
+            for i in range(100):
+                grid.new_card().new_text(str(i))
+        grid.update_data({'extra': True})
+        panel = page.new_collapse().new_panel('panel')
+        header = panel.new_prop('header2')
+        header.new_text('header')
+        page.new_input()
+        existing.text = 'updated'
+        temporary = page.new_text('temporary')
+        page.remove(temporary)
+        page.remove(removed)
+        assert not actions
+    assert len(actions) == 1
+    action = actions[0]
+    assert action['type'] == 'batch'
+    assert [a['type'] for a in action['actions']] == ['removeElements', 'newVariable', 'processRoots', 'updatePath']
+    assert action['actions'][3]['id'] == existing.id
+    assert action['actions'][0]['entries'] == [{'id': removed.id, 'rootId': 'root', 'type': 'element'}]
+    roots = action['actions'][2]['roots']
+    assert set(roots) == {'root', header.id}
+    assert [view['id'] for view in roots['root']] == [grid.id, panel.parent.id, page.children[-1].id]
+    assert roots['root'][0] == grid._get_view()
+    assert roots['root'][0]['data']['extra']
+    assert len(roots['root'][0]['children']) == 100
+    assert roots['root'][1]['children'][0]['propChildren'] == {'header2': header.id}
+    assert roots[header.id][0]['data']['text'] == 'header'
+
+    # a single kind of change is sent as is, and changes made before an exception are sent
+    del actions[:]
+    with pytest.raises(RuntimeError):
+        with page.batch():
+            text = page.new_text('text')
+            raise RuntimeError()
+    assert actions == [{'type': 'processRoots', 'roots': {'root': [text._get_view()]}}]
+    del actions[:]
+    with page.batch():
+        pass
+    assert actions == []
+
+
+def test_batch_existing_elements():
+    page = Page()
+    grid = page.new_grid(columns=2)
+    card = page.new_card()
+    actions = []
+    page._dispatch = lambda action, client_id=None: actions.append(action)
+    with page.batch():
+        text = grid.new_text('text')
+        header = card.new_prop('header')
+        header.new_text('header')
+    assert len(actions) == 1
+    # changes of existing elements follow the elements they refer to
+    assert [a['type'] for a in actions[0]['actions']] == ['processRoots', 'updatePath', 'newPropChild']
+    assert actions[0]['actions'][0]['roots'] == {grid.root_id: [text._get_view()], header.id: header._get_view()}
+    assert actions[0]['actions'][1]['id'] == grid.id
+    assert actions[0]['actions'][2]['id'] == header.id
+
+    # actions of elements removed in the batch are dropped
+    del actions[:]
+    with page.batch():
+        grid.new_text('text')
+        page.remove(grid)
+    assert [a['type'] for a in actions] == ['removeElements']
+
+
+def test_batch_is_per_thread():
+    page = Page()
+    actions = []
+    page._dispatch = lambda action, client_id=None: actions.append(action)
+    with page.batch():
+        text1 = page.new_text('1')
+        thread = threading.Thread(target=page.new_text, args=('2',))
+        thread.start()
+        thread.join()
+        # changes of other threads are not held back by the batch
+        assert [a['type'] for a in actions] == ['newElement']
+        assert actions[0]['id'] != text1.id
+    assert actions[-1] == {'type': 'processRoots', 'roots': {'root': [text1._get_view()]}}
+
+
+@pytest.mark.parametrize('block_size', [1000, 2])
+def test_children(monkeypatch, block_size):
+    monkeypatch.setattr(table_index, 'BLOCK_SIZE', block_size)
+    page = Page()
+    texts = [page.new_text(str(i)) for i in range(10)]
+    assert [t.index for t in page.children] == list(range(1, 11))
+    for text in texts[:6]:
+        page.remove(text)
+    assert page.children == texts[6:]
+    assert len(page.children) == 4
+    assert page.children[0] is texts[6]
+    assert texts[0] not in page.children and texts[6] in page.children
+    # removal doesn't make indices collide
+    assert page.new_text('new').index == 11
+
+    first = page.children[0]
+    inserted = [first.insert_before(view.Text, text='before') for _ in range(100)]
+    assert page.children[:100] == inserted
+    assert len(set(t.index for t in page.children)) == len(page.children)
+    assert list(page.children)[100] is first
+    after = first.insert_after(view.Text, text='after')
+    assert list(page.children)[101] is after
+    assert page.children[-1] is page.children[len(page.children) - 1]
+    with pytest.raises(IndexError):
+        page.children[len(page.children)]
+    # inserts only move the children of a single block
+    assert max(len(elements) for elements in page.children._segment.ids) <= 2 * block_size
+
+
+@pytest.mark.parametrize('block_size', [1000, 2])
+def test_move(monkeypatch, block_size):
+    monkeypatch.setattr(table_index, 'BLOCK_SIZE', block_size)
+    page = Page()
+    card1 = page.new_card()
+    card2 = page.new_card()
+    text1 = card1.new_text('1')
+    text2 = card1.new_text('2')
+    actions = []
+    page._dispatch = lambda action, client_id=None: actions.append(action)
+    text2.move(before=text1)
+    assert card1.children == [text2, text1]
+    assert actions == [{
+        'type': 'reorderElements',
+        'rootId': 'root',
+        'entries': [{'id': text2.id, 'index': text2.index, 'parentId': card1.id}]
+    }]
+    text2.move(parent=card2)
+    assert card1.children == [text1] and card2.children == [text2]
+    assert text2.parent is card2
+    assert actions[-1]['entries'] == [{'id': text2.id, 'index': 1, 'parentId': card2.id}]
+    card2.move(after=text1)
+    assert card1.children == [text1, card2]
+    text1.move(after=card2)
+    assert card1.children == [card2, text1]
+    assert page.children == [card1]
+    assert card1._get_view()['children'][0]['children'][0]['id'] == text2.id
+    with pytest.raises(ValueError):
+        card1.move(parent=text2)
+    with pytest.raises(ValueError):
+        text1.move()
+    with pytest.raises(ValueError):
+        text1.move(parent=card1.new_prop('prop'))
+
+    # positional creation sends a single action
+    del actions[:]
+    text3 = text1.insert_before(view.Text, text='3')
+    assert card1.children == [card2, text3, text1]
+    assert [a['type'] for a in actions] == ['newElement']
+    assert actions[0]['index'] == text3.index
+
+
+def test_grid_child_columns():
+    page = Page()
+    grid = page.new_grid(columns=3)
+    text1 = grid.new_text('1', cols=1)
+    text2 = grid.new_text('2', cols=2)
+    text3 = text1.insert_after(view.Text, text='3', cols=3)
+    assert grid.data['childColumns'] == [1, 3, 2]
+    text2.move(before=text1)
+    assert grid.data['childColumns'] == [2, 1, 3]
+    grid.remove(text1)
+    assert grid.data['childColumns'] == [2, 3]
+    text3.move(parent=page)
+    assert grid.data['childColumns'] == [2]
+
+
+def test_virtual_table():
+    page = Page()
+    table = page.new_table(['a', 'b'], page_size=2, virtual=True)
+    table.extend([[i, i * 10] for i in range(5)])
+    assert table.row_count == 5
+    assert table.data['rows'] == []
+    window = table._get_new_element_action()['data']['window']
+    assert window == {'offset': 0, 'rows': [{'data': [0, 0], 'id': 1}, {'data': [1, 10], 'id': 2}]}
+
+    actions = []
+    page._dispatch = lambda action, client_id=None: actions.append((action, client_id))
+    handler = MessageHandler(page._registry, page._dispatch)
+    handler.handle_fetch_rows({'type': 'fetchRows', 'id': table.id, 'clientId': 'c1', 'offset': 2, 'limit': 2})
+    handler.handle_fetch_rows({'type': 'fetchRows', 'id': 'missing', 'clientId': 'c1', 'offset': 0, 'limit': 2})
+    assert actions == [({
+        'type': 'tableRows',
+        'id': table.id,
+        'rootId': 'root',
+        'offset': 2,
+        'query': None,
+        'rows': [{'data': [2, 20], 'id': 3}, {'data': [3, 30], 'id': 4}],
+        'rowCount': 5,
+        'matchCount': 5
+    }, 'c1')]
+
+    # changes after the displayed page only update the row count
+    del actions[:]
+    table.append([5, 50])
+    assert [(a['type'], c) for a, c in actions] == [('updatePath', None)]
+    assert actions[0][0]['updateData']['data'] == 6
+
+    # changes in (or before) the displayed page resend it
+    del actions[:]
+    table.prepend([-1, -10])
+    assert [(a['type'], c) for a, c in actions] == [('updatePath', None), ('tableRows', 'c1')]
+    assert [r['data'][0] for r in actions[1][0]['rows']] == [1, 2]
+    del actions[:]
+    table.clear()
+    assert actions[1][0]['rows'] == []
+    assert actions[1][0]['rowCount'] == 0
+
+    # pages of disconnected clients are no longer updated
+    assert handler.client_tables == {'c1': {table.id}}
+    handler.handle_client_closed('c1')
+    assert not handler.client_tables
+    del actions[:]
+    table.append([1, 10])
+    assert [(a['type'], c) for a, c in actions] == [('updatePath', None)]
+
+
+def test_virtual_table_concurrent_fetch():
+    page = Page()
+    table = page.new_table(['a'], virtual=True)
+    page._dispatch = lambda action, client_id=None: None
+    errors = []
+
+    def fetch(client_id):
+        try:
+            for i in range(200):
+                table.fetch_rows(client_id, i % 10, 5)
+                table.release_rows(client_id)
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=fetch, args=('c{}'.format(i),)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for i in range(500):
+        if i % 2:
+            table.prepend([i])
+        else:
+            table.append([i])
+    for thread in threads:
+        thread.join()
+    assert not errors
+    rows = table.query_rows(0, 500)[0]
+    assert [r['data'][0] for r in rows[:3]] == [499, 497, 495]
+    assert [r['data'][0] for r in rows[-3:]] == [494, 496, 498]
+
+
+def test_virtual_table_query():
+    page = Page()
+    with pytest.raises(ValueError):
+        page.new_table(['a'], sort_columns=['a'])
+    table = page.new_table(['name', 'score'], virtual=True, sort_columns=['score'], search=['name'])
+    assert table.data['sortColumns'] == ['score']
+    assert table.data['searchable']
+    table.set([['alpha', 3], ['beta', 1], ['alphabet', 2]])
+    rows, count = table.query_rows(sort='score', search='alpha')
+    assert [r['data'][0] for r in rows] == ['alphabet', 'alpha']
+    assert count == 2
+
+    actions = []
+    page._dispatch = lambda action, client_id=None: actions.append((action, client_id))
+    query = {'sort': 'score', 'order': 'descend'}
+    table.fetch_rows('c1', 0, 2, query)
+    action = actions[0][0]
+    assert action['query'] == query
+    assert [r['data'][0] for r in action['rows']] == ['alpha', 'alphabet']
+    assert action['matchCount'] == 3
+
+    # rows added after the page of a query only change its match count
+    del actions[:]
+    table.append(['gamma', 0])
+    assert [(a['type'], c) for a, c in actions] == [('updatePath', None), ('tableRows', 'c1')]
+    assert [r['data'][0] for r in actions[-1][0]['rows']] == ['alpha', 'alphabet']
+    assert actions[-1][0]['matchCount'] == 4
+    table.prepend(['delta', 4])
+    assert [r['data'][0] for r in actions[-1][0]['rows']] == ['delta', 'alpha']
+
+    # rows that don't match the query of a page don't change it
+    table.release_rows('c1')
+    table.fetch_rows('c2', 0, 2, {'search': 'alpha'})
+    del actions[:]
+    table.extend([['zeta', 9]])
+    assert [(a['type'], c) for a, c in actions] == [('updatePath', None)]
+    table.append(['alpha2', 9])
+    assert [r['data'][0] for r in actions[-1][0]['rows']] == ['alpha', 'alphabet']
+    assert actions[-1][0]['matchCount'] == 3
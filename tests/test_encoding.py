@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import collections
+import datetime
+import json
+import uuid
+
+import pytest
+
+from awe import encoding, view, Page
+
+backends = [encoding.STDLIB]
+if encoding.orjson:
+    backends.append(encoding.ORJSON)
+if encoding.ujson:
+    backends.append(encoding.UJSON)
+
+
+class Custom(object):
+    def __init__(self, value):
+        self.value = value
+
+
+class SubCustom(Custom):
+    pass
+
+
+class Name(str):
+    pass
+
+
+@pytest.mark.parametrize('json_backend', backends)
+def test_to_json(json_backend):
+    page = Page(json_backend=json_backend)
+    text = page.new_text('text')
+    encoder = encoding.Encoder(
+        element_cls=view.Element,
+        serializers={Custom: lambda c: {'custom': c.value}},
+        json_backend=json_backend
+    )
+    assert encoder.json_backend == json_backend
+    obj = {
+        'deque': collections.deque([1, 2]),
+        'element': text,
+        'custom': Custom(1),
+        'sub_custom': SubCustom(2),
+        'tuple': (1, 'two'),
+        'unicode': u'שלום',
+        'big': 2 ** 70,
+        1: None,
+    }
+    expected = {
+        'deque': [1, 2],
+        'element': {'_awe_root_': 'root'},
+        'custom': {'custom': 1},
+        'sub_custom': {'custom': 2},
+        'tuple': [1, 'two'],
+        'unicode': u'שלום',
+        'big': 2 ** 70,
+        '1': None,
+    }
+    assert json.loads(encoder.to_json(obj)) == expected
+    assert json.loads(encoder.to_json_bytes(obj).decode('utf-8')) == expected
+    with pytest.raises(TypeError):
+        encoder.to_json({'unknown': object()})
+
+
+def test_backends_use_serializers():
+    def encode_all(serializers, obj):
+        results = set()
+        for json_backend in backends:
+            encoder = encoding.Encoder(element_cls=view.Element, serializers=dict(serializers),
+                                       json_backend=json_backend)
+            results.add(encoder.to_json(obj))
+        return results
+    serializers = {
+        datetime.datetime: lambda d: 'custom',
+        # like the standard library, backends encode subclasses of builtin types as their base type
+        Name: lambda n: {'name': str(n)}
+    }
+    obj = {
+        'd': datetime.datetime(2020, 1, 1),
+        'n': Name('n'),
+        'o': collections.OrderedDict([('b', 1), ('a', 2)]),
+        'i': [True, 2 ** 40, 1.5]
+    }
+    assert encode_all(serializers, obj) == {'{"d":"custom","n":"n","o":{"b":1,"a":2},"i":[true,1099511627776,1.5]}'}
+    # orjson encodes UUIDs itself, so it isn't used when they have a serializer
+    serializers[uuid.UUID] = lambda u: 'U'
+    obj = {'u': uuid.UUID(int=1), 'd': datetime.datetime(2020, 1, 1)}
+    assert encode_all(serializers, obj) == {'{"u":"U","d":"custom"}'}
+    encoder = encoding.Encoder(element_cls=view.Element, serializers=serializers)
+    assert encoder.json_backend != encoding.ORJSON
+
+
+def test_serializers_cache():
+    encoder = encoding.Encoder(
+        element_cls=view.Element,
+        serializers={Custom: lambda c: c.value},
+        json_backend=encoding.STDLIB
+    )
+    json_encoder = encoder._json_encoder
+    encoder.to_json([SubCustom(1), SubCustom(2), collections.deque()])
+    assert json_encoder.serializers_cache[SubCustom] is json_encoder.serializers[Custom]
+    assert json_encoder.serializers_cache[collections.deque] is list
+    with pytest.raises(TypeError):
+        encoder.to_json(object())
+    assert json_encoder.serializers_cache[object] is None
+
+
+def test_json_backend():
+    assert encoding.get_json_backend(encoding.STDLIB) == encoding.STDLIB
+    assert encoding.get_json_backend(encoding.AUTO) in backends
+    with pytest.raises(AssertionError):
+        encoding.get_json_backend('other')
+
+
+def test_iter_json(monkeypatch):
+    monkeypatch.setattr(encoding, 'JSON_SLICE_SIZE', 10)
+    encoder = encoding.Encoder(element_cls=view.Element, serializers=None, json_backend=encoding.STDLIB)
+    rows = collections.deque({'data': [i, str(i)], 'id': i} for i in range(30))
+    obj = {
+        'rows': rows,
+        'series': list(range(25)),
+        'empty': [],
+        'lazy': lambda: {1: (1, 2)},
+        'flat_lazy': {'a': lambda: 1},
+        'nested': {'a': [[1], {'b': {}}]}
+    }
+    expected = json.loads(encoder.to_json(dict(obj, lazy={1: [1, 2]}, flat_lazy={'a': 1})))
+    assert json.loads(''.join(encoder.iter_json(obj))) == expected
+    # large values are split into chunks of about the requested size
+    chunks = list(encoder.iter_json(obj, chunk_size=1))
+    assert json.loads(''.join(chunks)) == expected
+    assert max(len(chunk) for chunk in chunks) == len(encoder.to_json(list(range(10, 20)))) - 2
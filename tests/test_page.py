@@ -1,4 +1,11 @@
-from awe import Page, CustomElement
+import codecs
+import io
+import json
+import re
+
+import pytest
+
+from awe import Page, CustomElement, custom, export, resources
 
 
 def test_export():
@@ -17,6 +24,160 @@ def test_export():
     assert text.upper() in page.export()
 
 
+def test_export_to():
+    page = Page()
+    card = page.new_card('card')
+    card.new_text(u'text \u05e9')
+    page.new_table(['a', 'b']).append([1, 2])
+    result = io.BytesIO()
+    page.export_to(result)
+    assert result.getvalue() == page.export().encode('utf-8')
+    assert u'text \u05e9' in result.getvalue().decode('utf-8')
+
+
+def _frozen_state(html, state_format):
+    if state_format == export.JSON_PARSE:
+        literal = re.search(r"window.frozenState=JSON.parse\('(.*?)'\)</script>", html).group(1)
+        # javascript and python string escapes used by the exporter are the same
+        return json.loads(codecs.decode(literal.encode('ascii', 'backslashreplace'), 'unicode_escape'))
+    if state_format == export.JSON_SCRIPT:
+        return json.loads(re.search(r'<script type="application/json" id="awe-frozen-state">(.*?)</script>',
+                                    html).group(1))
+    return json.loads(re.search(r'<script>window.frozenState=(.*?)</script>', html).group(1))
+
+
+@pytest.mark.parametrize('state_format', export.STATE_FORMATS)
+def test_export_state_format(state_format):
+    text = u'</script><!-- \' " \\ \n \u2028 \u2029 \u05e9 \\u003c'
+    page = Page(export_state_format=state_format)
+    page.new_text(text)
+    html = page.export()
+    assert html.count('</script') == html.count('<script')
+    state = _frozen_state(html, state_format)
+    assert state['roots']['root'][0]['data']['text'] == text
+    assert u'\u2028' not in html
+
+
+def test_export_invalid_state_format():
+    with pytest.raises(ValueError):
+        Page(export_state_format='yaml')
+
+
+@pytest.mark.parametrize('window_bits', [8, 16])
+def test_invalid_compression_window_bits(window_bits):
+    with pytest.raises(ValueError):
+        Page(websocket_compression={'window_bits': window_bits})
+
+
+@pytest.mark.parametrize('minify', [False, True])
+def test_export_inline_assets(tmpdir, monkeypatch, minify):
+    build = tmpdir.join('client', 'awe', 'build')
+    build.join('index.html').write(
+        '<link rel="shortcut icon" href="/static/favicon.ico">'
+        '<link href="/static/static/css/main.0123abcd.chunk.css" rel="stylesheet">'
+        '<script>window.frozenState=null</script>'
+        '<script src="/custom-components"></script>'
+        '<script src="/static/static/js/main.0123abcd.chunk.js"></script>', ensure=True)
+    build.join('favicon.ico').write_binary(b'\x00icon')
+    build.join('static', 'css', 'main.0123abcd.chunk.css').write('/* c */ a > b {\n  color: red;\n}\n', ensure=True)
+    build.join('static', 'js', 'main.0123abcd.chunk.js').write(
+        'var s = "</script>";\n//# sourceMappingURL=main.0123abcd.chunk.js.map', ensure=True)
+    monkeypatch.setattr(resources, 'DIR', str(tmpdir))
+    monkeypatch.setattr(export, '_inline_assets', {})
+    reads = []
+    read = export._read_inline_asset
+    monkeypatch.setattr(export, '_read_inline_asset', lambda *args: reads.append(args) or read(*args))
+
+    for _ in range(2):
+        page = Page(export_assets='inline', export_minify=minify)
+        page.new_text('text')
+        html = page.export()
+    assert len(reads) == 3
+    assert '/static/' not in html
+    assert export.BASE_STATIC_URL not in html
+    assert 'href="data:image/x-icon;base64,AGljb24="' in html
+    assert 'var s = "<\\/script>";' in html
+    if minify:
+        assert '<style>a>b{color: red;}</style>' in html
+        assert 'sourceMappingURL' not in html
+    else:
+        assert '<style>/* c */ a > b {' in html
+        assert 'sourceMappingURL' in html
+
+    # directory exports share the assets instead of inlining them
+    page.export(directory=str(tmpdir.join('export')))
+    html = tmpdir.join('export', 'index.html').read()
+    assert '<script src="static/static/js/main.0123abcd.chunk.js"></script>' in html
+    assert tmpdir.join('export', 'static', 'static', 'js', 'main.0123abcd.chunk.js').check()
+    assert tmpdir.join('export', 'static', 'favicon.ico').check()
+
+    with pytest.raises(ValueError):
+        Page(export_assets='cdn')
+
+
+def _read_shard(directory, shard_hash):
+    content = directory.join(export.shards_dir, '{}.js'.format(shard_hash)).read_text('utf-8')
+    prefix = '(window.aweShards=window.aweShards||{{}})["{}"]='.format(shard_hash)
+    assert content.startswith(prefix) and content.endswith(';')
+    return json.loads(content[len(prefix):-1])
+
+
+def test_export_dir(tmpdir):
+    page = Page()
+    collapse = page.new_collapse()
+    collapse.new_panel('panel1', active=True).new_text('active panel')
+    panel2 = collapse.new_panel('panel2')
+    panel2.new_text('collapsed panel')
+    panel3 = collapse.new_panel()
+    panel3.header.new_text('header')
+    tabs = page.new_tabs()
+    tabs.new_tab('tab1').new_text('active tab')
+    tab2 = tabs.new_tab('tab2')
+    nested = tab2.new_collapse().new_panel('nested')
+    nested.new_text('nested panel')
+
+    index_path = page.export(directory=str(tmpdir))
+    assert index_path == str(tmpdir.join('index.html'))
+    html = tmpdir.join('index.html').read_text('utf-8')
+    state = json.loads(re.search(r'<script>window.frozenState=(.*?)</script>', html).group(1))
+    assert state['roots'] == {}
+    assert state['version'] == page._version
+    for shard_hash in state['shards']:
+        assert export.shard_script_format(shard_hash) in html
+    roots = {}
+    for shard_hash in state['shards']:
+        roots.update(_read_shard(tmpdir, shard_hash))
+    assert set(roots) == {'root', panel3.header.id}
+    assert 'active panel' in json.dumps(roots)
+    assert 'active tab' in json.dumps(roots)
+    assert 'collapsed panel' not in json.dumps(roots)
+    assert set(state['lazyShards']) == {panel2.id, tab2.id, nested.id}
+    assert _read_shard(tmpdir, state['lazyShards'][panel2.id])['root'][0]['data']['text'] == 'collapsed panel'
+    tab2_shard = _read_shard(tmpdir, state['lazyShards'][tab2.id])
+    assert tab2_shard['root'][0]['children'][0]['children'] == []
+    assert _read_shard(tmpdir, state['lazyShards'][nested.id])['root'][0]['data']['text'] == 'nested panel'
+    assert tmpdir.join(export.custom_components_file_format(page._custom_component.combined_script_hash())).check()
+
+    # unchanged roots keep their shards
+    page.new_text('more')
+    page.export(directory=str(tmpdir))
+    html = tmpdir.join('index.html').read_text('utf-8')
+    new_state = json.loads(re.search(r'<script>window.frozenState=(.*?)</script>', html).group(1))
+    assert set(new_state['shards']) & set(state['shards'])
+    assert set(new_state['shards']) != set(state['shards'])
+    assert new_state['lazyShards'] == state['lazyShards']
+
+
+def test_export_template():
+    template = export.Template('a{x}b{y}c{x}', {
+        '{y}': lambda: iter(['1', '2']),
+        '{x}': lambda: iter(['3']),
+        '{z}': lambda: iter(['4']),
+    })
+    assert template.segments == ['a', 'b', 'c{x}']
+    assert ''.join(template.render()) == 'a3b12c{x}'
+
+
 def test_export_with_custom_element():
     js_code = 'register((e) => <div {...e.props}>text</div>)'
 
@@ -27,7 +188,33 @@ def test_export_with_custom_element():
 
     page = Page()
     page.new(TestElement)
-    assert js_code in page.export()
+    # sources are inlined as script safe json strings
+    assert js_code.replace('<', '\\u003c') in page.export()
+
+
+def test_register_custom_element_action():
+    js_code = 'register((e) => <div {...e.props}>text</div>)'
+
+    class TestElement(CustomElement):
+        _scripts = ['https://example.com/script.js']
+        _styles = ['https://example.com/style.css']
+
+        @classmethod
+        def _js(cls):
+            return js_code
+
+    page = Page()
+    actions = []
+    page._dispatch = lambda action, client_id=None: actions.append(action)
+    page.new(TestElement)
+    page.new(TestElement)
+    assert actions[0] == {
+        'type': 'registerComponent',
+        'component': {'name': 'TestElement', 'hash': custom.content_hash(js_code), 'source': js_code},
+        'scripts': [{'src': 'https://example.com/script.js', 'type': 'text/javascript'}],
+        'styles': [{'href': 'https://example.com/style.css', 'rel': 'stylesheet'}]
+    }
+    assert [action['type'] for action in actions[1:]] == ['newElement', 'newElement']
 
 
 def test_offline():
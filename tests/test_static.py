@@ -0,0 +1,87 @@
+import gzip
+import os
+
+import bottle
+import pytest
+
+from awe import static
+
+
+def _request(accept_encoding=None):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/'}
+    if accept_encoding is not None:
+        environ['HTTP_ACCEPT_ENCODING'] = accept_encoding
+    bottle.request.bind(environ)
+
+
+@pytest.mark.parametrize('accept_encoding, expected', [
+    (None, []),
+    ('gzip, deflate', ['gzip']),
+    ('gzip;q=0, *', ['br']),
+    ('br;q=0.5, gzip', ['br', 'gzip']),
+    ('*', ['br', 'gzip']),
+    ('identity', [])
+])
+def test_accepted_encodings(accept_encoding, expected):
+    _request(accept_encoding)
+    assert static.accepted_encodings() == expected
+
+
+@pytest.fixture()
+def root(tmpdir):
+    js_dir = tmpdir.mkdir('static').mkdir('js')
+    js_dir.join('main.0123abcd.chunk.js').write('var a = 1;\n' * 1000)
+    js_dir.join('small.js').write('var a = 1;')
+    tmpdir.join('favicon.ico').write_binary(b'\0' * 2000)
+    return str(tmpdir)
+
+
+def _body(response):
+    body = response.body
+    result = body.read()
+    body.close()
+    return result
+
+
+def test_static_files(root):
+    static_files = static.StaticFiles(root)
+    path = 'static/js/main.0123abcd.chunk.js'
+    _request('gzip')
+    response = static_files.serve(path)
+    assert response.status_code == 200
+    assert response.get_header('Content-Encoding') == 'gzip'
+    assert response.get_header('Vary') == 'Accept-Encoding'
+    assert response.get_header('Cache-Control') == static.IMMUTABLE_CACHE_CONTROL
+    assert gzip.GzipFile(fileobj=response.body).read() == b'var a = 1;\n' * 1000
+    response.body.close()
+    # compressed once per process
+    _request('gzip')
+    assert static_files.serve(path).body.name == response.body.name
+    _request()
+    response = static_files.serve(path)
+    assert response.get_header('Content-Encoding') is None
+    assert _body(response) == b'var a = 1;\n' * 1000
+
+    _request('gzip')
+    for path in ['static/js/small.js', 'favicon.ico']:
+        response = static_files.serve(path)
+        assert response.get_header('Content-Encoding') is None
+        assert response.get_header('Cache-Control') is None
+        _body(response)
+    assert static_files.serve('static/js/missing.js').status_code == 404
+    assert static_files.serve('../' + os.path.basename(root)).status_code in (403, 404)
+
+
+def test_compress_directory(root):
+    static.compress_directory(root)
+    filename = os.path.join(root, 'static', 'js', 'main.0123abcd.chunk.js')
+    assert os.path.isfile(filename + '.gz')
+    assert os.path.isfile(filename + '.br') == bool(static.brotli)
+    assert not os.path.exists(os.path.join(root, 'static', 'js', 'small.js.gz'))
+    assert not os.path.exists(os.path.join(root, 'favicon.ico.gz'))
+    # compressed files built with the package are served as is
+    with open(filename + '.gz', 'wb') as f:
+        f.write(b'prebuilt')
+    _request('gzip')
+    response = static.StaticFiles(root).serve('static/js/main.0123abcd.chunk.js')
+    assert _body(response) == b'prebuilt'
@@ -0,0 +1,112 @@
+import pytest
+
+from awe import table_index
+
+
+def test_column_index(monkeypatch):
+    monkeypatch.setattr(table_index, 'BLOCK_SIZE', 2)
+    index = table_index.ColumnIndex()
+    index.add([(3, 1), ('b', 2), (None, 3), (1, 4), ({}, 5), ('a', 6), (3, 7)])
+    for value, row_id in [(2, 8), (3, 9), (0, 10), ('c', 11), (None, 12)]:
+        index.add([(value, row_id)])
+    ascending = [10, 4, 8, 1, 7, 9, 6, 2, 11, 5, 3, 12]
+    assert len(index) == 12
+    assert list(index.iter_ids()) == ascending
+    assert list(index.iter_ids(reverse=True)) == ascending[::-1]
+    for start, stop in [(0, 3), (3, 9), (10, 20), (12, 14)]:
+        assert index.slice_ids(start, stop) == ascending[start:stop]
+        assert index.slice_ids(start, stop, reverse=True) == ascending[::-1][start:stop]
+    assert index.equal_ids(3) == [1, 7, 9]
+    assert index.equal_ids('a') == [6]
+    assert index.equal_ids(None) == [3, 12]
+    assert index.equal_ids({}) == [5]
+    assert index.equal_ids(5) == []
+
+
+def test_column_index_text_and_bytes():
+    index = table_index.ColumnIndex()
+    index.add([(b'b', 1), (u'b', 2), (b'a', 3), (u'a', 4)])
+    index.add([(b'c', 5)])
+    assert list(index.iter_ids()) == [4, 2, 3, 1, 5]
+    assert index.equal_ids(b'b') == [1]
+    assert index.equal_ids(u'b') == [2]
+
+
+def test_rows():
+    rows = table_index.Rows([3, 4])
+    rows.prepend(2)
+    rows.prepend(1)
+    rows.extend([5, 6])
+    expected = [1, 2, 3, 4, 5, 6]
+    assert len(rows) == 6
+    assert list(rows) == expected
+    for start in range(-7, 8):
+        for stop in range(-7, 8):
+            assert rows[start:stop] == expected[start:stop]
+    assert rows[1] == 2 and rows[-1] == 6
+    with pytest.raises(IndexError):
+        rows[6]
+
+
+def test_token_index():
+    index = table_index.TokenIndex()
+    index.add([(['Hello World', 1], 1), (['hello there', None], 2), (['world', 12], 3)])
+    index.add([(['Worldwide hello'], 4)])
+    assert index.search('') is None
+    assert index.search('HELLO') == {1, 2, 4}
+    assert index.search('hello wor') == {1, 4}
+    assert index.search('world hel') == {1}
+    assert index.search('1') == {1, 3}
+    assert index.search('missing') == set()
+
+
+def test_table_index():
+    headers = ['name', 'score']
+    index = table_index.TableIndex(headers, sort_columns=['score'], search_columns=['name'])
+    rows = [{'id': i + 1, 'data': data} for i, data in enumerate([['a x', 3], ['b', 1], ['c x', 2]])]
+    index.add(rows)
+    prepended = {'id': 4, 'data': ['d x', 2]}
+    rows.insert(0, prepended)
+    index.add([prepended], prepend=True)
+
+    def ids(**kwargs):
+        result, count = index.query(rows, **kwargs)
+        return [row['id'] for row in result], count
+    assert ids(offset=1, limit=2) == ([1, 2], 4)
+    assert ids(offset=0, limit=10, sort='score') == ([2, 3, 4, 1], 4)
+    assert ids(offset=1, limit=2, sort='score', order='descend') == ([4, 3], 4)
+    assert ids(offset=0, limit=10, search='x') == ([4, 1, 3], 3)
+    assert ids(offset=0, limit=10, search='x', sort='score') == ([3, 4, 1], 3)
+    assert ids(offset=0, limit=10, filters={'score': [2, 3]}, search='x') == ([4, 1, 3], 3)
+    assert ids(offset=0, limit=10, filters={'name': 'b'}) == ([2], 1)
+    with pytest.raises(ValueError):
+        index.query(rows, 0, 10, sort='name')
+    with pytest.raises(ValueError):
+        index.query(rows, 0, 10, sort='score', order='up')
+    with pytest.raises(ValueError):
+        index.query(rows, 0, 10, filters={'missing': [1]})
+    with pytest.raises(ValueError):
+        table_index.TableIndex(headers, sort_columns=['missing'])
+    with pytest.raises(ValueError):
+        table_index.TableIndex(headers).query(rows, 0, 10, search='x')
+
+
+def test_table_index_added_matches():
+    headers = ['name', 'score']
+
+    def added_matches(added, limit, **query):
+        index = table_index.TableIndex(headers, sort_columns=['score'], search_columns=['name'])
+        rows = [{'id': i + 1, 'data': data} for i, data in enumerate([['a x', 3], ['b', 1], ['c x', 2]])]
+        index.add(rows)
+        page = index.query(rows, 0, limit, **query)[0]
+        added = [{'id': len(rows) + i + 1, 'data': data} for i, data in enumerate(added)]
+        index.add(added)
+        return index.added_matches(added, page, limit, **query)
+    assert added_matches([['e', 5]], 1, search='x') == 0
+    assert added_matches([['e x', 5], ['f x', 0]], 1, search='x', sort='score') is None
+    assert added_matches([['e x', 5], ['f x', 6]], 1, search='x', sort='score') == 2
+    assert added_matches([['e x', 5]], 1, search='x', sort='score', order='descend') is None
+    assert added_matches([['e x', 5]], 10, search='x', sort='score') is None
+    assert added_matches([['e x', 5]], 1, search='x') == 1
+    assert added_matches([['e', 5]], 1, filters={'score': 5}) is None
+    assert added_matches([['e', 5]], 1, filters={'score': 3}) == 0
@@ -0,0 +1,421 @@
+import json
+import threading
+
+import pytest
+from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
+from autobahn.websocket.protocol import TrafficStats
+
+from awe import encoding, view, websocket
+
+
+class MockConnection(object):
+
+    def __init__(self):
+        self.messages = []
+
+    def dispatch(self, payloads, prepared=None, key=None):
+        self.messages.append(json.loads(payloads[encoding.JSON].decode('utf-8')))
+
+    @staticmethod
+    def coalesces():
+        return False
+
+
+def _server(**kwargs):
+    server = websocket.WebSocketServer(
+        message_handler=None,
+        encoder=encoding.Encoder(element_cls=view.Element, serializers=None),
+        host='127.0.0.1',
+        port=9000,
+        **kwargs
+    )
+    server.calls = []
+    server._call_from_thread = lambda fn, *args: server.calls.append((fn, args))
+    return server
+
+
+def _connection(server):
+    connection = server()
+    # normally initialized when the connection is made
+    connection.trafficStats = TrafficStats()
+    connection._perMessageCompress = None
+    connection.sent = []
+    connection.sendMessage = lambda payload, **_: connection.sent.append(json.loads(payload.decode('utf-8')))
+    server.open_connections[str(id(connection))] = connection
+    return connection
+
+
+def test_dispatch_without_flush_interval():
+    server = _server()
+    connection = MockConnection()
+    server.open_connections['c1'] = connection
+    server.dispatch_from_thread({'type': 'a1'}, None)
+    server.dispatch_from_thread({'type': 'a2'}, None)
+    # the server thread is only woken once for all actions queued until it flushes
+    assert server.calls == [(server.flush, ())]
+    server.flush()
+    assert connection.messages == [{'type': 'batch', 'actions': [{'type': 'a1'}, {'type': 'a2'}]}]
+    assert not server.pending
+    server.dispatch_from_thread({'type': 'a3'}, None)
+    assert server.calls[-1] == (server.flush, ())
+
+
+def test_dispatch_versions_are_ordered():
+    server = _server()
+    versions = iter(range(1, 1000))
+    lock = threading.Lock()
+
+    def next_version():
+        with lock:
+            return next(versions)
+
+    def dispatch():
+        for _ in range(100):
+            server.dispatch_from_thread({'type': 'a'}, None, next_version=next_version)
+    threads = [threading.Thread(target=dispatch) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [version for _, _, version, _ in server.pending] == list(range(1, 501))
+    assert len(server.calls) == 1
+
+
+def test_flush_batches_actions():
+    server = _server(flush_interval=0.05)
+    c1, c2 = MockConnection(), MockConnection()
+    server.open_connections.update({'c1': c1, 'c2': c2})
+    server.dispatch_from_thread({'type': 'a1'}, None)
+    server.dispatch_from_thread({'type': 'a2'}, 'c1')
+    server.dispatch_from_thread({'type': 'a3'}, None)
+    # flush is only scheduled once per window
+    assert server.calls == [(server._call_later, (0.05, server.flush))]
+    server.flush()
+    assert c1.messages == [{'type': 'batch', 'actions': [{'type': 'a1'}, {'type': 'a2'}, {'type': 'a3'}]}]
+    assert c2.messages == [{'type': 'batch', 'actions': [{'type': 'a1'}, {'type': 'a3'}]}]
+    assert not server.pending
+    assert not server.flush_scheduled
+
+    server.dispatch_from_thread({'type': 'a4'}, None)
+    assert len(server.calls) == 2
+    server.flush()
+    assert c1.messages[-1] == {'type': 'a4'}
+    assert c2.messages[-1] == {'type': 'a4'}
+    server.flush()
+    assert len(c1.messages) == 2
+
+
+def test_flush_waits_for_actions_being_encoded():
+    server = _server()
+    connection = MockConnection()
+    server.open_connections['c1'] = connection
+    started, release = threading.Event(), threading.Event()
+    encode = server.encode
+
+    def slow_encode(action, formats=None):
+        if action['type'] == 'large':
+            started.set()
+            release.wait()
+        return encode(action, formats)
+    server.encode = slow_encode
+    thread = threading.Thread(target=server.dispatch_from_thread, args=({'type': 'large'}, None, lambda: 1))
+    thread.start()
+    started.wait()
+    # other threads queue actions while an action is encoded
+    server.dispatch_from_thread({'type': 'small'}, None, lambda: 2)
+    server.flush()
+    assert connection.messages == []
+    assert server.calls == [(server.flush, ())]
+    release.set()
+    thread.join()
+    assert len(server.calls) == 2
+    server.flush()
+    assert connection.messages == [
+        {'type': 'batch', 'actions': [{'type': 'large', 'version': 1}, {'type': 'small', 'version': 2}]}
+    ]
+    assert not server.pending
+
+
+def _update(element_id, path, action='set', data=None):
+    return {
+        'type': 'updatePath',
+        'id': element_id,
+        'rootId': 'root',
+        'updateData': {'path': path, 'action': action, 'data': data}
+    }
+
+
+def test_flush_coalesces_sets():
+    server = _server(flush_interval=0.05)
+    connection = MockConnection()
+    server.open_connections['c1'] = connection
+    for i in range(10):
+        server.dispatch_from_thread(_update('e1', ['data'], data=i), None)
+        server.dispatch_from_thread(_update('e2', ['props', 'a'], data=i), None)
+    server.dispatch_from_thread(_update('e2', ['props', 'b'], data=0), None)
+    server.dispatch_from_thread({'type': 'displayError'}, 'c1')
+    server.flush()
+    assert connection.messages == [{'type': 'batch', 'actions': [
+        _update('e1', ['data'], data=9),
+        _update('e2', ['props', 'a'], data=9),
+        _update('e2', ['props', 'b'], data=0),
+        {'type': 'displayError'}
+    ]}]
+
+
+def test_flush_keeps_order_sensitive_actions():
+    server = _server(flush_interval=0.05)
+    connection = MockConnection()
+    server.open_connections['c1'] = connection
+    actions = [
+        _update('e1', ['data'], data=1),
+        _update('e1', ['data', 'rows'], action='append', data=1),
+        _update('e1', ['data'], data=2),
+        _update('e2', ['data'], data=1),
+        {'type': 'newElement', 'id': 'e3'},
+        _update('e2', ['data'], data=2),
+        _update('e1', ['data'], data=3),
+        _update('e2', ['data'], data=3),
+    ]
+    for action in actions:
+        server.dispatch_from_thread(action, None)
+    server.flush()
+    assert connection.messages == [{'type': 'batch', 'actions': actions[:5] + actions[6:]}]
+
+
+@pytest.mark.skipif(not encoding.msgpack, reason='msgpack is not installed')
+def test_msgpack_batch():
+    server = _server(flush_interval=0.05)
+    server.formats = [encoding.MSGPACK, encoding.JSON]
+    actions = [{'type': 'a1', 'data': [1, 2.5, 'three']}, {'type': 'a2', 'data': None}]
+    for action in actions:
+        server.dispatch_from_thread(action, None)
+    payloads = server.batch([payloads for payloads, _, _, _ in server.pending])
+    expected = {'type': 'batch', 'actions': actions}
+    assert server.encoder.from_msgpack(payloads[encoding.MSGPACK]) == expected
+    assert server.encoder.from_json(payloads[encoding.JSON]) == expected
+
+    # payloads encoded while formats changed are transcoded to json
+    mixed = [{encoding.MSGPACK: server.encoder.to_msgpack(actions[0])}, {encoding.JSON: b'{"type":"a2"}'}]
+    assert server.encoder.from_json(server.batch(mixed)[encoding.JSON]) == {
+        'type': 'batch', 'actions': [actions[0], {'type': 'a2'}]
+    }
+
+
+def test_broadcast_prepares_message_once():
+    server = _server()
+    server.prepared = []
+    original_prepare_message = server.prepareMessage
+
+    def prepare_message(payload, **kwargs):
+        server.prepared.append(payload)
+        return original_prepare_message(payload, **kwargs)
+    server.prepareMessage = prepare_message
+    connections = {}
+    for i in range(5):
+        connection = _connection(server)
+        connection.sendPreparedMessage = connection.sent.append
+        connection.sendMessage = lambda *_, **__: pytest.fail('message should have been prepared')
+        connections[str(id(connection))] = connection
+    server.dispatch(server.encode({'type': 'a1'}))
+    assert server.prepared == [b'{"type":"a1"}']
+    sent = [c.sent for c in connections.values()]
+    assert all(len(s) == 1 and s[0] is sent[0][0] for s in sent)
+
+    # a single connection is sent the message directly
+    client_id, connection = next(iter(connections.items()))
+    connection.sendMessage = lambda payload, **_: connection.sent.append(payload)
+    server.dispatch(server.encode({'type': 'a2'}), client_id=client_id)
+    assert connection.sent[-1] == b'{"type":"a2"}'
+    # messages to closed connections are ignored
+    server.dispatch(server.encode({'type': 'a3'}), client_id='closed')
+    assert len(server.prepared) == 1
+    assert connection.get_stats() == {
+        'outgoing_messages': 2,
+        'outgoing_octets': 26,
+        'outgoing_compressed_octets': 26,
+        'dropped_messages': 0,
+        'resyncs': 0,
+        'message_format': encoding.JSON,
+        'compression': False,
+        'compression_ratio': 1.0,
+        'queue_depth': 0,
+        'paused': False
+    }
+    assert set(server.get_stats()) == set(connections)
+
+
+def test_compression_options():
+    server = _server()
+    assert not server.compression
+    assert server.compression_threshold == 0
+
+    server = _server(compression={'window_bits': 12})
+    assert server.compression == {'window_bits': 12, 'mem_level': 8, 'threshold': 1024}
+    assert server.compression_threshold == 1024
+    accept = server.accept_compression([PerMessageDeflateOffer()])
+    assert isinstance(accept, PerMessageDeflateOfferAccept)
+    assert accept.window_bits == 12
+    assert accept.mem_level == 8
+    accept = server.accept_compression([PerMessageDeflateOffer(True, True, False, 10)])
+    assert accept.window_bits == 10
+    # autobahn only accepts window sizes from 9 to 15
+    server = _server(compression={'window_bits': 8})
+    assert server.accept_compression([PerMessageDeflateOffer()]).window_bits == 9
+    assert server.accept_compression([]) is None
+
+
+def _dispatch(server, action):
+    server.dispatch(server.encode(action), key=websocket.coalesce_key(action))
+
+
+def test_paused_connection_queue():
+    server = _server()
+    connection = _connection(server)
+    connection.pause_writing()
+    for i in range(3):
+        _dispatch(server, _update('e1', ['data'], data=i))
+    assert not connection.sent
+    assert connection.get_stats()['queue_depth'] == 3
+    assert connection.get_stats()['paused']
+    connection.resume_writing()
+    assert connection.sent == [_update('e1', ['data'], data=i) for i in range(3)]
+    assert connection.get_stats()['queue_depth'] == 0
+    _dispatch(server, {'type': 'a1'})
+    assert connection.sent[-1] == {'type': 'a1'}
+
+
+def test_slow_consumer_resync():
+    server = _server(send_queue_size=3, slow_consumer_policy=websocket.RESYNC)
+    connection = _connection(server)
+    connection.pause_writing()
+    for i in range(5):
+        _dispatch(server, {'type': 'a{}'.format(i)})
+    assert connection.get_stats()['queue_depth'] == 3
+    assert connection.get_stats()['resyncs'] == 1
+    connection.resume_writing()
+    assert connection.sent == [{'type': 'resync'}, {'type': 'a3'}, {'type': 'a4'}]
+
+
+def test_slow_consumer_drop():
+    server = _server(send_queue_size=3, slow_consumer_policy=websocket.DROP)
+    connection = _connection(server)
+    connection.pause_writing()
+
+    def flush(*actions):
+        for action in actions:
+            server.dispatch_from_thread(action, None)
+        server.flush()
+    for i in range(10):
+        flush(_update('e1', ['data'], data=i), _update('e2', ['data'], data=i))
+    flush(_update('e1', ['data', 'rows'], action='append', data=1))
+    assert connection.get_stats()['queue_depth'] == 3
+    assert connection.get_stats()['dropped_messages'] == 18
+    assert connection.get_stats()['resyncs'] == 0
+    # superseded sets can't be dropped after an order sensitive update
+    flush(_update('e1', ['data'], data=10))
+    assert connection.get_stats()['resyncs'] == 1
+    connection.resume_writing()
+    assert connection.sent == [{'type': 'resync'}, _update('e1', ['data'], data=10)]
+
+    # flushes are sent as a single batch to connections that keep up
+    flush(_update('e1', ['data'], data=11), _update('e2', ['data'], data=11))
+    assert connection.sent[-1] == {'type': 'batch', 'actions': [_update(e, ['data'], data=11) for e in ['e1', 'e2']]}
+
+
+def test_slow_consumer_block():
+    server = _server(send_queue_size=2, slow_consumer_policy=websocket.BLOCK)
+    connection = _connection(server)
+    connection.pause_writing()
+    _dispatch(server, {'type': 'a1'})
+    assert server.writable.is_set()
+    _dispatch(server, {'type': 'a2'})
+    assert not server.writable.is_set()
+    connection.resume_writing()
+    assert server.writable.is_set()
+    connection.pause_writing()
+    _dispatch(server, {'type': 'a3'})
+    _dispatch(server, {'type': 'a4'})
+    assert not server.writable.is_set()
+    connection.on_close()
+    assert server.writable.is_set()
+
+
+def test_close_notifies_message_handler():
+    closed = []
+
+    class MessageHandler(object):
+        client_closed = staticmethod(closed.append)
+    server = _server()
+    server.message_handler = MessageHandler()
+    connection = _connection(server)
+    connection.on_close()
+    connection.on_close()
+    assert closed == [str(id(connection))]
+
+
+def test_action_log():
+    action_log = websocket.ActionLog(3)
+    assert action_log.since(0) == []
+    for version in range(1, 6):
+        action_log.append(version, version)
+    action_log.append(None, 'targeted')
+    assert action_log.since(5) == []
+    assert action_log.since(3) == [4, 5]
+    assert action_log.since(2) == [3, 4, 5]
+    assert action_log.since(1) is None
+
+    action_log = websocket.ActionLog(0)
+    action_log.append(1, 1)
+    assert action_log.since(1) == []
+    assert action_log.since(0) is None
+
+    # versions after the last logged one come from another page instance
+    assert action_log.since(2) is None
+    action_log = websocket.ActionLog(3)
+    action_log.start(10)
+    assert action_log.since(10) == []
+    assert action_log.since(9) is None
+    assert action_log.since(11) is None
+
+
+def test_resume_sends_missed_actions():
+    server = _server(action_log_size=2)
+    c1 = _connection(server)
+    for i in range(1, 4):
+        server.dispatch(server.encode({'type': 'a{}'.format(i)}), version=i)
+    server.dispatch(server.encode({'type': 'targeted'}), client_id=str(id(c1)), version=4)
+    assert len(c1.sent) == 4
+
+    c2 = _connection(server)
+    c2.resume(2)
+    assert c2.sent == [{'type': 'a3'}]
+    c2.resume(1)
+    assert c2.sent[-1] == {'type': 'batch', 'actions': [{'type': 'a2'}, {'type': 'a3'}]}
+    c2.resume(0)
+    assert c2.sent[-1] == {'type': 'resync'}
+    assert c2.get_stats()['resyncs'] == 1
+    sent = len(c2.sent)
+    c2.resume(3)
+    assert len(c2.sent) == sent
+
+    # clients of a restarted server resync, even with a known version
+    server.instance_token = 'token'
+    c3 = _connection(server)
+    c3.resume(2, 'token')
+    assert c3.sent == [{'type': 'a3'}]
+    c3.resume(2, 'other')
+    assert c3.sent[-1] == {'type': 'resync'}
+
+
+def test_flush_logs_broadcast_actions():
+    server = _server(flush_interval=0.05)
+    server.open_connections['c1'] = MockConnection()
+    server.dispatch_from_thread({'type': 'a1', 'version': 1}, None)
+    server.dispatch_from_thread({'type': 'a2', 'version': 2}, 'c1')
+    server.dispatch_from_thread({'type': 'a3', 'version': 3}, None)
+    server.flush()
+    assert [json.loads(p[encoding.JSON].decode('utf-8')) for p in server.action_log.since(0)] == [
+        {'type': 'a1', 'version': 1},
+        {'type': 'a3', 'version': 3}
+    ]
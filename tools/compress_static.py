@@ -0,0 +1,11 @@
+import os
+
+from awe import static
+
+
+def main():
+    static.compress_directory(os.path.join('awe', 'resources', 'client', 'awe', 'build'))
+
+
+if __name__ == '__main__':
+    main()